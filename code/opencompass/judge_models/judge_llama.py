@@ -1,13 +1,17 @@
 import re
-import time
+from typing import Dict, Optional
 
 import requests
 
+from opencompass.utils.retry import RetryError, RetryPolicy
+
 
 class JudgeLlama:
     def __init__(self, base_url="http://10.55.56.14:31225/v1/chat/completions", model="llama3.3-70B-Instruct",
-                 retries=1):
+                 retries=1, retry_policy: Optional[Dict] = None):
         self.retries = retries
+        # retries=0 still makes the one attempt
+        self.retry_policy = RetryPolicy(**{'max_attempts': max(1, retries), **(retry_policy or {})})
         self.base_url = base_url
         self.model = model
         self.timeout = 15 * 60
@@ -34,53 +38,52 @@ class JudgeLlama:
             "temperature": self.temperature,
             "messages": messages
         }
-        for attempt in range(self.retries):
-            try:
-                if stream:
-                    with requests.post(self.base_url, headers=self.headers, json=payload, timeout=self.timeout,
-                                       stream=True) as response:
-                        # response.raise_for_status()
-                        content = r""
-                        for line in response.iter_lines():
-                            print(content)
-                            result = str(line, encoding='utf-8')
-                            print(result)
-                            if "[DONE]" in result or len(result) == 0:
-                                continue
-                            elif '"finish_reason":"stop"' in result:
-                                break
-                            elif '"object":"error"' in result:
+        try:
+            return self.retry_policy.run(self._request, payload, stream, message, key=self.base_url)
+        except RetryError as e:
+            print(f"Judge request failed: {e}")
+            return "LLM ERROR"
+
+    def _request(self, payload, stream, message):
+        if stream:
+            with requests.post(self.base_url, headers=self.headers, json=payload, timeout=self.timeout,
+                               stream=True) as response:
+                # response.raise_for_status()
+                content = r""
+                for line in response.iter_lines():
+                    print(content)
+                    result = str(line, encoding='utf-8')
+                    print(result)
+                    if "[DONE]" in result or len(result) == 0:
+                        continue
+                    elif '"finish_reason":"stop"' in result:
+                        break
+                    elif '"object":"error"' in result:
+                        print(result)
+                        break
+                    else:
+                        try:
+                            if 'content' in result:
+                                result = re.search(r'"content":"(.*?)"', result).group(1)
+                                # result = result.replace("\\", "\n")
                                 print(result)
-                                break
+                                content += result
                             else:
-                                try:
-                                    if 'content' in result:
-                                        result = re.search(r'"content":"(.*?)"', result).group(1)
-                                        # result = result.replace("\\", "\n")
-                                        print(result)
-                                        content += result
-                                    else:
-                                        content += ""
-                                except Exception as e:
-                                    print(e)
-                                    continue
-                        return eval('f"' + content + '"')
-                else:
-                    response = requests.post(self.base_url, headers=self.headers, json=payload, timeout=self.timeout)
-                    print(response.text)
-                    response_data = response.json()
-                    print(f"Response data: {response_data}")
-                    print(response_data['choices'][-1])
-                    print(f"prompt:{message}")
-                    content = response_data['choices'][-1]['message']['content'].encode('utf-8').decode('utf-8')
-                    print(f"content:{content}")
-                    return content
-            except Exception as e:
-                print(f"Attempt {attempt + 1} failed: {e}")
-                if attempt < self.retries - 1:
-                    time.sleep(2 ** attempt)  # Exponential backoff
-                else:
-                    return "LLM ERROR"
+                                content += ""
+                        except Exception as e:
+                            print(e)
+                            continue
+                return eval('f"' + content + '"')
+        else:
+            response = requests.post(self.base_url, headers=self.headers, json=payload, timeout=self.timeout)
+            print(response.text)
+            response_data = response.json()
+            print(f"Response data: {response_data}")
+            print(response_data['choices'][-1])
+            print(f"prompt:{message}")
+            content = response_data['choices'][-1]['message']['content'].encode('utf-8').decode('utf-8')
+            print(f"content:{content}")
+            return content
 
     def predict(self, input_text, **kwargs):
         # print(f"input_text:{input_text}  kwargs:{kwargs}")
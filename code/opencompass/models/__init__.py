@@ -4,7 +4,7 @@ from .huggingface import HuggingFace  # noqa: F401, F403
 from .huggingface import HuggingFaceCausalLM  # noqa: F401, F403
 from .huggingface import HuggingFaceChatGLM3  # noqa: F401, F403
 from .lightllm_api import LightllmAPI  # noqa: F401
-from .GeneralApi import GeneralApi  # noqa: F401
+from .general_api import BaseGeneralApi  # noqa: F401
 from .qwen3_api import Qwen3API  # noqa: F401
 from .qwen35_api import Qwen35API  # noqa: F401
 from .non_reasoning_api import NonReasoningAPI  # noqa: F401
@@ -88,6 +88,18 @@ class BaseModel:
             int: Length of the input tokens
         """
 
+    def get_token_len_batch(self, prompts: List[str]) -> List[int]:
+        """Get lengths of a list of tokenized strings. Models able to
+        tokenize in batches are encouraged to override it.
+
+        Args:
+            prompts (List[str]): Input strings.
+
+        Returns:
+            List[int]: Lengths of the input tokens.
+        """
+        return [self.get_token_len(prompt) for prompt in prompts]
+
     def parse_template(self, prompt_template: PromptType, mode: str) -> str:
         """Parse a prompt template, and wrap it with meta template if
         applicable.
@@ -162,7 +174,7 @@ class BaseModel:
         if not is_batched:
             prompts = [prompts]
         prompts = [str(prompt) for prompt in prompts]
-        token_lens = [self.get_token_len(prompt) for prompt in prompts]
+        token_lens = self.get_token_len_batch(prompts)
         return token_lens[0] if not is_batched else token_lens
 
     def to(self, device):
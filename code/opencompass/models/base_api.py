@@ -1,18 +1,28 @@
-import re
+import asyncio
 import sys
 import threading
 import time
 import warnings
 from abc import abstractmethod
+from collections import deque
 from copy import deepcopy
-from queue import Queue
 from time import sleep
 from typing import Dict, List, Optional, Tuple, Union
 
 from opencompass.utils import get_logger
+from opencompass.utils.coordinator import (CoordinatorClient,
+                                           CoordinatorUnavailable,
+                                           get_coordinator)
 from opencompass.utils.prompt import PromptList
+from opencompass.utils.retry import (RetryPolicy, get_retry_after,
+                                     get_status_code)
+from opencompass.utils.tracing import RequestTracer
 
 from .base import BaseModel
+from .hedging import RequestCancelled
+from .response_cache import ResponseCache
+from .single_flight import SingleFlight
+from .tokenizer_service import TokenizerService
 
 PromptType = Union[PromptList, str]
 
@@ -22,9 +32,12 @@ class BaseAPIModel(BaseModel):
 
     Args:
         path (str): The path to the model.
-        query_per_second (int): The maximum queries allowed per second
-            between two consecutive calls of the API. Defaults to 1.
+        query_per_second (float): The maximum queries allowed per second
+            between two consecutive calls of the API. None or 0 disables the
+            limit. Defaults to 1.
+        rpm_verbose (bool): Whether to log the current RPM. Defaults to False.
         retry (int): Number of retires if the API call fails. Defaults to 2.
+            It is the default ``max_attempts`` of ``retry_policy``.
         max_seq_len (int): The maximum sequence length of the model. Defaults
             to 2048.
         meta_template (Dict, optional): The model's meta prompt
@@ -32,6 +45,37 @@ class BaseAPIModel(BaseModel):
             wrapping of any meta instructions.
         generation_kwargs (Dict, optional): The generation kwargs for the
             model. Defaults to dict().
+        adaptive_concurrency (Dict, optional): Keyword arguments of
+            :obj:`AdaptiveConcurrencyController`. If set, the number of
+            requests in flight is tuned at runtime instead of being fixed.
+            Defaults to None.
+        burst (int, optional): Number of queries that may be sent back to back
+            after an idle period. Defaults to ``max(1, query_per_second)``.
+        tokens_per_minute (int, optional): Budget of estimated prompt plus
+            completion tokens per minute, for gateways with TPM quotas.
+            Defaults to None.
+        response_cache (Dict, optional): Keyword arguments of
+            :obj:`ResponseCache`. If set, responses are cached on disk and
+            served without touching the network on reruns. Defaults to None.
+        trace (Dict, optional): Keyword arguments of :obj:`RequestTracer`.
+            If set, every request is traced to a JSON-lines file, per dataset
+            under ``{work_dir}/logs/trace`` unless ``path`` is given.
+            Defaults to None.
+        retry_policy (Dict, optional): Keyword arguments of
+            :obj:`RetryPolicy`, e.g. a per-sample ``deadline``, a
+            ``retry_budget`` or a ``circuit_breaker``. Defaults to None.
+        coalesce (bool): Whether identical requests in flight at the same
+            time share one call, see :obj:`SingleFlight`. Only sound when the
+            generation is deterministic, e.g. ``temperature=0``. Defaults to
+            False.
+        rate_limit_key (str, optional): Key under which the limits are
+            shared with the other task processes of the run when a
+            coordinator is available, see :obj:`CoordinatorServer`. Models
+            with the same key share one budget. Defaults to ``path``.
+        tokenizer_service (Dict, optional): Keyword arguments of
+            :obj:`TokenizerService`, which counts prompt tokens for
+            ``get_token_len``, e.g. ``dict(backend='tiktoken',
+            name='gpt-4')``. Defaults to the cached heuristic count.
     """
 
     is_api: bool = True
@@ -43,16 +87,57 @@ class BaseAPIModel(BaseModel):
                  retry: int = 2,
                  max_seq_len: int = 2048,
                  meta_template: Optional[Dict] = None,
-                 generation_kwargs: Dict = dict()):
+                 generation_kwargs: Dict = dict(),
+                 adaptive_concurrency: Optional[Dict] = None,
+                 burst: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None,
+                 response_cache: Optional[Dict] = None,
+                 trace: Optional[Dict] = None,
+                 retry_policy: Optional[Dict] = None,
+                 coalesce: bool = False,
+                 rate_limit_key: Optional[str] = None,
+                 tokenizer_service: Optional[Dict] = None):
         self.path = path
         self.max_seq_len = max_seq_len
         self.meta_template = meta_template
         self.retry = retry
         self.query_per_second = query_per_second
-        self.token_bucket = TokenBucket(query_per_second, rpm_verbose)
+        # the runner's coordinator, if any, enforces the limits across all
+        # the task processes instead of per process
+        self.coordinator = get_coordinator()
+        self.rate_limit_key = rate_limit_key or path
+        if self.coordinator is not None:
+            self.rate_limiter = SharedRateLimiter(
+                self.coordinator,
+                self.rate_limit_key,
+                query_per_second,
+                rpm_verbose,
+                burst=burst,
+                tokens_per_minute=tokens_per_minute)
+        else:
+            self.rate_limiter = RateLimiter(
+                query_per_second,
+                rpm_verbose,
+                burst=burst,
+                tokens_per_minute=tokens_per_minute)
         self.template_parser = APITemplateParser(meta_template)
         self.logger = get_logger()
         self.generation_kwargs = generation_kwargs
+        self.concurrency_controller = None
+        if adaptive_concurrency is not None:
+            self.concurrency_controller = AdaptiveConcurrencyController(
+                **adaptive_concurrency)
+        self.response_cache = None
+        if response_cache is not None:
+            self.response_cache = ResponseCache(**response_cache)
+        self.retry_policy = RetryPolicy(
+            **{'max_attempts': max(1, retry), **(retry_policy or {})})
+        self.trace_cfg = trace
+        self.tracer = None
+        if trace is not None and trace.get('path'):
+            self.tracer = RequestTracer(**trace)
+        self.single_flight = SingleFlight() if coalesce else None
+        self.tokenizer_service = TokenizerService(**(tokenizer_service or {}))
 
     @abstractmethod
     def generate(self, inputs: List[PromptType],
@@ -126,9 +211,9 @@ class BaseAPIModel(BaseModel):
                                   'instead.')
 
     def get_token_len(self, prompt: str) -> int:
-        """Get lengths of the tokenized string. Only English and Chinese
-        characters are counted for now. Users are encouraged to override this
-        method if more accurate length is needed.
+        """Get lengths of the tokenized string. Unless ``tokenizer_service``
+        names a real tokenizer, only English words and Chinese characters are
+        counted.
 
         Args:
             prompt (str): Input string.
@@ -136,24 +221,59 @@ class BaseAPIModel(BaseModel):
         Returns:
             int: Length of the input tokens
         """
+        return self.tokenizer_service.count(prompt)
 
-        english_parts = re.findall(r'[A-Za-z0-9]+', prompt)
-        chinese_parts = re.findall(r'[\u4e00-\u9FFF]+', prompt)
-
-        # Count English words
-        english_count = sum(len(part.split()) for part in english_parts)
-
-        # Count Chinese words
-        chinese_count = sum(len(part) for part in chinese_parts)
+    def get_token_len_batch(self, prompts: List[str]) -> List[int]:
+        if type(self).get_token_len is not BaseAPIModel.get_token_len:
+            # respect a subclass counting its own way
+            return super().get_token_len_batch(prompts)
+        return self.tokenizer_service.count_batch(prompts)
 
-        return english_count + chinese_count
-
-    def wait(self):
+    def wait(self, num_tokens: int = 0):
         """Wait till the next query can be sent.
 
         Applicable in both single-thread and multi-thread environments.
+
+        Args:
+            num_tokens (int): Estimated prompt plus completion tokens of the
+                query, charged to the tokens-per-minute budget if any.
         """
-        return self.token_bucket.get_token()
+        return self.rate_limiter.acquire(num_tokens)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """Runtime statistics of the request machinery, grouped by
+        component. Subclasses extend the dict with their own components."""
+        stats = {}
+        if self.concurrency_controller is not None:
+            stats['concurrency'] = self.concurrency_controller.stats()
+        if self.response_cache is not None:
+            stats['response_cache'] = self.response_cache.stats()
+        if self.retry_policy.counters['retries'] or \
+                self.retry_policy.counters['failures']:
+            stats['retry'] = self.retry_policy.stats()
+        if self.single_flight is not None and \
+                self.single_flight.counters['coalesced']:
+            stats['coalescing'] = self.single_flight.stats()
+        if self.coordinator is not None:
+            stats['coordinator'] = self.coordinator.stats()
+        if self.tokenizer_service.counters['misses']:
+            stats['tokenizer'] = self.tokenizer_service.stats()
+        return stats
+
+    def start_tracing(self, path: str):
+        """Trace the following requests to ``path``. Does nothing unless
+        ``trace`` is configured without an explicit path."""
+        if self.trace_cfg is None or self.trace_cfg.get('path'):
+            return
+        self.stop_tracing()
+        self.tracer = RequestTracer(path, **self.trace_cfg)
+
+    def stop_tracing(self):
+        """Flush and close the per-dataset tracer started by
+        :meth:`start_tracing`."""
+        if self.tracer is not None and not self.trace_cfg.get('path'):
+            self.tracer.close()
+            self.tracer = None
 
     def to(self, device):
         pass
@@ -418,40 +538,339 @@ class APITemplateParser:
         return res, True
 
 
-class TokenBucket:
-    """A token bucket for rate limiting.
+class RateLimiter:
+    """A thread-free token bucket for rate limiting.
+
+    Buckets are refilled lazily from the monotonic clock whenever a request
+    asks for a token, so no background thread is needed and fractional rates
+    such as one request every two seconds are exact.
 
     Args:
-        query_per_second (float): The rate of the token bucket.
+        rate (float, optional): Allowed requests per second. None or a
+            non-positive value disables the request limit.
+        verbose (bool): Whether to log the current RPM on every request.
+            Defaults to False.
+        burst (int, optional): Number of requests that may be sent back to
+            back after an idle period. Defaults to ``max(1, int(rate))``.
+        tokens_per_minute (int, optional): Budget of prompt plus completion
+            tokens per minute. Defaults to None (no budget).
     """
 
-    def __init__(self, rate, verbose=False):
-        self._rate = rate
-        self._tokens = threading.Semaphore(0)
-        self.started = False
-        self._request_queue = Queue()
+    def __init__(self,
+                 rate: Optional[float],
+                 verbose: bool = False,
+                 burst: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None):
+        self.rate = rate if rate and rate > 0 else None
+        self.burst = burst or max(1, int(self.rate or 1))
+        self.tokens_per_minute = tokens_per_minute or None
+        self._requests = float(self.burst)
+        self._tokens = float(self.tokens_per_minute or 0)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self._request_times = deque()
         self.logger = get_logger()
         self.verbose = verbose
 
-    def _add_tokens(self):
-        """Add tokens to the bucket."""
+    @property
+    def enabled(self) -> bool:
+        return self.rate is not None or self.tokens_per_minute is not None
+
+    def _refill(self, now: float):
+        elapsed = now - self._last
+        self._last = now
+        if self.rate is not None:
+            self._requests = min(self.burst,
+                                 self._requests + elapsed * self.rate)
+        if self.tokens_per_minute is not None:
+            self._tokens = min(
+                self.tokens_per_minute,
+                self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def try_acquire(self, num_tokens: int = 0) -> float:
+        """Take a request token and ``num_tokens`` budget tokens if both are
+        available.
+
+        Returns:
+            float: 0 on success, otherwise the seconds to wait before trying
+            again.
+        """
+        if not self.enabled:
+            return 0.
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            delay = 0.
+            if self.rate is not None and self._requests < 1:
+                delay = (1 - self._requests) / self.rate
+            if self.tokens_per_minute is not None:
+                # a single oversized request must still pass eventually
+                cost = min(num_tokens, self.tokens_per_minute)
+                if self._tokens < cost:
+                    delay = max(delay, (cost - self._tokens) * 60 /
+                                self.tokens_per_minute)
+            if delay > 0:
+                return delay
+            if self.rate is not None:
+                self._requests -= 1
+            if self.tokens_per_minute is not None:
+                self._tokens -= cost
+            if self.verbose:
+                self._log_rpm(now)
+            return 0.
+
+    def _log_rpm(self, now: float):
+        self._request_times.append(now)
+        while now - self._request_times[0] > 60:
+            self._request_times.popleft()
+        self.logger.info(f'Current RPM {len(self._request_times)}.')
+
+    def acquire(self, num_tokens: int = 0):
+        """Block until the request is allowed."""
         while True:
-            if self._tokens._value < self._rate:
-                self._tokens.release()
-            sleep(1 / self._rate)
-
-    def get_token(self):
-        """Get a token from the bucket."""
-        if not self.started:
-            self.started = True
-            threading.Thread(target=self._add_tokens, daemon=True).start()
-        self._tokens.acquire()
-        if self.verbose:
-            cur_time = time.time()
-            while not self._request_queue.empty():
-                if cur_time - self._request_queue.queue[0] > 60:
-                    self._request_queue.get()
-                else:
-                    break
-            self._request_queue.put(cur_time)
-            self.logger.info(f'Current RPM {self._request_queue.qsize()}.')
+            delay = self.try_acquire(num_tokens)
+            if delay <= 0:
+                return
+            sleep(delay)
+
+    async def acquire_async(self, num_tokens: int = 0):
+        """Asyncio counterpart of `acquire`."""
+        while True:
+            delay = self.try_acquire(num_tokens)
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+
+class SharedRateLimiter(RateLimiter):
+    """A :obj:`RateLimiter` whose buckets live in a coordinator, so that the
+    rate and token budgets hold across every process using ``key``. While
+    the coordinator is unavailable the local buckets of the process apply.
+
+    Args:
+        client (CoordinatorClient): Client of the coordinator.
+        key (str): Key of the shared budget.
+        rate, verbose, burst, tokens_per_minute: See :obj:`RateLimiter`.
+    """
+
+    def __init__(self,
+                 client: CoordinatorClient,
+                 key: str,
+                 rate: Optional[float],
+                 verbose: bool = False,
+                 burst: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None):
+        super().__init__(rate,
+                         verbose,
+                         burst=burst,
+                         tokens_per_minute=tokens_per_minute)
+        self.client = client
+        self.key = key
+        if self.enabled:
+            client.register(key,
+                            qps=self.rate,
+                            burst=self.burst if self.rate else None,
+                            tokens_per_minute=self.tokens_per_minute)
+
+    def try_acquire(self, num_tokens: int = 0) -> float:
+        if not self.enabled:
+            return 0.
+        try:
+            delay = self.client.try_acquire(self.key, num_tokens)
+        except CoordinatorUnavailable:
+            return super().try_acquire(num_tokens)
+        if delay <= 0 and self.verbose:
+            with self._lock:
+                self._log_rpm(time.monotonic())
+        return delay
+
+    async def acquire_async(self, num_tokens: int = 0):
+        """Asyncio counterpart of `acquire`, the round trips to the
+        coordinator run off the event loop."""
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = await loop.run_in_executor(None, self.try_acquire,
+                                               num_tokens)
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+
+def is_congestion_error(error: BaseException) -> bool:
+    """Whether an error signals an overloaded backend, i.e. HTTP 429/503 or
+    a timeout."""
+    if get_status_code(error) in (429, 503):
+        return True
+    return isinstance(error, TimeoutError) or 'Timeout' in type(error).__name__
+
+
+class AdaptiveConcurrencyController:
+    """Additive-increase/multiplicative-decrease controller of the number of
+    requests in flight.
+
+    Every healthy response grows the window by ``increase / window`` (about
+    ``increase`` per full window of responses). A congestion signal (HTTP
+    429/503, a timeout, or a response slower than ``latency_threshold``
+    seconds) multiplies the window by ``decrease``, at most once per
+    ``cooldown`` seconds. A ``Retry-After`` header pauses all new requests
+    until the requested time.
+
+    Args:
+        initial_window (int): Window at start. Defaults to 4.
+        min_window (int): Lower bound of the window. Defaults to 1.
+        max_window (int): Upper bound of the window. Defaults to 64.
+        increase (float): Additive step per window. Defaults to 1.
+        decrease (float): Multiplicative factor on congestion. Defaults to
+            0.5.
+        latency_threshold (float, optional): Responses slower than this are
+            treated as congestion. Defaults to None.
+        error_threshold (float): The window only grows while the error rate
+            of the last ``history`` requests is below this. Defaults to 0.1.
+        history (int): Number of recent requests used for the error rate.
+            Defaults to 50.
+        cooldown (float): Minimal seconds between two decreases. Defaults to
+            1.
+    """
+
+    def __init__(self,
+                 initial_window: int = 4,
+                 min_window: int = 1,
+                 max_window: int = 64,
+                 increase: float = 1.,
+                 decrease: float = 0.5,
+                 latency_threshold: Optional[float] = None,
+                 error_threshold: float = 0.1,
+                 history: int = 50,
+                 cooldown: float = 1.):
+        assert 1 <= min_window <= max_window
+        assert 0 < decrease < 1
+        self.min_window = min_window
+        self.max_window = max_window
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_threshold = latency_threshold
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.window = float(min(max(initial_window, min_window), max_window))
+        self.in_flight = 0
+        self.blocked_until = 0.
+        self._last_decrease = 0.
+        self._recent_errors = deque(maxlen=history)
+        self._cond = threading.Condition()
+        self.logger = get_logger()
+        self.counters = dict(requests=0, errors=0, congestion=0,
+                             retry_after=0, latency_sum=0.)
+
+    def _wait_time(self) -> float:
+        """Seconds to wait before a slot can be granted, 0 if one is free
+        now and None if the window is full."""
+        delay = self.blocked_until - time.monotonic()
+        if delay > 0:
+            return delay
+        return 0. if self.in_flight < int(self.window) else None
+
+    def try_acquire(self) -> Tuple[bool, Optional[float]]:
+        """Take a slot without blocking.
+
+        Returns:
+            Tuple[bool, Optional[float]]: Whether a slot was taken, and
+            otherwise the seconds until a retry makes sense (None means
+            until a running request finishes).
+        """
+        with self._cond:
+            delay = self._wait_time()
+            if delay == 0.:
+                self.in_flight += 1
+                return True, None
+            return False, delay
+
+    def acquire(self):
+        """Block until a slot in the window is free."""
+        with self._cond:
+            while True:
+                delay = self._wait_time()
+                if delay == 0.:
+                    self.in_flight += 1
+                    return
+                self._cond.wait(delay)
+
+    def release(self,
+                latency: Optional[float] = None,
+                error: Optional[BaseException] = None):
+        """Give a slot back and feed the outcome of the request."""
+        with self._cond:
+            self.in_flight -= 1
+            self.counters['requests'] += 1
+            self._recent_errors.append(error is not None)
+            if latency is not None:
+                self.counters['latency_sum'] += latency
+            if error is not None:
+                self.counters['errors'] += 1
+                if is_congestion_error(error):
+                    self._on_congestion(type(error).__name__,
+                                        get_retry_after(error))
+            elif (self.latency_threshold is not None and latency is not None
+                  and latency > self.latency_threshold):
+                self._on_congestion(f'latency {latency:.1f}s')
+            else:
+                self._on_success()
+            self._cond.notify_all()
+
+    def _on_success(self):
+        error_rate = sum(self._recent_errors) / len(self._recent_errors)
+        if error_rate >= self.error_threshold:
+            return
+        old = int(self.window)
+        self.window = min(self.max_window,
+                          self.window + self.increase / self.window)
+        if int(self.window) != old:
+            self.logger.info(f'Concurrency window raised to '
+                             f'{int(self.window)}')
+
+    def _on_congestion(self, reason: str, retry_after: Optional[float] = None):
+        now = time.monotonic()
+        self.counters['congestion'] += 1
+        if retry_after:
+            self.counters['retry_after'] += 1
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+            self.logger.warning(f'Retry-After {retry_after:.1f}s received, '
+                                'pausing new requests')
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.window = max(self.min_window, self.window * self.decrease)
+        self.logger.warning(f'Concurrency window lowered to '
+                            f'{int(self.window)} ({reason})')
+
+    def slot(self) -> '_ControlledSlot':
+        """Context manager holding one slot and reporting the outcome."""
+        return _ControlledSlot(self)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            stats = dict(self.counters,
+                         window=int(self.window),
+                         in_flight=self.in_flight)
+        latency_sum = stats.pop('latency_sum')
+        if stats['requests']:
+            stats['avg_latency'] = round(latency_sum / stats['requests'], 3)
+        return stats
+
+
+class _ControlledSlot:
+
+    def __init__(self, controller: AdaptiveConcurrencyController):
+        self.controller = controller
+
+    def __enter__(self):
+        self.controller.acquire()
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if isinstance(exc, RequestCancelled):
+            exc = None
+        self.controller.release(time.monotonic() - self.start, exc)
+        return False
@@ -0,0 +1,153 @@
+import json
+import os
+import os.path as osp
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+from opencompass.utils import get_logger
+from opencompass.utils.retry import RetryPolicy
+
+TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+class BatchJobClient:
+    """Run chat completions as one job of an OpenAI-compatible batch API.
+
+    The request bodies are written as JSONL, uploaded through ``/files`` and
+    submitted to ``/batches``. The job is then polled with exponential backoff
+    until it reaches a terminal status. Outputs are mapped back to the input
+    order by ``custom_id``. Items that failed or are missing are returned as
+    None, so the caller can fall back to online requests.
+
+    Args:
+        client (openai.OpenAI): Client of the gateway serving the batch API.
+        retry_policy (RetryPolicy): Policy of the individual API calls.
+        poll_interval (float): First polling interval in seconds. Defaults to
+            5.
+        max_poll_interval (float): Largest polling interval in seconds.
+            Defaults to 60.
+        timeout (float): Seconds to wait for the job before cancelling it.
+            Defaults to 86400.
+        completion_window (str): Completion window requested from the
+            gateway. Defaults to '24h'.
+        work_dir (str, optional): Directory to keep the submitted JSONL in.
+            Defaults to None, i.e. a temporary file removed after upload.
+    """
+
+    def __init__(self,
+                 client,
+                 retry_policy: RetryPolicy,
+                 poll_interval: float = 5.,
+                 max_poll_interval: float = 60.,
+                 timeout: float = 86400.,
+                 completion_window: str = '24h',
+                 work_dir: Optional[str] = None):
+        self.client = client
+        self.retry_policy = retry_policy
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+        self.completion_window = completion_window
+        self.work_dir = work_dir
+        self.logger = get_logger()
+        self._lock = threading.Lock()
+        self.counters = dict(jobs=0, requests=0, succeeded=0, failed=0)
+
+    def _write_input(self, bodies: List[Dict], url: str) -> str:
+        if self.work_dir is not None:
+            os.makedirs(self.work_dir, exist_ok=True)
+            path = osp.join(self.work_dir,
+                            f'batch_{time.strftime("%Y%m%d_%H%M%S")}.jsonl')
+            f = open(path, 'w', encoding='utf-8')
+        else:
+            fd, path = tempfile.mkstemp(suffix='.jsonl')
+            f = os.fdopen(fd, 'w', encoding='utf-8')
+        with f:
+            for index, body in enumerate(bodies):
+                f.write(
+                    json.dumps(
+                        {
+                            'custom_id': f'request-{index}',
+                            'method': 'POST',
+                            'url': url,
+                            'body': body
+                        },
+                        ensure_ascii=False) + '\n')
+        return path
+
+    def _call(self, func, *args, **kwargs):
+        return self.retry_policy.run(func, *args, **kwargs)
+
+    def run(self,
+            bodies: List[Dict],
+            url: str = '/v1/chat/completions') -> List[Optional[Dict]]:
+        """Submit the request bodies as one batch job and wait for it.
+
+        Returns:
+            List[Optional[Dict]]: The response body of every request, None for
+            the failed ones.
+        """
+        path = self._write_input(bodies, url)
+        try:
+            with open(path, 'rb') as f:
+                input_file = self._call(self.client.files.create,
+                                        file=f,
+                                        purpose='batch')
+        finally:
+            if self.work_dir is None:
+                os.remove(path)
+        batch = self._call(self.client.batches.create,
+                           input_file_id=input_file.id,
+                           endpoint=url,
+                           completion_window=self.completion_window)
+        self.logger.info(f'Submitted batch job {batch.id} with '
+                         f'{len(bodies)} requests')
+        batch = self._wait(batch)
+
+        outputs = [None] * len(bodies)
+        if batch.output_file_id:
+            content = self._call(self.client.files.content,
+                                 batch.output_file_id)
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                index = int(item['custom_id'].rsplit('-', 1)[1])
+                response = item.get('response') or {}
+                if not item.get('error') and \
+                        response.get('status_code') == 200:
+                    outputs[index] = response['body']
+        num_succeeded = sum(output is not None for output in outputs)
+        self.logger.info(f'Batch job {batch.id} {batch.status}: '
+                         f'{num_succeeded}/{len(bodies)} succeeded')
+        with self._lock:
+            self.counters['jobs'] += 1
+            self.counters['requests'] += len(bodies)
+            self.counters['succeeded'] += num_succeeded
+            self.counters['failed'] += len(bodies) - num_succeeded
+        return outputs
+
+    def _wait(self, batch):
+        interval = self.poll_interval
+        deadline = time.monotonic() + self.timeout
+        while batch.status not in TERMINAL_STATUSES:
+            if time.monotonic() > deadline:
+                self.logger.warning(f'Batch job {batch.id} is still '
+                                    f'{batch.status} after {self.timeout:g}s,'
+                                    ' cancelling it')
+                try:
+                    batch = self.client.batches.cancel(batch.id)
+                except Exception as e:
+                    self.logger.warning(f'Failed to cancel batch job '
+                                        f'{batch.id}: {e}')
+                return batch
+            time.sleep(interval)
+            interval = min(self.max_poll_interval, interval * 2)
+            batch = self._call(self.client.batches.retrieve, batch.id)
+        return batch
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self.counters)
@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from opencompass.utils import get_logger
+from opencompass.utils.retry import RetryPolicy
+
+from .hedging import RequestCancelled
+
+
+def derive_base_url(api_url: str) -> str:
+    """Get the OpenAI-style base url (ending with /v1) of an API url."""
+    if "/v1" in api_url:
+        v1_index = api_url.rfind("/v1")
+        return api_url[:v1_index] + "/v1"
+    if api_url.endswith("/chat/completions"):
+        return api_url[:-len("/chat/completions")]
+    return api_url
+
+
+class Endpoint:
+    """One replica of a logical model together with its health state."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.base_url = derive_base_url(url)
+        self.client: Any = None
+        self.async_client: Any = None
+        self.outstanding = 0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.
+        self.probing = False
+        self.latency_ewma: Optional[float] = None
+        self.requests = 0
+        self.errors = 0
+
+    def __repr__(self):
+        return f'Endpoint({self.url})'
+
+
+class EndpointPool:
+    """Least-outstanding-requests router over the replicas of one model, with
+    passive health tracking.
+
+    A replica is ejected after ``max_failures`` consecutive failed requests,
+    or when its latency EWMA grows beyond ``slow_factor`` times the fastest
+    healthy replica. Once its ejection time has passed it is half-open: a
+    single probe request is routed to it, and it rejoins the pool if the
+    probe succeeds. Every further ejection doubles the ejection time, up to
+    ``max_eject_time``. Non-retryable errors such as a 400 are the request's
+    fault and count neither as a failure nor as a success.
+
+    Args:
+        urls (List[str]): Urls of the replicas.
+        max_failures (int): Consecutive failures before ejection. Defaults
+            to 3.
+        eject_time (float): Seconds of the first ejection. Defaults to 30.
+        max_eject_time (float): Upper bound of the ejection time. Defaults
+            to 600.
+        slow_factor (float, optional): Latency ratio to the fastest replica
+            that counts as unhealthy. Defaults to None (disabled).
+    """
+
+    EWMA_ALPHA = 0.2
+    MIN_SAMPLES = 10
+
+    def __init__(self,
+                 urls: List[str],
+                 max_failures: int = 3,
+                 eject_time: float = 30.,
+                 max_eject_time: float = 600.,
+                 slow_factor: Optional[float] = None):
+        assert urls, 'at least one endpoint is required'
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.max_failures = max_failures
+        self.eject_time = eject_time
+        self.max_eject_time = max_eject_time
+        self.slow_factor = slow_factor
+        self._lock = threading.Lock()
+        self.logger = get_logger()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def __iter__(self):
+        return iter(self.endpoints)
+
+    def acquire(self, exclude: Optional[Endpoint] = None) -> Endpoint:
+        """Pick the healthy replica with the fewest outstanding requests.
+
+        Args:
+            exclude (Endpoint, optional): Replica to avoid if any other is
+                available, e.g. for a retry or a hedged request.
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [ep for ep in self.endpoints if ep is not exclude]
+            candidates = candidates or self.endpoints
+            healthy = [ep for ep in candidates if ep.ejected_until <= now]
+            probe = [ep for ep in healthy if ep.ejections and not ep.probing]
+            if probe:
+                endpoint = probe[0]
+                endpoint.probing = True
+            elif healthy:
+                healthy = [ep for ep in healthy if not ep.probing] or healthy
+                endpoint = min(healthy, key=lambda ep: ep.outstanding)
+            else:
+                # every replica is ejected, fall back to the one that
+                # recovers first instead of failing the sample
+                endpoint = min(candidates, key=lambda ep: ep.ejected_until)
+            endpoint.outstanding += 1
+            return endpoint
+
+    def release(self,
+                endpoint: Endpoint,
+                latency: Optional[float] = None,
+                error: Optional[BaseException] = None,
+                cancelled: bool = False):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if cancelled:
+                # abandoned by the caller, says nothing about the replica
+                endpoint.probing = False
+                return
+            endpoint.requests += 1
+            was_probing = endpoint.probing
+            endpoint.probing = False
+            if error is not None:
+                endpoint.errors += 1
+                if not RetryPolicy.is_retryable(error):
+                    # a rejected request, e.g. a 400 for an overlong prompt,
+                    # says nothing about the health of the replica
+                    return
+                endpoint.failures += 1
+                if was_probing or endpoint.failures >= self.max_failures:
+                    self._eject(endpoint, f'{type(error).__name__}: {error}')
+                return
+
+            endpoint.failures = 0
+            if latency is not None:
+                endpoint.latency_ewma = latency if endpoint.latency_ewma is None \
+                    else (1 - self.EWMA_ALPHA) * endpoint.latency_ewma + self.EWMA_ALPHA * latency
+            if was_probing:
+                endpoint.ejections = 0
+                self.logger.info(f'Endpoint {endpoint.url} is back in the pool')
+            elif self._is_slow(endpoint):
+                self._eject(endpoint, f'latency {endpoint.latency_ewma:.1f}s')
+
+    def _is_slow(self, endpoint: Endpoint) -> bool:
+        if self.slow_factor is None or endpoint.requests < self.MIN_SAMPLES:
+            return False
+        now = time.monotonic()
+        others = [
+            ep.latency_ewma for ep in self.endpoints
+            if ep is not endpoint and ep.latency_ewma is not None
+            and ep.ejected_until <= now and ep.requests >= self.MIN_SAMPLES
+        ]
+        return bool(others) and endpoint.latency_ewma > self.slow_factor * min(others)
+
+    def _eject(self, endpoint: Endpoint, reason: str):
+        duration = min(self.max_eject_time,
+                       self.eject_time * 2 ** endpoint.ejections)
+        endpoint.ejections += 1
+        endpoint.failures = 0
+        endpoint.ejected_until = time.monotonic() + duration
+        self.logger.warning(f'Endpoint {endpoint.url} ejected for '
+                            f'{duration:g}s ({reason})')
+
+    def use(self, exclude: Optional[Endpoint] = None) -> '_EndpointLease':
+        """Context manager leasing a replica and reporting the outcome."""
+        return _EndpointLease(self, exclude)
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                ep.url: dict(requests=ep.requests,
+                             errors=ep.errors,
+                             outstanding=ep.outstanding,
+                             ejected=ep.ejected_until > now,
+                             latency_ewma=None if ep.latency_ewma is None
+                             else round(ep.latency_ewma, 3))
+                for ep in self.endpoints
+            }
+
+
+class _EndpointLease:
+
+    def __init__(self, pool: EndpointPool, exclude: Optional[Endpoint]):
+        self.pool = pool
+        self.exclude = exclude
+
+    def __enter__(self) -> Endpoint:
+        self.endpoint = self.pool.acquire(self.exclude)
+        self.start = time.monotonic()
+        return self.endpoint
+
+    def __exit__(self, exc_type, exc, tb):
+        if isinstance(exc, (RequestCancelled, asyncio.CancelledError)):
+            self.pool.release(self.endpoint, cancelled=True)
+        else:
+            self.pool.release(self.endpoint, time.monotonic() - self.start,
+                              exc)
+        return False
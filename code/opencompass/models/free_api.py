@@ -1,18 +1,18 @@
 import json
+import logging
 import os
 import re
 import time
-from concurrent.futures import ThreadPoolExecutor
+import threading
 from threading import Lock
 from typing import Dict, List, Optional, Union
 
-import jieba
-import requests
-
 from transformers import AutoTokenizer
 
 from opencompass.registry import MODELS
+from opencompass.utils.http_pool import get_http_pool
 from opencompass.utils.prompt import PromptList
+from opencompass.utils.retry import FatalAPIError, RetryError
 
 from .base_api import BaseAPIModel
 
@@ -52,6 +52,18 @@ class FreeAPI(BaseAPIModel):
         temperature (float, optional): What sampling temperature to use.
             If not None, will override the temperature in the `generate()`
             call. Defaults to None.
+        retry_policy (Dict, optional): Keyword arguments of
+            :obj:`RetryPolicy`. Defaults to None.
+        http_pool (Dict, optional): Keyword arguments of :obj:`HTTPPool`,
+            the keep-alive connection pool shared within the process.
+            Certificates and environment proxies are ignored by default.
+        tokenizer_service (Dict, optional): Keyword arguments of
+            :obj:`TokenizerService`. Defaults to the HuggingFace tokenizer at
+            ``tokenizer_path`` if given.
+        batch_prompts (int): Number of prompts packed into one request, for
+            servers accepting a list of ``prompt``. The outputs are mapped
+            back by index, prompts whose output is missing are retried one
+            by one. Defaults to 1 (one prompt per request).
     """
 
     is_api: bool = True
@@ -68,21 +80,42 @@ class FreeAPI(BaseAPIModel):
                  meta_template: Optional[Dict] = None,
                  openai_api_base: str = OPENAI_API_BASE,
                  mode: str = 'none',
-                 temperature: Optional[float] = None):
+                 temperature: Optional[float] = None,
+                 retry_policy: Optional[Dict] = None,
+                 http_pool: Optional[Dict] = None,
+                 batch_prompts: int = 1,
+                 tokenizer_service: Optional[Dict] = None):
 
+        if tokenizer_service is None and tokenizer_path != "":
+            tokenizer_service = dict(backend='huggingface', name=tokenizer_path)
         super().__init__(path=path,
                          max_seq_len=max_seq_len,
                          meta_template=meta_template,
                          query_per_second=query_per_second,
-                         retry=retry)
+                         retry=retry,
+                         retry_policy=retry_policy,
+                         tokenizer_service=tokenizer_service)
+        self.http_pool = get_http_pool(
+            **{'verify': False, 'trust_env': False, **(http_pool or {})})
         self.temperature = temperature
         assert mode in ['none', 'front', 'mid', 'rear']
+        # every request asks for max_tokens, the prompt gets the rest
+        if mode != 'none' and max_seq_len - 100 - max_tokens <= 0:
+            self.logger.warning(
+                f'max_tokens={max_tokens} leaves no room for the prompt in '
+                f'max_seq_len={max_seq_len}, prompts are sent untruncated')
+            mode = 'none'
         self.mode = mode
         self.max_tokens = max_tokens
         self.tokenizer_path = tokenizer_path
         if tokenizer_path != "":
             self.tokenizer_path = tokenizer_path
-            self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_path, trust_remote_code=True)
+            service = self.tokenizer_service
+            if service.backend == 'huggingface' and service.name == tokenizer_path:
+                # loaded once and shared with the token counting
+                self.tokenizer = service.tokenizer
+            else:
+                self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_path, trust_remote_code=True)
 
         if isinstance(key, str):
             self.keys = [os.getenv('OPENAI_API_KEY') if key == 'ENV' else key]
@@ -101,6 +134,10 @@ class FreeAPI(BaseAPIModel):
         self.org_ctr = 0
         self.url = openai_api_base
         self.path = path
+        assert batch_prompts >= 1, 'batch_prompts must be positive'
+        self.batch_prompts = batch_prompts
+        self.batch_counters = dict(requests=0, prompts=0, split=0)
+        self._batch_lock = threading.Lock()
 
         print(f'openai_api_base: {openai_api_base}')
         print(f'self.url: {self.url}')
@@ -129,11 +166,22 @@ class FreeAPI(BaseAPIModel):
         if self.temperature is not None:
             temperature = self.temperature
 
-        with ThreadPoolExecutor() as executor:
-            results = list(
-                executor.map(self._generate, inputs,
-                             [max_out_len] * len(inputs),
-                             [temperature] * len(inputs)))
+        if self.batch_prompts > 1:
+            # every request shares the parameters of the call, so packing
+            # prompts keeps each prompt's settings
+            chunks = [
+                inputs[i:i + self.batch_prompts]
+                for i in range(0, len(inputs), self.batch_prompts)
+            ]
+            outputs = self.http_pool.executor.map(
+                self._generate_batch, chunks, [max_out_len] * len(chunks),
+                [temperature] * len(chunks))
+            return [result for chunk in outputs for result in chunk]
+
+        results = list(
+            self.http_pool.executor.map(self._generate, inputs,
+                                        [max_out_len] * len(inputs),
+                                        [temperature] * len(inputs)))
         return results
 
     def _generate(self, input: str or PromptList, max_out_len: int,
@@ -153,81 +201,139 @@ class FreeAPI(BaseAPIModel):
         Returns:
             str: The generated string.
         """
+        messages = self._truncate(self._to_text(input))
+
+        try:
+            return self.retry_policy.run(self._request,
+                                         messages,
+                                         temperature,
+                                         key=self.url)
+        except RetryError as e:
+            raise RuntimeError('Calling FastChat API failed after retrying for '
+                               f'{e.attempts} times. Check the logs for '
+                               'details.') from e
+
+    def _truncate(self, messages: str) -> str:
+        """Cut the prompt according to ``mode`` so that it fits into
+        ``max_seq_len`` with room for the ``max_tokens`` the request asks
+        for, holding out 100 tokens for counting errors."""
+        if self.mode == 'none':
+            return messages
+        return self.tokenizer_service.trim(
+            messages, self.max_seq_len - 100 - self.max_tokens, self.mode)
+
+    @staticmethod
+    def _to_text(input: str or PromptList) -> str:
         assert isinstance(input, (str, PromptList))
 
         if isinstance(input, str):
-            messages = input
+            return input
+        # print("=======================input is PromptList========================")
+        # self.logger.info("=======================input is PromptList========================")
+        # self.logger.info(f"PromptList: {PromptList}")
+        if len(input) == 1:
+            return input[0]['prompt']
+        messages = ""
+        for item in input:
+            msg = item['prompt']
+            messages = messages + msg
+        return messages
+
+    def _generate_batch(self, inputs: List[str or PromptList],
+                        max_out_len: int, temperature: float) -> List[str]:
+        """Generate a chunk of prompts in one request, falling back to one
+        request per prompt for the outputs the batch did not deliver."""
+        messages = [
+            self._truncate(self._to_text(input)) for input in inputs
+        ]
+        try:
+            outputs = self.retry_policy.run(self._request_batch,
+                                            messages,
+                                            temperature,
+                                            key=self.url)
+        except RetryError as e:
+            self.logger.warning(f'Batched request of {len(inputs)} prompts '
+                                f'failed ({e}), sending them one by one.')
+            outputs = [None] * len(inputs)
+        failed = [i for i, output in enumerate(outputs) if output is None]
+        with self._batch_lock:
+            self.batch_counters['requests'] += 1
+            self.batch_counters['prompts'] += len(inputs)
+            self.batch_counters['split'] += len(failed)
+        for i in failed:
+            outputs[i] = self._generate(inputs[i], max_out_len, temperature)
+        return outputs
+
+    def get_stats(self) -> Dict[str, Dict]:
+        stats = super().get_stats()
+        if self.batch_counters['requests']:
+            stats['batching'] = dict(self.batch_counters)
+        return stats
+
+    def _post(self, prompt: Union[str, List[str]], temperature: float) -> Dict:
+        self.wait()
+
+        with Lock():
+            if len(self.invalid_keys) == len(self.keys):
+                raise FatalAPIError('All keys have insufficient quota.')
+
+            # find the next valid key
+            while True:
+                self.key_ctr += 1
+                if self.key_ctr == len(self.keys):
+                    self.key_ctr = 0
+
+                if self.keys[self.key_ctr] not in self.invalid_keys:
+                    break
+
+            key = self.keys[self.key_ctr]
+        headers = {'accept': 'application/json', 'Content-Type': 'application/json'}
+        payload = dict(
+            prompt=prompt,
+            max_tokens=self.max_tokens,
+            stop=['<|im_end|>', '<|endoftext|>', '</s>'],
+            temperature=temperature,
+        )
+        data = json.dumps(payload)
+        # full payloads are only formatted when DEBUG is on
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f'request payload: {payload}')
+        raw_response = self.http_pool.post(self.url, headers=headers, data=data)
+        try:
+            response = raw_response.json()
+        except json.JSONDecodeError as e:
+            # a non-JSON body will not get better with retrying
+            raise FatalAPIError(f'JsonDecode error, got {str(raw_response.content)}') from e
+        return response
+
+    def _request(self, messages: str, temperature: float) -> str:
+        response = self._post(messages, temperature)
+        try:
+            response_text = response['text'][0].strip()
+        except Exception:
+            self.logger.error(f'decode response error, response:{str(response)}')
+            raise
+        return self._trim_echo(messages, response_text)
+
+    def _request_batch(self, messages: List[str],
+                       temperature: float) -> List[Optional[str]]:
+        texts = self._post(messages, temperature).get('text')
+        if not isinstance(texts, list) or len(texts) != len(messages):
+            # the server does not batch, split rather than retry
+            return [None] * len(messages)
+        return [
+            self._trim_echo(message, text.strip())
+            if isinstance(text, str) else None
+            for message, text in zip(messages, texts)
+        ]
+
+    def _trim_echo(self, messages: str, response_text: str) -> str:
+        """Strip the prompt the server echoes before the reply."""
+        if messages in response_text:
+            trim_resp = response_text.replace(messages, "")
         else:
-            # print("=======================input is PromptList========================")
-            # self.logger.info("=======================input is PromptList========================")
-            # self.logger.info(f"PromptList: {PromptList}")
-            if len(input) == 1:
-                messages = input[0]['prompt']
-            else:
-                messages = ""
-                for item in input:
-                    msg = item['prompt']
-                    messages = messages + msg
-
-        max_num_retries = 0
-        while max_num_retries < self.retry:
-            self.wait()
-
-            with Lock():
-                if len(self.invalid_keys) == len(self.keys):
-                    raise RuntimeError('All keys have insufficient quota.')
-
-                # find the next valid key
-                while True:
-                    self.key_ctr += 1
-                    if self.key_ctr == len(self.keys):
-                        self.key_ctr = 0
-
-                    if self.keys[self.key_ctr] not in self.invalid_keys:
-                        break
-
-                key = self.keys[self.key_ctr]
-            headers = {'accept': 'application/json', 'Content-Type': 'application/json'}
-            proxies = {'http': ''}
-            try:
-                payload = dict(
-                    prompt=messages,
-                    max_tokens=self.max_tokens,
-                    stop=['<|im_end|>', '<|endoftext|>', '</s>'],
-                    temperature=temperature,
-                )
-                data = json.dumps(payload)
-                self.logger.info(f'===============request payload: {payload}')
-                # self.logger.info(f"=============data: {data}")
-                raw_response = requests.post(self.url,
-                                             headers=headers,
-                                             data=data,
-                                             verify=False,
-                                             proxies=proxies
-                                             )
-            except requests.ConnectionError:
-                self.logger.error('Got connection error, retrying...')
-                continue
-            try:
-                response = raw_response.json()
-            except requests.JSONDecodeError:
-                self.logger.error('JsonDecode error, got',
-                                  str(raw_response.content))
-                # continue
-                break
-            try:
-                response_text = response['text'][0].strip()
-                if messages in response_text:
-                    trim_resp = response_text.replace(messages, "")
-                else:
-                    trim_resp = response_text[len(messages) - 1:]
-                self.logger.info(f"response.content: {response_text}")
-                self.logger.info(f"after trim: {trim_resp}")
-                return trim_resp
-            except:
-                self.logger.error(f'decode response error, response:{str(response)}')
-            max_num_retries += 1
-
-        raise RuntimeError('Calling FastChat API failed after retrying for '
-                           f'{max_num_retries} times. Check the logs for '
-                           'details.')
+            trim_resp = response_text[len(messages) - 1:]
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"response.content: {response_text}")
+            self.logger.debug(f"after trim: {trim_resp}")
+        return trim_resp
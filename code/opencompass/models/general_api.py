@@ -1,18 +1,99 @@
+import asyncio
+import contextlib
 import copy
+import functools
+import hashlib
 import json
+import logging
 import os
-import socket
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
-from threading import Lock
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from threading import BoundedSemaphore
 from typing import Dict, List, Optional, Union
 
 import httpx
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletion
 
+from opencompass.utils.coordinator import CoordinatorUnavailable
 from opencompass.utils.prompt import PromptList
+from opencompass.utils.retry import RETRY_EXHAUSTED_PREFIX, RetryError
+
 from .base_api import BaseAPIModel
+from .batch_job import BatchJobClient
+from .endpoint_pool import EndpointPool, derive_base_url
+from .hedging import HedgeAttempt, RequestCancelled, RequestHedger
+from .response_cache import ResponseCache
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+class SSEDecoder:
+    """Incremental decoder of server-sent events, fed line by line.
+
+    Only the ``data`` field matters for chat completions. Multi-line data is
+    joined with newlines as required by the SSE spec.
+    """
+
+    def __init__(self):
+        self._data = []
+
+    def feed(self, line: str) -> Optional[str]:
+        """Consume one line, returning the event data when an event ends."""
+        line = line.rstrip('\r\n')
+        if not line:
+            return self.flush()
+        if line.startswith('data:'):
+            value = line[5:]
+            self._data.append(value[1:] if value.startswith(' ') else value)
+        return None
+
+    def flush(self) -> Optional[str]:
+        if not self._data:
+            return None
+        data = '\n'.join(self._data)
+        self._data = []
+        return data
+
+
+class _EventLoopThread:
+    """A long-lived asyncio event loop running in a daemon thread.
+
+    Every async request of a model instance is scheduled on this loop, so the
+    async client and its connection pool live across batches and datasets.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, coro) -> Future:
+        """Schedule a coroutine on the loop without waiting for it."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """Run a coroutine on the loop and block until it is done."""
+        if not self._thread.is_alive():
+            # daemon threads are gone at interpreter exit
+            coro.close()
+            raise RuntimeError('event loop thread is not running')
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
 
 
 class BaseGeneralApi(BaseAPIModel):
@@ -30,22 +111,62 @@ class BaseGeneralApi(BaseAPIModel):
     def __init__(
             self,
             path: str = "zteaim_api",
-            api_url: str = "",
+            api_url: Union[str, List[str]] = "",
             api_data: Dict = {},
             api_headers: Dict = {},
-            query_per_second: int = 1,
+            query_per_second: Optional[float] = None,
             retry: int = 2,
             meta_template: Optional[Dict] = None,
             mode: str = "none",
             stream: bool = True,
             top_p: Optional[float] = None,
             enable_thinking: Optional[bool] = None,
+            max_concurrency: int = 64,
+            async_mode: bool = False,
+            adaptive_concurrency: Optional[Dict] = None,
+            burst: Optional[int] = None,
+            tokens_per_minute: Optional[int] = None,
+            response_cache: Optional[Dict] = None,
+            endpoint_health: Optional[Dict] = None,
+            collect_metrics: bool = False,
+            trace: Optional[Dict] = None,
+            raw_stream: bool = False,
+            retry_policy: Optional[Dict] = None,
+            hedge: Optional[Dict] = None,
+            batch_job: Optional[Dict] = None,
+            prompt_cache_key: Optional[int] = None,
+            coalesce: Optional[bool] = None,
+            rate_limit_key: Optional[str] = None,
+            tokenizer_service: Optional[Dict] = None,
+            max_seq_len: Optional[int] = None,
     ):
+        # keep the previous schedule of three attempts 5s+ apart by default
+        retry_policy = {'max_attempts': 3, 'base_delay': 5., **(retry_policy or {})}
+        if adaptive_concurrency is not None:
+            # max_concurrency stays the hard ceiling of the adaptive window
+            adaptive_concurrency = {'max_window': max_concurrency, **adaptive_concurrency}
+        if coalesce is None:
+            # duplicate prompts only share a call when decoding is greedy
+            coalesce = {**self.DEFAULT_API_PARAMS, **api_data}.get('temperature') == 0
+        if rate_limit_key is None:
+            # every task process of the run hitting the same endpoint shares
+            # one budget through the runner's coordinator
+            rate_limit_key = api_url if isinstance(api_url, str) else ','.join(api_url)
         super().__init__(
             path=path,
+            max_seq_len=max_seq_len or 2048,
             meta_template=meta_template,
             query_per_second=query_per_second,
-            retry=retry
+            retry=retry,
+            adaptive_concurrency=adaptive_concurrency,
+            burst=burst,
+            tokens_per_minute=tokens_per_minute,
+            response_cache=response_cache,
+            trace=trace,
+            retry_policy=retry_policy,
+            coalesce=coalesce,
+            rate_limit_key=rate_limit_key,
+            tokenizer_service=tokenizer_service
         )
         self.headers = api_headers
         self.api_data = api_data
@@ -53,6 +174,32 @@ class BaseGeneralApi(BaseAPIModel):
         self.stream = stream
         self.timeout = 120
         self.enable_thinking = enable_thinking
+        # mode truncates the last user message to fit max_seq_len with room
+        # for max_tokens, configs that cannot truncate still build and send
+        # their prompts unchanged
+        if mode not in ('none', 'front', 'mid', 'rear'):
+            self.logger.warning(f"未知的截断模式 mode={mode!r}, 不做截断")
+            mode = 'none'
+        elif mode != 'none' and not max_seq_len:
+            self.logger.warning(f"截断模式 mode={mode!r} 需要设置 max_seq_len, 不做截断")
+            mode = 'none'
+        self.mode = mode
+        assert max_concurrency >= 1, 'max_concurrency must be positive'
+        self.max_concurrency = max_concurrency
+        self.async_mode = async_mode
+        # attach per-sample timing and token usage to every result
+        self.collect_metrics = collect_metrics
+        # decode the SSE stream directly instead of through the SDK's
+        # per-chunk pydantic models, the results are identical
+        self.raw_stream = raw_stream
+        # race a duplicate request against samples stuck before their first
+        # token, see `RequestHedger`
+        self.hedger = RequestHedger(**hedge) if hedge is not None else None
+        # send a `prompt_cache_key` hint derived from the first N characters
+        # of the conversation, so that gateways supporting it route requests
+        # sharing a prefix to the same prefix cache
+        self.prompt_cache_key = prompt_cache_key
+        self._hedge_executor = None
 
         auth_value = self.headers.get("Authorization", "")
         if not auth_value:
@@ -63,69 +210,216 @@ class BaseGeneralApi(BaseAPIModel):
         else:
             self.api_key = auth_value
 
-        if "/v1" in api_url:
-            v1_index = api_url.rfind("/v1")
-            self.base_url = api_url[:v1_index] + "/v1"
-        elif api_url.endswith("/chat/completions"):
-            self.base_url = api_url[:-len("/chat/completions")]
-        else:
-            self.base_url = api_url
+        # a list of urls are replicas of the same logical model, requests
+        # are routed by the pool while the abbr and output paths stay put
+        api_urls = [api_url] if isinstance(api_url, str) else list(api_url)
+        self.endpoint_pool = EndpointPool(api_urls, **(endpoint_health or {}))
+        self.base_url = derive_base_url(api_urls[0])
 
+        # keep a per-instance copy so that one model's top_p does not leak
+        # into every other instance through the class attribute
+        self.DEFAULT_API_PARAMS = dict(self.DEFAULT_API_PARAMS)
         if top_p is not None:
             self.DEFAULT_API_PARAMS["top_p"] = top_p
 
         self._init_http_client()
-        self._client_lock = Lock()
+        # offline mode: every `generate` call becomes one job of the
+        # gateway's batch API, see `BatchJobClient`
+        self.batch_job = None
+        if batch_job is not None:
+            self.batch_job = BatchJobClient(self.openai_client, self.retry_policy, **batch_job)
+        # the OpenAI/httpx clients are thread-safe, the semaphore only bounds
+        # the number of requests in flight for this model instance
+        self._request_slots = BoundedSemaphore(max_concurrency)
+        if self.coordinator is not None:
+            # max_concurrency also bounds the requests in flight to the
+            # endpoint across the task processes of the run
+            self.coordinator.register(self.rate_limit_key, concurrency=max_concurrency)
 
-    def _init_http_client(self):
-        limits = httpx.Limits(
-            max_connections=100,
-            max_keepalive_connections=50,
+        # async mode: the loop, client and semaphore are created lazily on
+        # the loop thread, see `_ensure_async_engine`
+        self._loop_thread = None
+        self._loop_thread_lock = threading.Lock()
+        self.async_openai_client = None
+        self._async_request_slots = None
+        self._coordinator_executor = None
+        self._async_slot_cond = None
+
+    def _http_limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=max(100, self.max_concurrency),
+            max_keepalive_connections=max(50, self.max_concurrency),
             keepalive_expiry=60.0
         )
 
-        self.http_client = httpx.Client(
-            limits=limits,
-            timeout=httpx.Timeout(
-                connect=30.0,
-                read=300.0,
-                write=30.0,
-                pool=60.0
-            ),
-            http2=True,
-            transport=httpx.HTTPTransport(
-                retries=1,
-                http2=True
-            )
+    @staticmethod
+    def _http_timeout() -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=30.0,
+            read=300.0,
+            write=30.0,
+            pool=60.0
         )
 
-        default_headers = {
+    def _default_headers(self) -> Dict:
+        return {
             k: v for k, v in self.headers.items() if k != "Authorization"
         }
 
-        self.openai_client = OpenAI(
-            api_key=f"Bearer {self.api_key}",
-            base_url=self.base_url,
-            timeout=5 * 60,
-            default_headers=default_headers,
-            http_client=self.http_client
+    def _init_http_client(self):
+        self.http_client = httpx.Client(
+            limits=self._http_limits(),
+            timeout=self._http_timeout(),
+            http2=True,
+            transport=httpx.HTTPTransport(http2=True)
+        )
+
+        for endpoint in self.endpoint_pool:
+            endpoint.client = OpenAI(
+                api_key=f"Bearer {self.api_key}",
+                base_url=endpoint.base_url,
+                timeout=5 * 60,
+                # retries are owned by `self.retry_policy`
+                max_retries=0,
+                default_headers=self._default_headers(),
+                http_client=self.http_client
+            )
+        self.openai_client = self.endpoint_pool.endpoints[0].client
+
+    def _ensure_async_engine(self) -> _EventLoopThread:
+        # concurrent callers (e.g. the window dispatcher) must share one loop,
+        # published only once its clients and slots are ready
+        if self._loop_thread is None:
+            with self._loop_thread_lock:
+                if self._loop_thread is None:
+                    loop_thread = _EventLoopThread()
+                    loop_thread.run(self._init_async_client())
+                    self._loop_thread = loop_thread
+        return self._loop_thread
+
+    async def _init_async_client(self):
+        self.async_http_client = httpx.AsyncClient(
+            limits=self._http_limits(),
+            timeout=self._http_timeout(),
+            http2=True,
+            transport=httpx.AsyncHTTPTransport(http2=True)
         )
+        for endpoint in self.endpoint_pool:
+            endpoint.async_client = AsyncOpenAI(
+                api_key=f"Bearer {self.api_key}",
+                base_url=endpoint.base_url,
+                timeout=5 * 60,
+                # retries are owned by `self.retry_policy`
+                max_retries=0,
+                default_headers=self._default_headers(),
+                http_client=self.async_http_client
+            )
+        self.async_openai_client = self.endpoint_pool.endpoints[0].async_client
+        self._async_request_slots = asyncio.Semaphore(self.max_concurrency)
+        self._async_slot_cond = asyncio.Condition()
+        if self.coordinator is not None:
+            # the coordinator round trips block, they run on one thread so
+            # that a slot is released on the connection that holds it
+            self._coordinator_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='coordinator')
+
+    @contextlib.contextmanager
+    def _request_slot(self):
+        """Context manager holding one in-flight request slot."""
+        if self.concurrency_controller is not None:
+            slot = self.concurrency_controller.slot()
+        else:
+            slot = self._request_slots
+        with slot:
+            if self.coordinator is None:
+                yield
+                return
+            with self.coordinator.slot(self.rate_limit_key):
+                yield
 
-    def _exponential_backoff_retry(self, func, *args, **kwargs):
-        max_retries = 3
-        base_delay = 1.0
+    @contextlib.asynccontextmanager
+    async def _async_request_slot(self):
+        """Async counterpart of `_request_slot`, run on the loop thread."""
+        async with self._async_local_slot():
+            if self.coordinator is None:
+                yield
+                return
+            try:
+                await self._acquire_coordinator_slot()
+                acquired = True
+            except CoordinatorUnavailable:
+                # the local slot still bounds the requests in flight
+                acquired = False
+            try:
+                yield
+            finally:
+                if acquired:
+                    # a lost connection has given the slot back already
+                    with contextlib.suppress(CoordinatorUnavailable):
+                        await asyncio.shield(asyncio.get_running_loop().run_in_executor(
+                            self._coordinator_executor, self.coordinator.release_slot, self.rate_limit_key))
 
-        for attempt in range(max_retries):
+    async def _acquire_coordinator_slot(self):
+        """Take a coordinator slot without blocking the loop. The round trips
+        run on the coordinator thread and poll instead of parking on the
+        server, which would hold that thread."""
+        loop = asyncio.get_running_loop()
+        acquire_slot = functools.partial(self.coordinator.acquire_slot, self.rate_limit_key, blocking=False)
+        delay = 0.001
+        while True:
+            future = loop.run_in_executor(self._coordinator_executor, acquire_slot)
             try:
-                return func(*args, **kwargs)
-            except (httpx.ConnectError, httpx.TimeoutException, socket.error) as e:
-                if attempt == max_retries - 1:
-                    raise e
-                delay = base_delay * (2 ** attempt)
-                self.logger.warning(f"连接错误，{delay}秒后重试 (尝试 {attempt + 1}/{max_retries}): {e}")
-                time.sleep(delay)
-            except Exception as e:
-                raise e
+                granted = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # e.g. a losing hedge: give back a slot granted meanwhile
+                future.add_done_callback(self._release_granted_slot)
+                raise
+            if granted:
+                return
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, 0.05)
+
+    def _release_granted_slot(self, future):
+        if not future.cancelled() and future.exception() is None and future.result():
+            self._coordinator_executor.submit(self.coordinator.release_slot, self.rate_limit_key)
+
+    @contextlib.asynccontextmanager
+    async def _async_local_slot(self):
+        controller = self.concurrency_controller
+        if controller is None:
+            async with self._async_request_slots:
+                yield
+            return
+
+        async with self._async_slot_cond:
+            while True:
+                acquired, delay = controller.try_acquire()
+                if acquired:
+                    break
+                try:
+                    await asyncio.wait_for(self._async_slot_cond.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        start = time.monotonic()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            controller.release(time.monotonic() - start, error)
+            async with self._async_slot_cond:
+                self._async_slot_cond.notify_all()
+
+    def get_stats(self) -> Dict[str, Dict]:
+        stats = super().get_stats()
+        if len(self.endpoint_pool) > 1:
+            stats['endpoints'] = self.endpoint_pool.stats()
+        if self.hedger is not None:
+            stats['hedging'] = self.hedger.stats()
+        if self.batch_job is not None:
+            stats['batch_job'] = self.batch_job.stats()
+        return stats
 
     def generate(
             self,
@@ -134,15 +428,85 @@ class BaseGeneralApi(BaseAPIModel):
     ) -> List[Union[str, dict]]:
         start_time = time.time()
         batch_size = len(inputs)
-        max_workers = min(64, batch_size)
 
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            results = list(executor.map(self._generate, inputs))
+        if self.batch_job is not None:
+            results = self._generate_batch_job(inputs)
+        else:
+            results = self._generate_online(inputs)
         end_time = time.time()
-        self.logger.info(f"Batch 执行完成，batch_size: {batch_size}, 耗时: {end_time - start_time:.2f}秒")
+        self.logger.debug(f"Batch 执行完成，batch_size: {batch_size}, 耗时: {end_time - start_time:.2f}秒")
         return results
 
-    def _generate(self, input: List[Union[str, PromptList]]) -> Union[str, dict]:
+    def submit(
+            self,
+            inputs: List[Union[str, PromptList]],
+            **kwargs
+    ) -> Future:
+        """Start generating ``inputs`` on the event loop of the async engine
+        and return a future of the results at once, so that a caller can keep
+        many requests in flight without a thread for each."""
+        assert self.async_mode and self.batch_job is None, \
+            'submit() needs async_mode and no batch_job'
+        return self._ensure_async_engine().submit(self._agenerate_batch(inputs))
+
+    def _generate_online(self, inputs: List[Union[str, PromptList]]) -> List[dict]:
+        if self.async_mode:
+            loop_thread = self._ensure_async_engine()
+            return loop_thread.run(self._agenerate_batch(inputs))
+        if len(inputs) == 1:
+            # the window dispatcher sends one sample per call
+            return [self._generate(inputs[0])]
+        max_workers = max(1, min(self.max_concurrency, len(inputs)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self._generate, inputs))
+
+    def _generate_batch_job(self, inputs: List[Union[str, PromptList]]) -> List[dict]:
+        """Generate the inputs as one batch job, falling back to online
+        requests for the items the job did not complete."""
+        results = [None] * len(inputs)
+        pending, cache_keys, bodies = [], {}, []
+        for i, input in enumerate(inputs):
+            messages = self._input_messages(input)
+            cache_key = self._response_cache_key(messages)
+            if cache_key is not None:
+                results[i] = self.response_cache.get(cache_key)
+                if results[i] is not None:
+                    continue
+                cache_keys[i] = cache_key
+            body = self._build_request_params(messages, stream=False)
+            body.update(body.pop('extra_body', None) or {})
+            pending.append(i)
+            bodies.append(body)
+
+        outputs = [None] * len(pending)
+        if bodies:
+            try:
+                outputs = self.batch_job.run(bodies)
+            except Exception as e:
+                self.logger.error(f"Batch 任务提交失败，全部改为在线请求: {e}")
+        for i, body in zip(pending, outputs):
+            if body is None:
+                continue
+            try:
+                results[i] = self._parse_completion(ChatCompletion.model_validate(body))
+            except Exception as e:
+                self.logger.warning(f"Batch 结果解析失败，custom_id: request-{i}, {e}")
+                continue
+            if i in cache_keys:
+                self.response_cache.put(cache_keys[i], results[i])
+
+        failed = [i for i in pending if results[i] is None]
+        if failed:
+            self.logger.warning(f"Batch 任务中 {len(failed)}/{len(inputs)} 条未完成，改为在线请求")
+            for i, result in zip(failed, self._generate_online([inputs[i] for i in failed])):
+                results[i] = result
+        return results
+
+    async def _agenerate_batch(self, inputs: List[Union[str, PromptList]]) -> List[dict]:
+        return await asyncio.gather(*(self._agenerate(x) for x in inputs))
+
+    @staticmethod
+    def _to_messages(input: Union[str, PromptList]) -> List[Dict]:
         messages = []
         message = {}
         if isinstance(input, PromptList):
@@ -159,31 +523,227 @@ class BaseGeneralApi(BaseAPIModel):
                 messages.append(message)
         else:
             messages.append({'role': 'user', 'content': input})
+        return messages
+
+    def _input_messages(self, input: Union[str, PromptList]) -> List[Dict]:
+        messages = self._to_messages(input)
+        if self.mode != 'none':
+            self._truncate_messages(messages)
+        return messages
+
+    def _truncate_messages(self, messages: List[Dict]):
+        """Trim the last user message in place so that the conversation
+        fits into `max_seq_len` with room for `max_tokens`."""
+        users = [i for i, m in enumerate(messages)
+                 if m['role'] == 'user' and isinstance(m.get('content'), str)]
+        if not users:
+            return
+        contents = [m['content'] if isinstance(m.get('content'), str) else '' for m in messages]
+        lengths = self.get_token_len_batch(contents)
+        max_tokens = int({**self.DEFAULT_API_PARAMS, **self.api_data}.get('max_tokens') or 0)
+        budget = self.max_seq_len - max_tokens
+        if sum(lengths) <= budget:
+            return
+        last = users[-1]
+        budget -= sum(lengths) - lengths[last]
+        if budget <= 0:
+            # trimming the last message cannot make the conversation fit
+            self.logger.warning(
+                f"截断失败: 其余消息已占用 {sum(lengths) - lengths[last]} tokens, "
+                f"超出 max_seq_len={self.max_seq_len} 减去 max_tokens={max_tokens} 的预算, 按原样发送")
+            return
+        messages[last] = {
+            **messages[last],
+            'content': self.tokenizer_service.trim(contents[last], budget, self.mode)
+        }
+
+    def _request_key(self, messages: List[Dict]) -> str:
+        """Hash of everything that determines the response of a request."""
+        params = self._build_request_params(messages)
+        params.pop('stream', None)
+        return ResponseCache.make_key(model=self.path,
+                                      params=params,
+                                      parse_reasoning=self.PARSE_REASONING)
+
+    def _response_cache_key(self, messages: List[Dict]) -> Optional[str]:
+        if self.response_cache is None:
+            return None
+        return self._request_key(messages)
+
+    @staticmethod
+    def _shared_result(result: Dict) -> Dict:
+        # the sample did not send a request of its own, so it carries no
+        # latency or token usage
+        return {k: copy.deepcopy(v) for k, v in result.items() if k != 'metrics'}
+
+    def _generate(self, input: List[Union[str, PromptList]]) -> Union[str, dict]:
+        messages = self._input_messages(input)
+        if self.single_flight is None:
+            return self._generate_messages(messages)
+        result, shared = self.single_flight.do(
+            self._request_key(messages), self._generate_messages, messages)
+        return self._shared_result(result) if shared else result
 
-        retries = 0
-        err_reason = ""
-        while retries < 3:
+    def _breaker_options(self) -> Dict:
+        """Circuit breaker of a retried call. The endpoint is only chosen per
+        attempt, so a single endpoint keys the breaker by its URL; a pool of
+        replicas ejects its failing ones itself, and one breaker over the
+        whole pool would fail calls that a healthy replica can serve."""
+        if len(self.endpoint_pool) > 1:
+            return dict(circuit=False)
+        return dict(key=self.endpoint_pool.endpoints[0].url)
+
+    def _generate_messages(self, messages: List[Dict]) -> Dict:
+        cache_key = self._response_cache_key(messages)
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        request = self.generate_stream if self.stream else self.generate_no_stream
+        if self.hedger is not None:
+            request = functools.partial(self._hedged_request, request)
+        try:
+            result = self.retry_policy.run(request, messages, **self._breaker_options())
+        except RetryError as e:
+            self.logger.error(f"请求失败，放弃重试: {e}")
+            return {'content': f"{RETRY_EXHAUSTED_PREFIX}, err_reason:{e.format_errors()}"}
+        if cache_key is not None:
+            self.response_cache.put(
+                cache_key, {k: v for k, v in result.items() if k != 'metrics'})
+        return result
+
+    async def _agenerate(self, input: Union[str, PromptList]) -> dict:
+        """Async counterpart of `_generate` under the same retry policy."""
+        messages = self._input_messages(input)
+        if self.single_flight is None:
+            return await self._agenerate_messages(messages)
+        result, shared = await self.single_flight.ado(
+            self._request_key(messages), self._agenerate_messages, messages)
+        return self._shared_result(result) if shared else result
+
+    async def _agenerate_messages(self, messages: List[Dict]) -> Dict:
+        cache_key = self._response_cache_key(messages)
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        request = self.agenerate_stream if self.stream else self.agenerate_no_stream
+        if self.hedger is not None:
+            request = functools.partial(self._ahedged_request, request)
+        try:
+            result = await self.retry_policy.arun(request, messages, **self._breaker_options())
+        except RetryError as e:
+            self.logger.error(f"请求失败，放弃重试: {e}")
+            return {'content': f"{RETRY_EXHAUSTED_PREFIX}, err_reason:{e.format_errors()}"}
+        if cache_key is not None:
+            self.response_cache.put(
+                cache_key, {k: v for k, v in result.items() if k != 'metrics'})
+        return result
+
+    def _run_attempt(self, request, messages: List[Dict], attempt: HedgeAttempt):
+        try:
+            return request(messages, attempt=attempt)
+        finally:
+            attempt.finish()
+
+    def _hedged_request(self, request, messages: List[Dict]) -> Dict:
+        """Run ``request`` and, if it has no first token within the hedging
+        delay, race a duplicate on another replica against it."""
+        hedger = self.hedger
+        delay = hedger.delay()
+        primary = HedgeAttempt()
+        if delay is None:
             try:
-                result = self.generate_stream(messages) if self.stream else self.generate_no_stream(messages)
-                return result if isinstance(result, dict) else {'content': result}
-            except (httpx.ConnectError, httpx.TimeoutException, socket.error) as e:
-                retries += 1
-                timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-                err_reason += f"{timestamp} {retries}:Connection error - {type(e).__name__}: {str(e)}"
-                if retries < 3:
-                    delay = 5 * (2 ** (retries - 1))
-                    self.logger.warning(f"连接错误，{delay}秒后重试: {e}")
-                    time.sleep(delay)
-                else:
-                    self.logger.error("达到最大重试次数，放弃重试")
-            except Exception as e:
-                retries += 1
-                timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-                err_reason += f"{timestamp} {retries}:{type(e).__name__}: {str(e)}"
-                self.logger.warning(f"请求失败，5秒后重试: {e}")
-                time.sleep(5)
+                return request(messages, attempt=primary)
+            finally:
+                hedger.observe(primary)
+
+        if self._hedge_executor is None:
+            # the caller thread only waits, every attempt runs in the pool
+            self._hedge_executor = ThreadPoolExecutor(
+                max_workers=2 * self.max_concurrency, thread_name_prefix='hedge')
+        executor = self._hedge_executor
+        future = executor.submit(self._run_attempt, request, messages, primary)
+        if primary.wait_first_token(delay) or not hedger.try_hedge():
+            try:
+                return future.result()
+            finally:
+                hedger.observe(primary)
+
+        hedge = HedgeAttempt(exclude=primary.endpoint)
+        attempts = {future: primary, executor.submit(self._run_attempt, request, messages, hedge): hedge}
+        self.logger.debug(f"{delay:.2f}秒内未收到首个 token，发送对冲请求")
+        pending = set(attempts)
+        errors = {}
+        try:
+            while pending:
+                done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if attempts[future] is hedge:
+                            hedger.record_win(primary, hedge)
+                        return future.result()
+                    errors[attempts[future]] = future.exception()
+        finally:
+            # closing the loser's response frees its slot and replica at
+            # once, even if it is still waiting for its first token
+            for attempt in attempts.values():
+                attempt.cancel()
+                hedger.observe(attempt)
+        raise errors.get(primary) or errors[hedge]
+
+    async def _ahedged_request(self, request, messages: List[Dict]) -> Dict:
+        """Async counterpart of `_hedged_request`, the loser is cancelled as
+        an asyncio task."""
+        hedger = self.hedger
+        delay = hedger.delay()
+        primary = HedgeAttempt()
+        if delay is None:
+            try:
+                return await request(messages, attempt=primary)
+            finally:
+                hedger.observe(primary)
+
+        primary_task = asyncio.ensure_future(request(messages, attempt=primary))
+        # the delay counts from sending, not from queueing for a slot
+        timeout = delay
+        while True:
+            done, _ = await asyncio.wait({primary_task}, timeout=timeout)
+            if done or primary.first_token_time is not None:
+                break
+            timeout = delay
+            if primary.started.is_set():
+                timeout = primary.start + delay - time.monotonic()
+                if timeout <= 0:
+                    break
+        if done or primary.first_token_time is not None or not hedger.try_hedge():
+            try:
+                return await primary_task
+            finally:
+                hedger.observe(primary)
 
-        return {'content': f"Max Retries, status: Error, err_reason:{err_reason}"}
+        hedge = HedgeAttempt(exclude=primary.endpoint)
+        attempts = {primary_task: primary, asyncio.ensure_future(request(messages, attempt=hedge)): hedge}
+        self.logger.debug(f"{delay:.2f}秒内未收到首个 token，发送对冲请求")
+        pending = set(attempts)
+        errors = {}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if attempts[task] is hedge:
+                            hedger.record_win(primary, hedge)
+                        return task.result()
+                    errors[attempts[task]] = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+            for attempt in attempts.values():
+                hedger.observe(attempt)
+        raise errors.get(primary) or errors[hedge]
 
     def _apply_prompt_suffix_control(self, messages: List[Dict]) -> List[Dict]:
         if self.enable_thinking is not False:
@@ -225,10 +785,32 @@ class BaseGeneralApi(BaseAPIModel):
         params.update(self.api_data)
         params['messages'] = request_messages
         params['stream'] = stream
+        if stream and self.collect_metrics:
+            params['stream_options'] = {'include_usage': True}
         if self.THINKING_CONTROL_MODE == 'extra_body':
             self._inject_extra_body_control(params)
+        if self.prompt_cache_key:
+            params['extra_body'] = {
+                **(params.get('extra_body') or {}),
+                'prompt_cache_key': self._prompt_cache_key(request_messages)
+            }
         return params
 
+    def _prompt_cache_key(self, messages: List[Dict]) -> str:
+        text = '\x00'.join(f"{m.get('role')}\x01{m.get('content')}" for m in messages)
+        prefix = text[:self.prompt_cache_key].encode('utf-8')
+        return hashlib.sha1(prefix).hexdigest()[:16]
+
+    def _estimate_request_tokens(self, params: Dict) -> int:
+        """Estimated prompt plus completion tokens, for the TPM budget."""
+        if self.rate_limiter.tokens_per_minute is None:
+            return 0
+        prompt_tokens = sum(self.get_token_len_batch([
+            msg['content'] for msg in params['messages']
+            if isinstance(msg.get('content'), str)
+        ]))
+        return prompt_tokens + int(params.get('max_tokens') or 0)
+
     def _extract_reasoning_from_message(self, message, result: Dict) -> None:
         if not self.PARSE_REASONING:
             return
@@ -280,52 +862,167 @@ class BaseGeneralApi(BaseAPIModel):
 
         return has_field, value
 
-    def generate_no_stream(self, messages):
-        with self._client_lock:
-            request_params = self._build_request_params(messages, stream=False)
-            self.logger.info(f"完整请求参数: {json.dumps(request_params, indent=2, ensure_ascii=False)}")
+    @staticmethod
+    def _usage_metrics(usage) -> Dict:
+        """Prompt/completion token counts of an OpenAI `usage` object, with
+        reasoning and content tokens kept apart when the server reports
+        them."""
+        if usage is None:
+            return {}
+        if hasattr(usage, 'model_dump'):
+            usage = usage.model_dump()
+        metrics = {}
+        for key in ('prompt_tokens', 'completion_tokens'):
+            if usage.get(key) is not None:
+                metrics[key] = usage[key]
+        details = usage.get('completion_tokens_details') or {}
+        if details.get('reasoning_tokens') is not None:
+            metrics['reasoning_tokens'] = details['reasoning_tokens']
+            if 'completion_tokens' in metrics:
+                metrics['content_tokens'] = metrics['completion_tokens'] - details['reasoning_tokens']
+        return metrics
+
+    def _build_metrics(self, start: float, end: float, usage=None, timing: Optional[Dict] = None) -> Dict:
+        metrics = {'latency': round(end - start, 4)}
+        metrics.update(self._usage_metrics(usage))
+        if timing is None:
+            return metrics
+        metrics['content_chunks'] = timing['content_chunks']
+        metrics['reasoning_chunks'] = timing['reasoning_chunks']
+        first_token = timing['first_token']
+        if first_token is not None:
+            metrics['ttft'] = round(first_token - start, 4)
+            if timing['first_content'] is not None:
+                metrics['ttfc'] = round(timing['first_content'] - start, 4)
+            num_tokens = metrics.get(
+                'completion_tokens', timing['content_chunks'] + timing['reasoning_chunks'])
+            if end > first_token:
+                metrics['tokens_per_s'] = round(num_tokens / (end - first_token), 2)
+        return metrics
+
+    def _parse_completion(self, completion, start: Optional[float] = None) -> Dict:
+        """Convert a non-stream chat completion into the result dict."""
+        message = completion.choices[0].message
+        has_content_field, ans = self._extract_message_field(message, 'content')
+        has_reasoning_content_field, reasoning_content = self._extract_message_field(
+            message, 'reasoning_content')
+
+        if (not has_content_field) or ans is None:
+            if has_reasoning_content_field:
+                ans = '' if reasoning_content is None else reasoning_content
+            else:
+                ans = None
+
+        result = {'content': ans}
+        if hasattr(message, 'refusal') and message.refusal is not None:
+            result['refusal'] = message.refusal
+        if hasattr(message, 'model_dump'):
             try:
-                completion = self._exponential_backoff_retry(
-                    self.openai_client.chat.completions.create,
-                    **request_params
-                )
-                message = completion.choices[0].message
-                has_content_field, ans = self._extract_message_field(message, 'content')
-                has_reasoning_content_field, reasoning_content = self._extract_message_field(
-                    message, 'reasoning_content')
-
-                if (not has_content_field) or ans is None:
-                    if has_reasoning_content_field:
-                        ans = '' if reasoning_content is None else reasoning_content
-                    else:
-                        ans = None
+                message_dict = message.model_dump()
+                if 'refusal' in message_dict and message_dict['refusal'] is not None:
+                    result['refusal'] = message_dict['refusal']
+            except Exception:
+                pass
+        if isinstance(message, dict) and 'refusal' in message and message['refusal'] is not None:
+            result['refusal'] = message['refusal']
 
-                result = {'content': ans}
-                if hasattr(message, 'refusal') and message.refusal is not None:
-                    result['refusal'] = message.refusal
-                if hasattr(message, 'model_dump'):
-                    try:
-                        message_dict = message.model_dump()
-                        if 'refusal' in message_dict and message_dict['refusal'] is not None:
-                            result['refusal'] = message_dict['refusal']
-                    except Exception:
-                        pass
-                if isinstance(message, dict) and 'refusal' in message and message['refusal'] is not None:
-                    result['refusal'] = message['refusal']
-
-                self._extract_reasoning_from_message(message, result)
-
-                self.logger.info(f"模型返回内容: {ans}")
-                if 'reasoning' in result:
-                    self.logger.info(f"模型返回 reasoning: {result['reasoning']}")
-                return result
+        self._extract_reasoning_from_message(message, result)
+        if start is not None:
+            result['metrics'] = self._build_metrics(
+                start, time.monotonic(), getattr(completion, 'usage', None))
+
+        self._log_response(result)
+        return result
+
+    def _log_request(self, params: Dict) -> None:
+        # full payloads are only formatted when DEBUG is on, use `trace` for
+        # a compact per-request record instead
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"完整请求参数: {json.dumps(params, indent=2, ensure_ascii=False)}")
+
+    def _log_response(self, result: Dict) -> None:
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"模型返回内容: {result['content']}")
+            if 'reasoning' in result:
+                self.logger.debug(f"模型返回 reasoning: {result['reasoning']}")
+
+    def _trace(self, params: Dict, endpoint, start: float,
+               result: Optional[Dict] = None, error: Optional[BaseException] = None) -> None:
+        """Send one compact record (and maybe the full payload) to the
+        tracer."""
+        tracer = self.tracer
+        if tracer is None:
+            return
+        request_id = tracer.new_request_id()
+        record = {
+            'id': request_id,
+            'model': self.path,
+            'endpoint': endpoint.url,
+            'stream': params.get('stream', False),
+            'messages': len(params['messages']),
+            'prompt_chars': sum(
+                len(msg['content']) for msg in params['messages'] if isinstance(msg.get('content'), str)),
+            'latency': round(time.monotonic() - start, 4),
+        }
+        if error is None:
+            record['status'] = 'ok'
+            record['content_chars'] = len(result['content'] or '')
+            if result.get('reasoning'):
+                record['reasoning_chars'] = len(result['reasoning'])
+            record.update(result.get('metrics') or {})
+        else:
+            record['status'] = 'error'
+            record['error'] = f'{type(error).__name__}: {str(error)[:200]}'
+        tracer.record(**record)
+        if tracer.should_sample_payload():
+            tracer.payload(request_id, params, result)
+
+    def generate_no_stream(self, messages, attempt: Optional[HedgeAttempt] = None):
+        request_params = self._build_request_params(messages, stream=False)
+        self.wait(self._estimate_request_tokens(request_params))
+        exclude = attempt.exclude if attempt is not None else None
+        with self._request_slot(), self.endpoint_pool.use(exclude) as endpoint:
+            self._log_request(request_params)
+            start = time.monotonic()
+            try:
+                if attempt is not None:
+                    attempt.begin(endpoint)
+                completion = endpoint.client.chat.completions.create(**request_params)
+                if attempt is not None:
+                    attempt.on_chunk()
+                result = self._parse_completion(completion, start if self.collect_metrics else None)
+            except RequestCancelled:
+                raise
             except Exception as e:
-                self.logger.error(f"非流式请求失败: {type(e).__name__}: {str(e)}, API URL: {self.api_url}")
+                if attempt is not None:
+                    attempt.check_cancelled(e)
+                self._trace(request_params, endpoint, start, error=e)
+                self.logger.error(f"非流式请求失败: {type(e).__name__}: {str(e)}, API URL: {endpoint.url}")
                 raise
+            self._trace(request_params, endpoint, start, result=result)
+            return result
 
-    @staticmethod
-    def _accumulate_text(current: Optional[str], piece: str) -> str:
-        return piece if current is None else current + piece
+    async def agenerate_no_stream(self, messages, attempt: Optional[HedgeAttempt] = None):
+        request_params = self._build_request_params(messages, stream=False)
+        await self.rate_limiter.acquire_async(self._estimate_request_tokens(request_params))
+        exclude = attempt.exclude if attempt is not None else None
+        async with self._async_request_slot():
+            with self.endpoint_pool.use(exclude) as endpoint:
+                self._log_request(request_params)
+                start = time.monotonic()
+                try:
+                    if attempt is not None:
+                        attempt.begin(endpoint)
+                    completion = await endpoint.async_client.chat.completions.create(**request_params)
+                    if attempt is not None:
+                        attempt.on_chunk()
+                    result = self._parse_completion(completion, start if self.collect_metrics else None)
+                except Exception as e:
+                    self._trace(request_params, endpoint, start, error=e)
+                    self.logger.error(f"非流式请求失败: {type(e).__name__}: {str(e)}, API URL: {endpoint.url}")
+                    raise
+                self._trace(request_params, endpoint, start, result=result)
+                return result
 
     def _extract_reasoning_from_delta(self, delta):
         """Extract reasoning from a stream delta chunk.
@@ -345,57 +1042,256 @@ class BaseGeneralApi(BaseAPIModel):
 
         return False, None
 
-    def generate_stream(self, messages):
-        with self._client_lock:
-            request_params = self._build_request_params(messages, stream=True)
-            self.logger.info(f"完整请求参数: {json.dumps(request_params, indent=2, ensure_ascii=False)}")
+    @staticmethod
+    def _new_stream_state(start: Optional[float] = None) -> Dict:
+        # pieces are collected in lists and joined once in `_finish_stream`,
+        # 'text' stays None until the first piece to tell "no content" apart
+        # from an empty answer
+        state = {'text': None, 'reasoning': [], 'has_reasoning_field': False}
+        if start is not None:
+            state['timing'] = {
+                'start': start,
+                'first_token': None,
+                'first_content': None,
+                'content_chunks': 0,
+                'reasoning_chunks': 0,
+                'usage': None,
+            }
+        return state
+
+    def _consume_stream_chunk(self, state: Dict, chunk) -> None:
+        """Fold one streamed chunk into the accumulated stream state."""
+        timing = state.get('timing')
+        if timing is not None and getattr(chunk, 'usage', None) is not None:
+            timing['usage'] = chunk.usage
+        if not chunk.choices:
+            return
+        delta = chunk.choices[0].delta
+        if not delta:
+            return
+
+        has_content, content_val = self._extract_message_field(delta, 'content')
+        if not has_content:
+            content_val = None
+        has_rc, rc_val = self._extract_message_field(delta, 'reasoning_content')
+        has_reasoning, reasoning_val = False, None
+        if self.PARSE_REASONING:
+            has_reasoning, reasoning_val = self._extract_reasoning_from_delta(delta)
+        self._fold_delta(state, content_val, has_rc, rc_val, has_reasoning, reasoning_val)
+
+    def _consume_raw_chunk(self, state: Dict, data: Dict) -> None:
+        """Same as `_consume_stream_chunk` for a chunk decoded into a plain
+        dict, without building any pydantic object."""
+        timing = state.get('timing')
+        if timing is not None and data.get('usage') is not None:
+            timing['usage'] = data['usage']
+        choices = data.get('choices')
+        if not choices:
+            return
+        delta = choices[0].get('delta')
+        if not delta:
+            return
+
+        has_reasoning, reasoning_val = False, None
+        if self.PARSE_REASONING and 'reasoning' in delta:
+            has_reasoning, reasoning_val = True, delta['reasoning'] or None
+        self._fold_delta(state, delta.get('content'), 'reasoning_content' in delta,
+                         delta.get('reasoning_content'), has_reasoning, reasoning_val)
+
+    def _fold_delta(self, state: Dict, content_val, has_rc: bool, rc_val,
+                    has_reasoning: bool, reasoning_val) -> None:
+        # Accumulate content
+        piece = None
+        if content_val is not None:
+            piece = content_val
+        elif has_rc:
+            piece = '' if rc_val is None else rc_val
+        if piece is not None:
+            if state['text'] is None:
+                state['text'] = [piece]
+            else:
+                state['text'].append(piece)
+
+        # Accumulate reasoning
+        if has_reasoning:
+            state['has_reasoning_field'] = True
+        if reasoning_val:
+            state['reasoning'].append(reasoning_val)
+
+        timing = state.get('timing')
+        if timing is not None:
+            now = time.monotonic()
+            if content_val:
+                timing['content_chunks'] += 1
+                if timing['first_content'] is None:
+                    timing['first_content'] = now
+            if rc_val or reasoning_val:
+                timing['reasoning_chunks'] += 1
+            if timing['first_token'] is None and (
+                    timing['content_chunks'] or timing['reasoning_chunks']):
+                timing['first_token'] = now
+
+    def _consume_sse_event(self, state: Dict, payload: str) -> bool:
+        """Fold the data of one server-sent event into the stream state.
+
+        Returns True once the stream is finished.
+        """
+        if payload.startswith('[DONE]'):
+            return True
+        data = json_loads(payload)
+        if isinstance(data, dict) and data.get('error'):
+            raise RuntimeError(f"流式返回错误: {data['error']}")
+        self._consume_raw_chunk(state, data)
+        return False
+
+    def _raw_stream_request(self, endpoint, params: Dict):
+        """Url, headers and body of a raw streaming chat completion, matching
+        what the OpenAI SDK would send."""
+        body = dict(params)
+        body.update(body.pop('extra_body', None) or {})
+        headers = self._default_headers()
+        headers.update({
+            'Authorization': f"Bearer {endpoint.client.api_key}",
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+        })
+        return f"{endpoint.base_url.rstrip('/')}/chat/completions", headers, json_dumps(body)
+
+    def _raw_stream(self, endpoint, params: Dict, start: Optional[float] = None,
+                    attempt: Optional[HedgeAttempt] = None) -> Dict:
+        """Stream a chat completion over plain httpx and decode the SSE lines
+        directly, see `raw_stream`."""
+        url, headers, body = self._raw_stream_request(endpoint, params)
+        state = self._new_stream_state(start)
+        decoder = SSEDecoder()
+        with self.http_client.stream('POST', url, headers=headers, content=body) as response:
+            if attempt is not None:
+                attempt.bind(response)
+            if response.status_code >= 400:
+                response.read()
+                response.raise_for_status()
+            for line in response.iter_lines():
+                payload = decoder.feed(line)
+                if payload is None:
+                    continue
+                if attempt is not None:
+                    attempt.on_chunk()
+                if self._consume_sse_event(state, payload):
+                    break
+            else:
+                payload = decoder.flush()
+                if payload is not None:
+                    self._consume_sse_event(state, payload)
+        return state
+
+    async def _araw_stream(self, endpoint, params: Dict, start: Optional[float] = None,
+                           attempt: Optional[HedgeAttempt] = None) -> Dict:
+        url, headers, body = self._raw_stream_request(endpoint, params)
+        state = self._new_stream_state(start)
+        decoder = SSEDecoder()
+        async with self.async_http_client.stream('POST', url, headers=headers, content=body) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                payload = decoder.feed(line)
+                if payload is None:
+                    continue
+                if attempt is not None:
+                    attempt.on_chunk()
+                if self._consume_sse_event(state, payload):
+                    break
+            else:
+                payload = decoder.flush()
+                if payload is not None:
+                    self._consume_sse_event(state, payload)
+        return state
+
+    def _finish_stream(self, state: Dict) -> Dict:
+        text = None if state['text'] is None else ''.join(state['text'])
+        result = {'content': text}
+        if self.PARSE_REASONING:
+            reasoning = ''.join(state['reasoning'])
+            if reasoning:
+                result['reasoning'] = reasoning
+            elif state['has_reasoning_field']:
+                result['reasoning'] = None
+        timing = state.get('timing')
+        if timing is not None:
+            result['metrics'] = self._build_metrics(
+                timing['start'], time.monotonic(), timing['usage'], timing)
+
+        self._log_response(result)
+        return result
+
+    def generate_stream(self, messages, attempt: Optional[HedgeAttempt] = None):
+        request_params = self._build_request_params(messages, stream=True)
+        self.wait(self._estimate_request_tokens(request_params))
+        exclude = attempt.exclude if attempt is not None else None
+        with self._request_slot(), self.endpoint_pool.use(exclude) as endpoint:
+            self._log_request(request_params)
+            start = time.monotonic()
             try:
-                stream = self._exponential_backoff_retry(
-                    self.openai_client.chat.completions.create,
-                    **request_params
-                )
-                text = None
-                reasoning = None
-                has_reasoning_field = False
-
-                for chunk in stream:
-                    if not chunk.choices:
-                        continue
-                    delta = chunk.choices[0].delta
-                    if not delta:
-                        continue
-
-                    # Accumulate content
-                    has_content, content_val = self._extract_message_field(delta, 'content')
-                    has_rc, rc_val = self._extract_message_field(delta, 'reasoning_content')
-
-                    if has_content and content_val is not None:
-                        text = self._accumulate_text(text, content_val)
-                    elif has_rc:
-                        text = self._accumulate_text(text, '' if rc_val is None else rc_val)
-
-                    # Accumulate reasoning
-                    if self.PARSE_REASONING:
-                        has_field, cur_val = self._extract_reasoning_from_delta(delta)
-                        if has_field:
-                            has_reasoning_field = True
-                        if cur_val:
-                            reasoning = cur_val if reasoning is None else reasoning + cur_val
-
-                result = {'content': text}
-                if self.PARSE_REASONING:
-                    if reasoning:
-                        result['reasoning'] = reasoning
-                    elif has_reasoning_field:
-                        result['reasoning'] = None
-
-                self.logger.info(f"模型返回内容: {text}")
-                if 'reasoning' in result:
-                    self.logger.info(f"模型返回 reasoning: {result['reasoning']}")
-                return result
+                if attempt is not None:
+                    attempt.begin(endpoint)
+                if self.raw_stream:
+                    state = self._raw_stream(endpoint, request_params, start if self.collect_metrics else None,
+                                             attempt)
+                else:
+                    stream = endpoint.client.chat.completions.create(**request_params)
+                    if attempt is not None:
+                        attempt.bind(stream.response)
+                    state = self._new_stream_state(start if self.collect_metrics else None)
+                    try:
+                        for chunk in stream:
+                            if attempt is not None:
+                                attempt.on_chunk()
+                            self._consume_stream_chunk(state, chunk)
+                    finally:
+                        stream.response.close()
+                result = self._finish_stream(state)
+            except RequestCancelled:
+                raise
             except Exception as e:
-                self.logger.error(f"流式请求失败: {type(e).__name__}: {str(e)}, API URL: {self.api_url}")
+                if attempt is not None:
+                    attempt.check_cancelled(e)
+                self._trace(request_params, endpoint, start, error=e)
+                self.logger.error(f"流式请求失败: {type(e).__name__}: {str(e)}, API URL: {endpoint.url}")
                 raise
+            self._trace(request_params, endpoint, start, result=result)
+            return result
+
+    async def agenerate_stream(self, messages, attempt: Optional[HedgeAttempt] = None):
+        request_params = self._build_request_params(messages, stream=True)
+        await self.rate_limiter.acquire_async(self._estimate_request_tokens(request_params))
+        exclude = attempt.exclude if attempt is not None else None
+        async with self._async_request_slot():
+            with self.endpoint_pool.use(exclude) as endpoint:
+                self._log_request(request_params)
+                start = time.monotonic()
+                try:
+                    if attempt is not None:
+                        attempt.begin(endpoint)
+                    if self.raw_stream:
+                        state = await self._araw_stream(endpoint, request_params,
+                                                        start if self.collect_metrics else None, attempt)
+                    else:
+                        stream = await endpoint.async_client.chat.completions.create(**request_params)
+                        state = self._new_stream_state(start if self.collect_metrics else None)
+                        try:
+                            async for chunk in stream:
+                                if attempt is not None:
+                                    attempt.on_chunk()
+                                self._consume_stream_chunk(state, chunk)
+                        finally:
+                            await stream.response.aclose()
+                    result = self._finish_stream(state)
+                except Exception as e:
+                    self._trace(request_params, endpoint, start, error=e)
+                    self.logger.error(f"流式请求失败: {type(e).__name__}: {str(e)}, API URL: {endpoint.url}")
+                    raise
+                self._trace(request_params, endpoint, start, result=result)
+                return result
 
     def __del__(self):
         try:
@@ -403,3 +1299,11 @@ class BaseGeneralApi(BaseAPIModel):
                 self.http_client.close()
         except Exception:
             pass
+        try:
+            if getattr(self, '_loop_thread', None) is not None:
+                self._loop_thread.run(self.async_http_client.aclose(), timeout=5)
+                self._loop_thread.stop()
+            if getattr(self, '_coordinator_executor', None) is not None:
+                self._coordinator_executor.shutdown(wait=False)
+        except Exception:
+            pass
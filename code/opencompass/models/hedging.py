@@ -0,0 +1,186 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+
+class RequestCancelled(Exception):
+    """Raised inside a request that lost a hedging race. It is neither an
+    error of the replica nor of the request."""
+
+
+class HedgeAttempt:
+    """Per-attempt state shared between a request and its hedging driver.
+
+    The clock of an attempt starts in :meth:`begin`, once it has passed the
+    local rate limit and holds a request slot, so that local queueing is not
+    mistaken for a slow replica. The driver cancels a losing attempt with
+    :meth:`cancel`, which also closes its open response, so that an attempt
+    stuck before its first token gives up its slot right away.
+
+    Args:
+        exclude (Endpoint, optional): Replica the attempt should avoid.
+    """
+
+    def __init__(self, exclude: Any = None):
+        self.exclude = exclude
+        self.endpoint = None
+        self.start = time.monotonic()
+        self.first_token_time: Optional[float] = None
+        # set once the request is sent, or when the attempt is over
+        self.started = threading.Event()
+        # set on the first token or when the attempt is over, whichever
+        # comes first
+        self.responded = threading.Event()
+        self.cancelled = threading.Event()
+        self._response = None
+        self._lock = threading.Lock()
+
+    @property
+    def ttft(self) -> Optional[float]:
+        if self.first_token_time is None:
+            return None
+        return self.first_token_time - self.start
+
+    def begin(self, endpoint: Any):
+        """Called right before the request is sent to ``endpoint``."""
+        if self.cancelled.is_set():
+            raise RequestCancelled()
+        self.endpoint = endpoint
+        self.start = time.monotonic()
+        self.started.set()
+
+    def bind(self, response: Any):
+        """Register the open response (anything with ``close()``) of the
+        attempt, closed if the attempt is cancelled."""
+        with self._lock:
+            if not self.cancelled.is_set():
+                self._response = response
+                return
+        response.close()
+        raise RequestCancelled()
+
+    def cancel(self):
+        """Make the attempt give up, closing its open response so that a
+        read blocked on it fails right away."""
+        with self._lock:
+            self.cancelled.set()
+            response, self._response = self._response, None
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+    def check_cancelled(self, error: BaseException):
+        """Turn an error caused by :meth:`cancel` closing the response into
+        :obj:`RequestCancelled`."""
+        if self.cancelled.is_set():
+            raise RequestCancelled() from error
+
+    def wait_first_token(self, delay: float) -> bool:
+        """Wait until the attempt has a first token or is over, for at most
+        ``delay`` seconds after it was sent. Returns whether it responded."""
+        self.started.wait()
+        return self.responded.wait(
+            max(0., self.start + delay - time.monotonic()))
+
+    def on_chunk(self):
+        """Called for every received chunk (or a whole completion)."""
+        if self.first_token_time is None:
+            self.first_token_time = time.monotonic()
+            self.responded.set()
+        if self.cancelled.is_set():
+            raise RequestCancelled()
+
+    def finish(self):
+        with self._lock:
+            self._response = None
+        self.started.set()
+        self.responded.set()
+
+
+class RequestHedger:
+    """Decides when to hedge a slow request and keeps the bookkeeping.
+
+    Every request reports its time to first token (TTFT). Once ``min_samples``
+    are known, a request that has no first token after the ``percentile`` of
+    the recent TTFTs gets a duplicate, preferably on another replica. The
+    first completion wins and the other one is cancelled. At most
+    ``max_ratio`` of the requests are hedged, bounding the extra load.
+
+    Args:
+        percentile (float): TTFT percentile that triggers a hedge. Defaults
+            to 95.
+        max_ratio (float): Maximum fraction of hedged requests. Defaults to
+            0.1.
+        min_delay (float): Lower bound of the hedging delay in seconds.
+            Defaults to 0.5.
+        min_samples (int): Observed TTFTs needed before hedging starts.
+            Defaults to 20.
+        history (int): Number of recent TTFTs the percentile is taken over.
+            Defaults to 256.
+    """
+
+    def __init__(self,
+                 percentile: float = 95.,
+                 max_ratio: float = 0.1,
+                 min_delay: float = 0.5,
+                 min_samples: int = 20,
+                 history: int = 256):
+        assert 0 < percentile < 100, 'percentile must be in (0, 100)'
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self._ttfts = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self.counters = dict(requests=0,
+                             hedges=0,
+                             hedge_wins=0,
+                             budget_skips=0,
+                             est_saved_s=0.)
+
+    def observe(self, attempt: HedgeAttempt):
+        if attempt.ttft is not None:
+            with self._lock:
+                self._ttfts.append(attempt.ttft)
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait for a first token before hedging, None while
+        there is not enough history."""
+        with self._lock:
+            self.counters['requests'] += 1
+            if len(self._ttfts) < self.min_samples:
+                return None
+            ttfts = sorted(self._ttfts)
+        index = min(len(ttfts) - 1, int(len(ttfts) * self.percentile / 100))
+        return max(self.min_delay, ttfts[index])
+
+    def try_hedge(self) -> bool:
+        with self._lock:
+            if self.counters['hedges'] + 1 > \
+                    self.max_ratio * self.counters['requests']:
+                self.counters['budget_skips'] += 1
+                return False
+            self.counters['hedges'] += 1
+            return True
+
+    def record_win(self, primary: HedgeAttempt, hedge: HedgeAttempt):
+        """Account a race won by the hedge.
+
+        If the primary had no first token yet, it needed at least as long as
+        the hedge spent generating after its own first token, which is taken
+        as a conservative estimate of the latency saved.
+        """
+        with self._lock:
+            self.counters['hedge_wins'] += 1
+            if primary.first_token_time is None and hedge.ttft is not None:
+                generation = time.monotonic() - hedge.first_token_time
+                self.counters['est_saved_s'] += generation
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.counters)
+        stats['est_saved_s'] = round(stats['est_saved_s'], 3)
+        return stats
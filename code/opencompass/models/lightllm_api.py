@@ -1,17 +1,38 @@
 import json
-from concurrent.futures import ThreadPoolExecutor
+import threading
 from typing import Dict, List, Optional
 
-import requests
-
 from opencompass.registry import MODELS
+from opencompass.utils.http_pool import get_http_pool
 from opencompass.utils.logging import get_logger
+from opencompass.utils.retry import RetryError
 
 from .base_api import BaseAPIModel
 
 
 @MODELS.register_module()
 class LightllmAPI(BaseAPIModel):
+    """Model wrapper around a LightLLM ``/generate`` server.
+
+    Args:
+        path (str): Name of the model. Defaults to 'LightllmAPI'.
+        url (str): Url of the ``/generate`` endpoint.
+        max_seq_len (int): The maximum sequence length of the model.
+            Defaults to 2048.
+        meta_template (Dict, optional): The model's meta prompt template.
+        retry (int): Number of retires if the API call fails. Defaults to 2.
+        generation_kwargs (Dict, optional): ``do_sample`` and ``ignore_eos``
+            of the requests.
+        retry_policy (Dict, optional): Keyword arguments of
+            :obj:`RetryPolicy`. Defaults to None.
+        http_pool (Dict, optional): Keyword arguments of :obj:`HTTPPool`,
+            the keep-alive connection pool shared within the process.
+        batch_prompts (int): Number of prompts packed into one request, for
+            servers accepting a list of ``inputs``. The outputs are mapped
+            back by index, prompts whose output is missing are retried one
+            by one. Defaults to 1 (one prompt per request).
+    """
+
     is_api: bool = True
 
     def __init__(
@@ -22,17 +43,26 @@ class LightllmAPI(BaseAPIModel):
             meta_template: Optional[Dict] = None,
             retry: int = 2,
             generation_kwargs: Optional[Dict] = dict(),
+            retry_policy: Optional[Dict] = None,
+            http_pool: Optional[Dict] = None,
+            batch_prompts: int = 1,
     ):
 
         super().__init__(path=path,
                          max_seq_len=max_seq_len,
                          meta_template=meta_template,
                          retry=retry,
-                         generation_kwargs=generation_kwargs)
+                         generation_kwargs=generation_kwargs,
+                         retry_policy=retry_policy)
         self.logger = get_logger()
         self.url = url
+        self.http_pool = get_http_pool(**(http_pool or {}))
         self.do_sample = self.generation_kwargs.get('do_sample', False)
         self.ignore_eos = self.generation_kwargs.get('ignore_eos', False)
+        assert batch_prompts >= 1, 'batch_prompts must be positive'
+        self.batch_prompts = batch_prompts
+        self.batch_counters = dict(requests=0, prompts=0, split=0)
+        self._batch_lock = threading.Lock()
 
     def generate(self, inputs: List[str], max_out_len: int,
                  **kwargs) -> List[str]:
@@ -47,40 +77,94 @@ class LightllmAPI(BaseAPIModel):
         Returns:
             List[str]: A list of generated strings.
         """
+        if self.batch_prompts > 1:
+            # every request shares the parameters of the call, so packing
+            # prompts keeps each prompt's settings
+            chunks = [
+                inputs[i:i + self.batch_prompts]
+                for i in range(0, len(inputs), self.batch_prompts)
+            ]
+            outputs = self.http_pool.executor.map(
+                self._generate_batch, chunks, [max_out_len] * len(chunks))
+            return [result for chunk in outputs for result in chunk]
 
-        with ThreadPoolExecutor() as executor:
-            results = list(
-                executor.map(self._generate, inputs,
-                             [max_out_len] * len(inputs)))
+        results = list(
+            self.http_pool.executor.map(self._generate, inputs,
+                                        [max_out_len] * len(inputs)))
         return results
 
+    def _build_data(self, inputs, max_out_len: int) -> Dict:
+        return dict(inputs=inputs,
+                    parameters=dict(do_sample=self.do_sample,
+                                    ignore_eos=self.ignore_eos,
+                                    max_new_tokens=max_out_len))
+
     def _generate(self, input: str, max_out_len: int) -> str:
-        max_num_retries = 0
-        while max_num_retries < self.retry:
-            self.wait()
-            header = {'content-type': 'application/json'}
-            try:
-                data = dict(inputs=input,
-                            parameters=dict(do_sample=self.do_sample,
-                                            ignore_eos=self.ignore_eos,
-                                            max_new_tokens=max_out_len))
-                raw_response = requests.post(self.url,
-                                             headers=header,
-                                             data=json.dumps(data))
-            except requests.ConnectionError:
-                self.logger.error('Got connection error, retrying...')
-                continue
-            try:
-                response = raw_response.json()
-                generated_text = response['generated_text']
-                if isinstance(generated_text, list):
-                    generated_text = generated_text[0]
-                return generated_text
-            except requests.JSONDecodeError:
-                self.logger.error('JsonDecode error, got',
-                                  str(raw_response.content))
-            max_num_retries += 1
-
-        raise RuntimeError('Calling LightllmAPI failed after retrying for '
-                           f'{max_num_retries} times. Check the logs for '
-                           'details.')
+        data = self._build_data(input, max_out_len)
+        try:
+            return self.retry_policy.run(self._request, data, key=self.url)
+        except RetryError as e:
+            raise RuntimeError('Calling LightllmAPI failed after retrying for '
+                               f'{e.attempts} times. Check the logs for '
+                               'details.') from e
+
+    def _generate_batch(self, inputs: List[str],
+                        max_out_len: int) -> List[str]:
+        """Generate a chunk of prompts in one request, falling back to one
+        request per prompt for the outputs the batch did not deliver."""
+        data = self._build_data(inputs, max_out_len)
+        try:
+            outputs = self.retry_policy.run(self._request_batch,
+                                            data,
+                                            len(inputs),
+                                            key=self.url)
+        except RetryError as e:
+            self.logger.warning(f'Batched request of {len(inputs)} prompts '
+                                f'failed ({e}), sending them one by one.')
+            outputs = [None] * len(inputs)
+        failed = [i for i, output in enumerate(outputs) if output is None]
+        with self._batch_lock:
+            self.batch_counters['requests'] += 1
+            self.batch_counters['prompts'] += len(inputs)
+            self.batch_counters['split'] += len(failed)
+        for i in failed:
+            outputs[i] = self._generate(inputs[i], max_out_len)
+        return outputs
+
+    def _post(self, data: Dict) -> Dict:
+        self.wait()
+        header = {'content-type': 'application/json'}
+        raw_response = self.http_pool.post(self.url,
+                                           headers=header,
+                                           data=json.dumps(data))
+        raw_response.raise_for_status()
+        try:
+            return raw_response.json()
+        except json.JSONDecodeError:
+            self.logger.error('JsonDecode error, got '
+                              f'{str(raw_response.content)}')
+            raise
+
+    def _request(self, data: Dict) -> str:
+        generated_text = self._post(data)['generated_text']
+        if isinstance(generated_text, list):
+            generated_text = generated_text[0]
+        return generated_text
+
+    def _request_batch(self, data: Dict,
+                       num_inputs: int) -> List[Optional[str]]:
+        generated_text = self._post(data).get('generated_text')
+        if not isinstance(generated_text, list) or \
+                len(generated_text) != num_inputs:
+            # the server does not batch, split rather than retry
+            return [None] * num_inputs
+        return [
+            text if isinstance(text, str) else None
+            for text in generated_text
+        ]
+
+    def get_stats(self) -> Dict[str, Dict]:
+        stats = super().get_stats()
+        if self.batch_counters['requests']:
+            stats['batching'] = dict(self.batch_counters)
+        return stats
@@ -1,16 +1,13 @@
 import json
 import os
 import re
-import time
-from concurrent.futures import ThreadPoolExecutor
 from threading import Lock
 from typing import Dict, List, Optional, Union
 
-import jieba
-import requests
-
 from opencompass.registry import MODELS
+from opencompass.utils.http_pool import get_http_pool
 from opencompass.utils.prompt import PromptList
+from opencompass.utils.retry import FatalAPIError, RetryError
 
 from .base_api import BaseAPIModel
 
@@ -50,6 +47,14 @@ class OpenAI(BaseAPIModel):
         temperature (float, optional): What sampling temperature to use.
             If not None, will override the temperature in the `generate()`
             call. Defaults to None.
+        retry_policy (Dict, optional): Keyword arguments of
+            :obj:`RetryPolicy`. Defaults to None.
+        http_pool (Dict, optional): Keyword arguments of :obj:`HTTPPool`,
+            the keep-alive connection pool shared within the process.
+            Defaults to None.
+        tokenizer_service (Dict, optional): Keyword arguments of
+            :obj:`TokenizerService`. Defaults to the tiktoken encoding of
+            ``path``.
     """
 
     is_api: bool = True
@@ -65,16 +70,22 @@ class OpenAI(BaseAPIModel):
                  meta_template: Optional[Dict] = None,
                  openai_api_base: str = OPENAI_API_BASE,
                  mode: str = 'none',
-                 temperature: Optional[float] = None):
-
-        super().__init__(path=path,
-                         max_seq_len=max_seq_len,
-                         meta_template=meta_template,
-                         query_per_second=query_per_second,
-                         rpm_verbose=rpm_verbose,
-                         retry=retry)
-        import tiktoken
-        self.tiktoken = tiktoken
+                 temperature: Optional[float] = None,
+                 retry_policy: Optional[Dict] = None,
+                 http_pool: Optional[Dict] = None,
+                 tokenizer_service: Optional[Dict] = None):
+
+        super().__init__(
+            path=path,
+            max_seq_len=max_seq_len,
+            meta_template=meta_template,
+            query_per_second=query_per_second,
+            rpm_verbose=rpm_verbose,
+            retry=retry,
+            retry_policy=retry_policy,
+            tokenizer_service=tokenizer_service
+            or dict(backend='tiktoken', name=path))
+        self.http_pool = get_http_pool(**(http_pool or {}))
         self.temperature = temperature
         assert mode in ['none', 'front', 'mid', 'rear']
         self.mode = mode
@@ -124,11 +135,10 @@ class OpenAI(BaseAPIModel):
         if self.temperature is not None:
             temperature = self.temperature
 
-        with ThreadPoolExecutor() as executor:
-            results = list(
-                executor.map(self._generate, inputs,
-                             [max_out_len] * len(inputs),
-                             [temperature] * len(inputs)))
+        results = list(
+            self.http_pool.executor.map(self._generate, inputs,
+                                        [max_out_len] * len(inputs),
+                                        [temperature] * len(inputs)))
         return results
 
     def _generate(self, input: str or PromptList, max_out_len: int,
@@ -184,94 +194,89 @@ class OpenAI(BaseAPIModel):
         if max_out_len <= 0:
             return ''
 
-        max_num_retries = 0
-        while max_num_retries < self.retry:
-            self.wait()
+        try:
+            return self.retry_policy.run(self._request,
+                                         messages,
+                                         max_out_len,
+                                         temperature,
+                                         key=self.url)
+        except RetryError as e:
+            raise RuntimeError('Calling OpenAI failed after retrying for '
+                               f'{e.attempts} times. Check the logs for '
+                               'details.') from e
+
+    def _request(self, messages: List[Dict], max_out_len: int,
+                 temperature: float) -> str:
+        """Send one chat completion request, raising on any failure so that
+        the retry policy decides what happens next."""
+        self.wait()
+
+        with Lock():
+            if len(self.invalid_keys) == len(self.keys):
+                raise FatalAPIError('All keys have insufficient quota.')
+
+            # find the next valid key
+            while True:
+                self.key_ctr += 1
+                if self.key_ctr == len(self.keys):
+                    self.key_ctr = 0
+
+                if self.keys[self.key_ctr] not in self.invalid_keys:
+                    break
+
+            key = self.keys[self.key_ctr]
+
+        header = {
+            'Authorization': f'Bearer {key}',
+            'content-type': 'application/json',
+        }
 
+        if self.orgs:
             with Lock():
-                if len(self.invalid_keys) == len(self.keys):
-                    raise RuntimeError('All keys have insufficient quota.')
-
-                # find the next valid key
-                while True:
-                    self.key_ctr += 1
-                    if self.key_ctr == len(self.keys):
-                        self.key_ctr = 0
-
-                    if self.keys[self.key_ctr] not in self.invalid_keys:
-                        break
-
-                key = self.keys[self.key_ctr]
-
-            header = {
-                'Authorization': f'Bearer {key}',
-                'content-type': 'application/json',
-            }
-
-            if self.orgs:
-                with Lock():
-                    self.org_ctr += 1
-                    if self.org_ctr == len(self.orgs):
-                        self.org_ctr = 0
-                header['OpenAI-Organization'] = self.orgs[self.org_ctr]
-
-            try:
-                data = dict(
-                    model=self.path,
-                    messages=messages,
-                    max_tokens=max_out_len,
-                    n=1,
-                    stop=None,
-                    temperature=temperature,
-                )
-                raw_response = requests.post(self.url,
-                                             headers=header,
-                                             data=json.dumps(data))
-            except requests.ConnectionError:
-                self.logger.error('Got connection error, retrying...')
-                continue
-            try:
-                response = raw_response.json()
-            except requests.JSONDecodeError:
-                self.logger.error('JsonDecode error, got',
-                                  str(raw_response.content))
-                continue
-            try:
-                return response['choices'][0]['message']['content'].strip()
-            except KeyError:
-                if 'error' in response:
-                    if response['error']['code'] == 'rate_limit_exceeded':
-                        time.sleep(1)
-                        continue
-                    elif response['error']['code'] == 'insufficient_quota':
-                        self.invalid_keys.add(key)
-                        self.logger.warn(f'insufficient_quota key: {key}')
-                        continue
-
-                    self.logger.error('Find error message in response: ',
-                                      str(response['error']))
-            max_num_retries += 1
-
-        raise RuntimeError('Calling OpenAI failed after retrying for '
-                           f'{max_num_retries} times. Check the logs for '
-                           'details.')
-
-    def get_token_len(self, prompt: str) -> int:
-        """Get lengths of the tokenized string. Only English and Chinese
-        characters are counted for now. Users are encouraged to override this
-        method if more accurate length is needed.
-
-        Args:
-            prompt (str): Input string.
-
-        Returns:
-            int: Length of the input tokens
-        """
-        enc = self.tiktoken.encoding_for_model(self.path)
-        return len(enc.encode(prompt))
+                self.org_ctr += 1
+                if self.org_ctr == len(self.orgs):
+                    self.org_ctr = 0
+            header['OpenAI-Organization'] = self.orgs[self.org_ctr]
+
+        data = dict(
+            model=self.path,
+            messages=messages,
+            max_tokens=max_out_len,
+            n=1,
+            stop=None,
+            temperature=temperature,
+        )
+        raw_response = self.http_pool.post(self.url,
+                                           headers=header,
+                                           data=json.dumps(data))
+        try:
+            response = raw_response.json()
+        except json.JSONDecodeError:
+            self.logger.error('JsonDecode error, got '
+                              f'{str(raw_response.content)}')
+            raise
+        try:
+            return response['choices'][0]['message']['content'].strip()
+        except KeyError:
+            if 'error' not in response:
+                raise
+        error = response['error']
+        if error['code'] == 'insufficient_quota':
+            # the next attempt picks another key
+            self.invalid_keys.add(key)
+            self.logger.warn(f'insufficient_quota key: {key}')
+        elif error['code'] != 'rate_limit_exceeded':
+            self.logger.error(
+                f'Find error message in response: {str(error)}')
+        raise RuntimeError(f'OpenAI error {error["code"]}: '
+                           f'{error.get("message")}')
 
     def bin_trim(self, prompt: str, num_token: int) -> str:
-        """Get a suffix of prompt which is no longer than num_token tokens.
+        """Get a part of prompt which is no longer than num_token tokens,
+        truncated according to ``mode``.
+
+        The prompt is tokenized once and cut at token boundaries, see
+        :meth:`TokenizerService.trim`.
 
         Args:
             prompt (str): Input string.
@@ -280,39 +285,7 @@ class OpenAI(BaseAPIModel):
         Returns:
             str: The trimmed prompt.
         """
-        token_len = self.get_token_len(prompt)
-        if token_len <= num_token:
-            return prompt
-        pattern = re.compile(r'[\u4e00-\u9fa5]')
-        if pattern.search(prompt):
-            words = list(jieba.cut(prompt, cut_all=False))
-            sep = ''
-        else:
-            words = prompt.split(' ')
-            sep = ' '
-
-        l, r = 1, len(words)
-        while l + 2 < r:
-            mid = (l + r) // 2
-            if self.mode == 'front':
-                cur_prompt = sep.join(words[-mid:])
-            elif self.mode == 'mid':
-                cur_prompt = sep.join(words[:mid]) + sep.join(words[-mid:])
-            elif self.mode == 'rear':
-                cur_prompt = sep.join(words[:mid])
-
-            if self.get_token_len(cur_prompt) <= num_token:
-                l = mid  # noqa: E741
-            else:
-                r = mid
-
-        if self.mode == 'front':
-            prompt = sep.join(words[-l:])
-        elif self.mode == 'mid':
-            prompt = sep.join(words[:l]) + sep.join(words[-l:])
-        elif self.mode == 'rear':
-            prompt = sep.join(words[:l])
-        return prompt
+        return self.tokenizer_service.trim(prompt, num_token, self.mode)
 
 
 class OpenAIAllesAPIN(OpenAI):
@@ -329,6 +302,11 @@ class OpenAIAllesAPIN(OpenAI):
             template if needed, in case the requirement of injecting or
             wrapping of any meta instructions.
         retry (int): Number of retires if the API call fails. Defaults to 2.
+        retry_policy (Dict, optional): Keyword arguments of
+            :obj:`RetryPolicy`. Defaults to None.
+        http_pool (Dict, optional): Keyword arguments of :obj:`HTTPPool`,
+            the keep-alive connection pool shared within the process.
+            Defaults to None.
     """
 
     is_api: bool = True
@@ -342,13 +320,17 @@ class OpenAIAllesAPIN(OpenAI):
                  rpm_verbose: bool = False,
                  max_seq_len: int = 2048,
                  meta_template: Optional[Dict] = None,
-                 retry: int = 2):
+                 retry: int = 2,
+                 retry_policy: Optional[Dict] = None,
+                 http_pool: Optional[Dict] = None):
         super().__init__(path=path,
                          max_seq_len=max_seq_len,
                          query_per_second=query_per_second,
                          rpm_verbose=rpm_verbose,
                          meta_template=meta_template,
-                         retry=retry)
+                         retry=retry,
+                         retry_policy=retry_policy,
+                         http_pool=http_pool)
         self.url = url
         self.temperature = temperature
         self.headers = {
@@ -398,55 +380,35 @@ class OpenAIAllesAPIN(OpenAI):
             'messages': messages,
             'temperature': temperature
         }
-        for _ in range(self.retry):
-            self.wait()
-            try:
-                raw_response = requests.post(self.url,
-                                             headers=self.headers,
-                                             data=json.dumps(data))
-            except requests.ConnectionError:
-                self.logger.error('Request error, got',
-                                  str(raw_response.content))
-                time.sleep(1)
-                continue
-            try:
-                response = raw_response.json()
-            except requests.JSONDecodeError:
-                self.logger.error('JsonDecode error, got',
-                                  str(raw_response.content))
-                time.sleep(1)
-                continue
-            if raw_response.status_code == 200 and response[
-                'msgCode'] == '10000':
-                data = response['data']
-                choices = data['choices']
-                if choices is None:
-                    self.logger.error(data)
-                else:
-                    return choices[0]['message']['content'].strip()
-            try:
-                match = re.match(r'Error code: \d+ - (.*)', response['data'])
-                err = eval(match.group(1))['error']
-                if err['code'] == 'content_filter' and err['status'] == 400:
-                    return err['message']
-            except Exception:
-                pass
-            self.logger.error(response['msg'])
-            self.logger.error(response)
-            time.sleep(1)
-
-        raise RuntimeError('API call failed.')
-
-    def get_token_len(self, prompt: str) -> int:
-        """Get lengths of the tokenized string. Only English and Chinese
-        characters are counted for now. Users are encouraged to override this
-        method if more accurate length is needed.
-
-        Args:
-            prompt (str): Input string.
-
-        Returns:
-            int: Length of the input tokens
-        """
-        enc = self.tiktoken.encoding_for_model(self.path)
-        return len(enc.encode(prompt))
+        try:
+            return self.retry_policy.run(self._request, data, key=self.url)
+        except RetryError as e:
+            raise RuntimeError('API call failed.') from e
+
+    def _request(self, data: Dict) -> str:
+        self.wait()
+        raw_response = self.http_pool.post(self.url,
+                                           headers=self.headers,
+                                           data=json.dumps(data))
+        try:
+            response = raw_response.json()
+        except json.JSONDecodeError:
+            self.logger.error('JsonDecode error, got '
+                              f'{str(raw_response.content)}')
+            raise
+        if raw_response.status_code == 200 and response['msgCode'] == '10000':
+            choices = response['data']['choices']
+            if choices is None:
+                self.logger.error(response['data'])
+            else:
+                return choices[0]['message']['content'].strip()
+        try:
+            match = re.match(r'Error code: \d+ - (.*)', response['data'])
+            err = eval(match.group(1))['error']
+            if err['code'] == 'content_filter' and err['status'] == 400:
+                return err['message']
+        except Exception:
+            pass
+        self.logger.error(response['msg'])
+        self.logger.error(response)
+        raise RuntimeError(f'AllesAPIN error: {response["msg"]}')
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import os.path as osp
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from opencompass.utils import get_logger
+
+
+class ResponseCache:
+    """Persistent content-addressed cache of API responses backed by SQLite.
+
+    Entries are keyed by a hash of everything that determines the response
+    (see :meth:`make_key`), so a rerun with different shard boundaries or
+    after a crash can reuse every completion that was already paid for. The
+    database runs in WAL mode and can be shared by the processes of one run.
+
+    Args:
+        path (str): Path of the SQLite file. Defaults to
+            '.cache/api_responses.sqlite'.
+        ttl (float, optional): Seconds after which an entry expires. Defaults
+            to None (never).
+        max_entries (int, optional): Keep at most this many entries, evicting
+            the least recently used. Defaults to None (unbounded).
+        readonly (bool): Only serve hits and never write, e.g. for
+            reproducible re-scoring. Defaults to False.
+    """
+
+    EVICT_EVERY = 256
+
+    def __init__(self,
+                 path: str = '.cache/api_responses.sqlite',
+                 ttl: Optional[float] = None,
+                 max_entries: Optional[int] = None,
+                 readonly: bool = False):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.readonly = readonly
+        self.logger = get_logger()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.counters = dict(hits=0, misses=0, writes=0, evictions=0)
+
+        if readonly:
+            self._conn = sqlite3.connect(f'file:{path}?mode=ro',
+                                         uri=True,
+                                         check_same_thread=False,
+                                         timeout=30)
+        else:
+            if osp.dirname(path):
+                os.makedirs(osp.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path,
+                                         check_same_thread=False,
+                                         timeout=30)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                               'key TEXT PRIMARY KEY, '
+                               'value TEXT NOT NULL, '
+                               'created REAL NOT NULL, '
+                               'accessed REAL NOT NULL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed '
+                               'ON responses (accessed)')
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(**parts) -> str:
+        """Hash the parts that determine a response into a cache key."""
+        payload = json.dumps(parts,
+                             sort_keys=True,
+                             ensure_ascii=False,
+                             default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, created FROM responses WHERE key = ?',
+                (key, )).fetchone()
+            if row is None or (self.ttl is not None
+                               and now - row[1] > self.ttl):
+                self.counters['misses'] += 1
+                return None
+            self.counters['hits'] += 1
+            if not self.readonly:
+                self._conn.execute(
+                    'UPDATE responses SET accessed = ? WHERE key = ?',
+                    (now, key))
+                self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Dict):
+        if self.readonly:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), now, now))
+            self._conn.commit()
+            self.counters['writes'] += 1
+            self._puts += 1
+            if self._puts % self.EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        evicted = 0
+        if self.ttl is not None:
+            evicted += self._conn.execute(
+                'DELETE FROM responses WHERE created < ?',
+                (now - self.ttl, )).rowcount
+        if self.max_entries is not None:
+            evicted += self._conn.execute(
+                'DELETE FROM responses WHERE key IN (SELECT key FROM '
+                'responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries, )).rowcount
+        self._conn.commit()
+        self.counters['evictions'] += evicted
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self.counters)
+
+    def close(self):
+        with self._lock:
+            if not self.readonly:
+                self._evict(time.time())
+            self._conn.close()
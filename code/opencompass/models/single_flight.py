@@ -0,0 +1,98 @@
+import asyncio
+import threading
+from typing import Any, Dict, Hashable, Tuple
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce identical calls that are in flight at the same time.
+
+    The first caller of a key (the leader) runs the call. Callers arriving
+    with the same key before it finishes wait for it and share its result or
+    error instead of issuing a duplicate request. Only completed calls are
+    forgotten, nothing is cached beyond that, see :obj:`ResponseCache` for
+    persistent reuse.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._async_calls: Dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.counters = dict(calls=0, coalesced=0)
+
+    def _join(self, calls: Dict, key: Hashable, factory) -> Tuple[Any, bool]:
+        with self._lock:
+            self.counters['calls'] += 1
+            call = calls.get(key)
+            if call is not None:
+                self.counters['coalesced'] += 1
+                return call, False
+            call = calls[key] = factory()
+            return call, True
+
+    def do(self, key: Hashable, func, *args, **kwargs) -> Tuple[Any, bool]:
+        """Run ``func(*args, **kwargs)`` once for all concurrent callers of
+        ``key``.
+
+        Returns:
+            Tuple[Any, bool]: The result and whether it was shared from
+            another caller's call.
+        """
+        call, leader = self._join(self._calls, key, _Call)
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    async def ado(self, key: Hashable, func, *args,
+                  **kwargs) -> Tuple[Any, bool]:
+        """Async counterpart of :meth:`do` for a coroutine function. All
+        callers must run on the same event loop."""
+        future, leader = self._join(
+            self._async_calls, key,
+            lambda: asyncio.get_running_loop().create_future())
+        if not leader:
+            return await asyncio.shield(future), True
+        try:
+            result = await func(*args, **kwargs)
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # followers, if any, retrieve it; avoid the "never
+                # retrieved" warning otherwise
+                future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._async_calls[key]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.counters)
+        if stats['calls']:
+            stats['dedup_ratio'] = round(stats['coalesced'] / stats['calls'],
+                                         4)
+        return stats
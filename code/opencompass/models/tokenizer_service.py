@@ -0,0 +1,223 @@
+import functools
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from opencompass.utils import get_logger
+
+# an English word or digit run counts as one token, a Chinese character too
+_HEURISTIC_TOKEN = re.compile(r'[A-Za-z0-9]+|[\u4e00-\u9FFF]')
+
+
+def heuristic_token_len(text: str) -> int:
+    """Rough token count of ``text``: English words and digit runs plus
+    Chinese characters, in a single regex pass."""
+    return len(_HEURISTIC_TOKEN.findall(text))
+
+
+class TokenizerService:
+    """Prompt length accounting of a model, loaded once and cached.
+
+    Token counts are kept in an LRU cache keyed by the hash and length of the
+    string, so the many repeated prompts, in-context examples and candidate
+    truncations of a dataset are only tokenized once, and the strings
+    themselves are not kept alive. Uncached strings of a batch are tokenized
+    together, which the tiktoken and fast HuggingFace tokenizers parallelize.
+
+    Args:
+        backend (str): 'heuristic' counts English words and Chinese
+            characters, 'tiktoken' and 'huggingface' run a real tokenizer.
+            Defaults to 'heuristic'.
+        name (str, optional): Model or encoding name of tiktoken, or the
+            name or path of a HuggingFace tokenizer. Required by the real
+            backends.
+        cache_size (int): Number of cached counts. 0 disables the cache.
+            Defaults to 65536.
+        tokenizer_kwargs (Dict, optional): Extra arguments of
+            ``AutoTokenizer.from_pretrained``. Defaults to
+            ``dict(trust_remote_code=True)``.
+    """
+
+    BACKENDS = ('heuristic', 'tiktoken', 'huggingface')
+
+    def __init__(self,
+                 backend: str = 'heuristic',
+                 name: Optional[str] = None,
+                 cache_size: int = 65536,
+                 tokenizer_kwargs: Optional[Dict] = None):
+        assert backend in self.BACKENDS, \
+            f'backend must be one of {self.BACKENDS}, got {backend}'
+        assert backend == 'heuristic' or name, \
+            f'the {backend} backend needs a tokenizer name'
+        self.backend = backend
+        self.name = name
+        self.cache_size = cache_size
+        self.tokenizer_kwargs = tokenizer_kwargs or dict(
+            trust_remote_code=True)
+        self._tokenizer = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.counters = dict(hits=0, misses=0)
+        self.logger = get_logger()
+
+    @property
+    def tokenizer(self):
+        """The underlying tiktoken encoding or HuggingFace tokenizer, loaded
+        on first use. None for the heuristic backend."""
+        if self._tokenizer is None and self.backend != 'heuristic':
+            with self._load_lock:
+                if self._tokenizer is None:
+                    self._tokenizer = self._load()
+        return self._tokenizer
+
+    def _load(self):
+        if self.backend == 'tiktoken':
+            import tiktoken
+            try:
+                return tiktoken.encoding_for_model(self.name)
+            except KeyError:
+                try:
+                    return tiktoken.get_encoding(self.name)
+                except ValueError:
+                    self.logger.warning(
+                        f'No tiktoken encoding for {self.name}, counting '
+                        'with cl100k_base.')
+                    return tiktoken.get_encoding('cl100k_base')
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(self.name,
+                                             **self.tokenizer_kwargs)
+
+    def encode(self, text: str) -> List[int]:
+        """Token ids of ``text``, not cached. The heuristic backend has no
+        ids and raises."""
+        if self.backend == 'tiktoken':
+            return self.tokenizer.encode(text, disallowed_special=())
+        if self.backend == 'huggingface':
+            return self.tokenizer.encode(text, add_special_tokens=False)
+        raise NotImplementedError('the heuristic backend has no token ids')
+
+    def token_offsets(self, text: str) -> Optional[List[int]]:
+        """Character offset in ``text`` where each token starts, from a
+        single tokenization. None if the tokenizer cannot map tokens back to
+        characters (slow HuggingFace tokenizers)."""
+        if self.backend == 'heuristic':
+            return [m.start() for m in _HEURISTIC_TOKEN.finditer(text)]
+        if self.backend == 'tiktoken':
+            # the byte-level encoding round-trips, so the offsets of the
+            # decoded text are offsets of ``text``
+            _, offsets = self.tokenizer.decode_with_offsets(self.encode(text))
+            return offsets
+        if not getattr(self.tokenizer, 'is_fast', False):
+            return None
+        encoded = self.tokenizer(text,
+                                 add_special_tokens=False,
+                                 return_offsets_mapping=True)
+        return [start for start, _ in encoded['offset_mapping']]
+
+    def trim(self, text: str, num_tokens: int, mode: str) -> str:
+        """Cut ``text`` down to at most ``num_tokens`` tokens.
+
+        The text is tokenized once and cut at token boundaries through the
+        offset map, so the kept parts are verbatim slices of ``text``.
+
+        Args:
+            text (str): Input string.
+            num_tokens (int): The upper bound of token numbers.
+            mode (str): Which part to truncate: 'front' keeps the end,
+                'rear' keeps the beginning and 'mid' keeps both ends.
+
+        Returns:
+            str: The trimmed text.
+        """
+        assert mode in ('front', 'mid', 'rear'), f'unknown mode {mode}'
+        num_tokens = max(0, num_tokens)
+        offsets = self.token_offsets(text)
+        if offsets is None:
+            return self._trim_ids(text, num_tokens, mode)
+        if len(offsets) <= num_tokens:
+            return text
+        head = num_tokens - num_tokens // 2 if mode == 'mid' else num_tokens
+        tail = num_tokens - head if mode == 'mid' else num_tokens
+        if mode == 'front':
+            return text[offsets[len(offsets) - tail]:] if tail else ''
+        if mode == 'rear':
+            return text[:offsets[head]]
+        kept = text[:offsets[head]]
+        if tail:
+            kept += text[offsets[len(offsets) - tail]:]
+        return kept
+
+    def _trim_ids(self, text: str, num_tokens: int, mode: str) -> str:
+        ids = self.encode(text)
+        if len(ids) <= num_tokens:
+            return text
+        decode = functools.partial(self.tokenizer.decode,
+                                   skip_special_tokens=True)
+        if mode == 'front':
+            return decode(ids[len(ids) - num_tokens:]) if num_tokens else ''
+        if mode == 'rear':
+            return decode(ids[:num_tokens])
+        head = num_tokens - num_tokens // 2
+        tail = num_tokens - head
+        return decode(ids[:head]) + (decode(ids[len(ids) - tail:])
+                                     if tail else '')
+
+    def _count_uncached(self, texts: List[str]) -> List[int]:
+        if self.backend == 'heuristic':
+            return [heuristic_token_len(text) for text in texts]
+        if self.backend == 'tiktoken':
+            if len(texts) == 1:
+                return [len(self.encode(texts[0]))]
+            return [
+                len(ids) for ids in self.tokenizer.encode_batch(
+                    texts, disallowed_special=())
+            ]
+        return [
+            len(ids) for ids in self.tokenizer(
+                texts, add_special_tokens=False)['input_ids']
+        ]
+
+    def count(self, text: str) -> int:
+        """Number of tokens of ``text``."""
+        return self.count_batch([text])[0]
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        """Numbers of tokens of ``texts``, tokenizing the uncached ones in
+        one batch."""
+        if not self.cache_size:
+            return self._count_uncached(list(texts))
+        keys = [(hash(text), len(text)) for text in texts]
+        counts = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                count = self._cache.get(key)
+                if count is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    self._cache.move_to_end(key)
+                    counts[i] = count
+            self.counters['hits'] += len(texts) - len(missing)
+            self.counters['misses'] += len(missing)
+        if not missing:
+            return counts
+        fresh = self._count_uncached(
+            [texts[indices[0]] for indices in missing.values()])
+        with self._lock:
+            for (key, indices), count in zip(missing.items(), fresh):
+                for i in indices:
+                    counts[i] = count
+                self._cache[key] = count
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return counts
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.counters, backend=self.backend)
+        total = stats['hits'] + stats['misses']
+        if total:
+            stats['hit_rate'] = round(stats['hits'] / total, 4)
+        return stats
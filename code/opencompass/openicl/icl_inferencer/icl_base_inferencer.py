@@ -1,8 +1,10 @@
 """Basic Inferencer."""
 import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 import numpy as np
 from mmengine.dist import is_main_process
@@ -29,6 +31,42 @@ def remove_think_tags(s: str) -> str:
     return s
 
 
+def build_postprocessor(postprocessor_cfg: Dict) -> Callable[[str], Any]:
+    """Build the ``pred_postprocessor`` of a dataset into a function of a raw
+    prediction, which is stripped of its think tags first."""
+    cfg = postprocessor_cfg.copy()
+    proc = cfg.pop('type')
+    if not callable(proc):
+        proc = TEXT_POSTPROCESSORS.get(proc)
+    return lambda prediction: proc(remove_think_tags(prediction), **cfg)
+
+
+def postprocess_results(results_dict: Dict[str, Dict],
+                        postprocessor_cfg: Dict,
+                        overwrite: bool = True) -> int:
+    """Set ``processed_pred`` of the results from their raw ``prediction``.
+
+    Args:
+        results_dict (Dict[str, Dict]): Results by index, as dumped to a
+            prediction file.
+        postprocessor_cfg (Dict): The ``pred_postprocessor`` of the dataset.
+        overwrite (bool): Whether to redo the results already carrying a
+            ``processed_pred``. Defaults to True.
+
+    Returns:
+        int: Number of results postprocessed.
+    """
+    postprocess = build_postprocessor(postprocessor_cfg)
+    num_done = 0
+    for result in results_dict.values():
+        if 'prediction' not in result or (not overwrite
+                                          and 'processed_pred' in result):
+            continue
+        result['processed_pred'] = postprocess(result['prediction'])
+        num_done += 1
+    return num_done
+
+
 class BaseInferencer:
     """Base Inferencer class for all evaluation Inferencer.
 
@@ -112,8 +150,81 @@ class BaseInferencer:
 
 
 def dump_results_dict(results_dict, filename):
-    with open(filename, 'w', encoding='utf-8') as json_file:
+    # write aside and swap, so that a crash never leaves a torn file behind
+    part = f'{filename}.part'
+    with open(part, 'w', encoding='utf-8') as json_file:
         json.dump(results_dict, json_file, indent=4, ensure_ascii=False)
+    os.replace(part, filename)
+
+
+def result_journal_path(save_dir: str, filename: str) -> str:
+    """Path of the checkpoint journal of the predictions ``filename``,
+    e.g. ``tmp_xxx.jsonl`` for ``xxx.json``."""
+    return os.path.join(save_dir,
+                        'tmp_' + os.path.splitext(filename)[0] + '.jsonl')
+
+
+class ResultJournal:
+    """Append-only JSON-lines checkpoint of completed samples.
+
+    Every completed sample is one line ``{"id": ..., "result": ...}`` keyed
+    by its original index, and every append is flushed and fsync'd, so the
+    cost of a checkpoint only depends on the samples it adds, not on how many
+    are already done. A line torn by a crash is dropped on replay.
+
+    Args:
+        path (str): Path of the journal.
+        fsync (bool): Whether to fsync every append. Defaults to True.
+    """
+
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        self._file = None
+
+    def replay(self) -> Dict[str, Dict]:
+        """Results recorded so far, later records of an index winning. A
+        torn tail is cut off so that new records start on a clean line."""
+        results = {}
+        if not os.path.exists(self.path):
+            return results
+        good = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    results[record['id']] = record['result']
+                except (ValueError, KeyError, TypeError):
+                    break
+                good += len(line)
+        if good < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(good)
+        return results
+
+    def append(self, results: Dict[str, Dict]):
+        """Record the results of some samples, one line each."""
+        if not results:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        data = ''.join(
+            json.dumps({'id': idx, 'result': result}, ensure_ascii=False) +
+            '\n' for idx, result in results.items())
+        self._file.write(data.encode('utf-8'))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
 
 
 class GenInferencerOutputHandler:
@@ -124,11 +235,110 @@ class GenInferencerOutputHandler:
 
     def __init__(self) -> None:
         self.results_dict = {}
+        self.journal = None
+        self._postprocess_pool = None
+        self._postprocess_futures = []
+        self._lock = threading.Lock()
 
     def write_to_json(self, save_dir: str, filename: str):
         """Dump the result to a json file."""
         dump_results_dict(self.results_dict, Path(save_dir) / filename)
 
+    def resume(self, journal_path: str, legacy_path: Optional[str] = None):
+        """Rebuild the results by replaying the checkpoint journal, and
+        keep appending completed samples to it. A whole-dict checkpoint of
+        older versions at ``legacy_path`` is carried over."""
+        self.journal = ResultJournal(journal_path)
+        if legacy_path is not None and os.path.exists(legacy_path):
+            try:
+                with open(legacy_path, encoding='utf-8') as f:
+                    legacy = json.load(f)
+            except ValueError:
+                legacy = {}
+            self.journal.append(legacy)
+            os.remove(legacy_path)
+        self.results_dict.update(self.journal.replay())
+
+    def checkpoint(self, indices):
+        """Append the results of the samples at ``indices`` to the
+        journal."""
+        if self.journal is None:
+            return
+        # postprocessing workers may still be adding to the results
+        with self._lock:
+            results = {
+                str(idx): dict(self.results_dict[str(idx)])
+                for idx in indices
+            }
+        self.journal.append(results)
+
+    def start_postprocessing(self, num_workers: int = 1):
+        """Run the postprocessors of :meth:`save_results` on background
+        threads, so that they do not hold up the inference loop. The raw
+        predictions are queued as they are saved."""
+        self._postprocess_pool = ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix='postprocess')
+
+    def finish_postprocessing(self, postprocessor_cfg: Optional[Dict] = None):
+        """Wait for the queued postprocessing, then postprocess the results
+        still lacking ``processed_pred``, e.g. those replayed from a
+        checkpoint taken before their postprocessing was done."""
+        if self._postprocess_pool is not None:
+            futures, self._postprocess_futures = self._postprocess_futures, []
+            try:
+                for future in futures:
+                    future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+                self._postprocess_pool.shutdown()
+                self._postprocess_pool = None
+        if postprocessor_cfg:
+            postprocess_results(self.results_dict,
+                                postprocessor_cfg,
+                                overwrite=False)
+
+    def _postprocess(self, idx: str, prediction, postprocessor_cfg: Dict):
+        processed_pred = build_postprocessor(postprocessor_cfg)(prediction)
+        with self._lock:
+            self.results_dict[idx]['processed_pred'] = processed_pred
+
+    def finalize_journal(self):
+        """Drop the journal once the results are dumped."""
+        if self.journal is not None:
+            self.journal.remove()
+            self.journal = None
+
+    def write_metrics_summary(self, save_dir: str, filename: str):
+        """Dump p50/p95/p99 of the per-sample request metrics next to the
+        predictions, e.g. ``xxx_metrics.json`` for ``xxx.json``. Nothing is
+        written if no sample carries metrics."""
+        metrics = [
+            sample['metrics'] for sample in self.results_dict.values()
+            if isinstance(sample.get('metrics'), dict)
+        ]
+        if not metrics:
+            return
+        summary = {'num_samples': len(metrics)}
+        keys = sorted({key for sample in metrics for key in sample})
+        for key in keys:
+            values = np.array([
+                sample[key] for sample in metrics
+                if isinstance(sample.get(key), (int, float))
+            ])
+            if not len(values):
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary[key] = dict(mean=round(float(values.mean()), 4),
+                                p50=round(float(p50), 4),
+                                p95=round(float(p95), 4),
+                                p99=round(float(p99), 4),
+                                max=round(float(values.max()), 4))
+            if key.endswith('tokens'):
+                summary[key]['total'] = int(values.sum())
+        stem = Path(filename).stem
+        dump_results_dict(summary, Path(save_dir) / f'{stem}_metrics.json')
+
     def save_results(self, origin_prompt, prediction, idx, gold=None, postprocessor_cfg=None):
         # 处理 prediction：可能是字符串或字典
         prediction_content = prediction
@@ -138,16 +348,13 @@ class GenInferencerOutputHandler:
             # 如果是字典，提取 content 和额外字段
             prediction_content = prediction.get('content', '')
             # 提取可能的额外字段（如 reasoning, refusal 等）
-            for key in ['reasoning']:
+            for key in ['reasoning', 'metrics']:
                 if key in prediction:
                     extra_fields[key] = prediction[key]
         elif isinstance(prediction, str):
             # 如果是字符串，保持原样
             prediction_content = prediction
         
-        # 先移除think标签
-        cleaned_prediction = remove_think_tags(prediction_content)
-        
         # 过滤掉空的 SYSTEM 消息，避免在评测结果中显示
         filtered_prompt = origin_prompt
         if isinstance(origin_prompt, (PromptList, list)):
@@ -172,13 +379,16 @@ class GenInferencerOutputHandler:
         
         if gold:
             self.results_dict[str(idx)]['gold'] = gold
-        if postprocessor_cfg:
-            cfg = postprocessor_cfg.copy()
-            proc = cfg.pop('type')
-            if not callable(proc):
-                proc = TEXT_POSTPROCESSORS.get(proc)
-            processed_pred = proc(cleaned_prediction, **cfg)
-            self.results_dict[str(idx)]['processed_pred'] = processed_pred
+        if not postprocessor_cfg:
+            return
+        if self._postprocess_pool is None:
+            self.results_dict[str(idx)]['processed_pred'] = \
+                build_postprocessor(postprocessor_cfg)(prediction_content)
+        else:
+            self._postprocess_futures.append(
+                self._postprocess_pool.submit(self._postprocess, str(idx),
+                                              prediction_content,
+                                              postprocessor_cfg))
 
 
 class PPLInferencerOutputHandler:
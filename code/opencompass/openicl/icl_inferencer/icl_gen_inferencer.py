@@ -1,26 +1,84 @@
 """Direct Generation Inferencer."""
 
+import contextlib
+import functools
 import inspect
 import os
 import os.path as osp
-from typing import List, Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 
-import mmengine
 import torch
 from tqdm import tqdm
 
 from opencompass.models.base import BaseModel
 from opencompass.registry import ICL_INFERENCERS
-from opencompass.utils import batched
+from opencompass.utils import batched, prefetch
+from opencompass.utils.prompt import PromptList
 
 from ..icl_prompt_template import PromptTemplate
 from ..icl_retriever import BaseRetriever
 from ..utils.logging import get_logger
-from .icl_base_inferencer import BaseInferencer, GenInferencerOutputHandler
+from .icl_base_inferencer import (BaseInferencer, GenInferencerOutputHandler,
+                                  result_journal_path)
 
 logger = get_logger(__name__)
 
 
+def _prompt_text(prompt) -> str:
+    """Flatten a rendered prompt into the text the backend sees, so that
+    prompts can be compared by prefix."""
+    if isinstance(prompt, (PromptList, list)):
+        return '\x00'.join(
+            f'{item.get("role", "")}\x01{item.get("prompt", "")}'
+            if isinstance(item, dict) else str(item) for item in prompt)
+    return str(prompt)
+
+
+def _close(iterator):
+    """Stop a prompt generator, and with it its prefetch thread."""
+    close = getattr(iterator, 'close', None)
+    if close is not None:
+        close()
+
+
+def common_prefix_len(a: str, b: str) -> int:
+    """Length of the common prefix of two strings, by a binary search over
+    slice comparisons rather than a per-character loop."""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def shared_prefix_ratio(texts: List[str]) -> float:
+    """Fraction of characters each text shares with the previous one, an
+    estimate of the prompt tokens a server-side prefix cache can reuse when
+    the texts are sent in this order."""
+    total = sum(len(text) for text in texts)
+    if not total:
+        return 0.
+    shared = sum(
+        common_prefix_len(prev, text) for prev, text in zip(texts, texts[1:]))
+    return shared / total
+
+
+def prefix_order(texts: List[str]) -> List[int]:
+    """Order in which prompts sharing a prefix are contiguous.
+
+    Sorting the texts lexicographically walks the prefix trie depth first,
+    so every group of prompts with a common prefix (system prompt, few-shot
+    block, ...) is dispatched back to back instead of being interleaved
+    with other groups.
+    """
+    return sorted(range(len(texts)), key=texts.__getitem__)
+
+
 @ICL_INFERENCERS.register_module()
 class GenInferencer(BaseInferencer):
     """Generation Inferencer class to directly evaluate by generation.
@@ -37,8 +95,32 @@ class GenInferencer(BaseInferencer):
             `JSON` file.
         gen_field_replace_token (:obj:`str`, optional): Used to replace the
             generation field token when generating prompts.
-        save_every (:obj:`int`, optional): Save intermediate results every
-            `save_every` iters. Defaults to 1.
+        save_every (:obj:`int`, optional): Checkpoint the completed samples
+            every `save_every` iters to an append-only journal, which is
+            replayed when the task is resumed. None disables checkpoints.
+            Defaults to 1.
+        prefix_ordering (:obj:`bool`, optional): Dispatch prompts sharing a
+            prefix contiguously to make better use of the server's prefix
+            cache. Results are still saved by dataset index. It sorts the
+            rendered prompts, so it is not available with `lazy_prompts`.
+            Defaults to True for API models without `lazy_prompts` and False
+            otherwise.
+        dispatch_window (:obj:`int`, optional): Number of samples of an API
+            model kept in flight across batch boundaries. A finished sample
+            is replaced by the next one right away instead of waiting for the
+            slowest sample of its batch. Defaults to `batch_size` for API
+            models; 0 keeps the batch by batch loop, which local models,
+            offline batch jobs and models packing several prompts per
+            request always use.
+        lazy_prompts (:obj:`bool`, optional): Render and length-check the
+            prompts on a background thread just ahead of dispatch instead of
+            all of them before the first request. The samples are then
+            dispatched in dataset order, without `prefix_ordering`. Defaults
+            to False.
+        postprocess_workers (:obj:`int`, optional): Number of background
+            threads applying the `pred_postprocessor` to the predictions as
+            they come in, off the inference loop. 0 applies it inline.
+            Defaults to 1.
         generation_kwargs (:obj:`Dict`, optional): Parameters for the
             :obj:`model.generate()` method.
     """
@@ -54,6 +136,10 @@ class GenInferencer(BaseInferencer):
             output_json_filepath: Optional[str] = './icl_inference_output',
             output_json_filename: Optional[str] = 'predictions',
             save_every: Optional[int] = 1,
+            prefix_ordering: Optional[bool] = None,
+            dispatch_window: Optional[int] = None,
+            lazy_prompts: bool = False,
+            postprocess_workers: int = 1,
             **kwargs) -> None:
         super().__init__(
             model=model,
@@ -71,6 +157,16 @@ class GenInferencer(BaseInferencer):
         if self.model.is_api and save_every is None:
             save_every = 1
         self.save_every = save_every
+        self.lazy_prompts = lazy_prompts
+        if prefix_ordering is None:
+            prefix_ordering = self.model.is_api and not self.lazy_prompts
+        elif prefix_ordering and self.lazy_prompts:
+            logger.warning('prefix_ordering needs every prompt rendered '
+                           'upfront, it is disabled with lazy_prompts')
+            prefix_ordering = False
+        self.prefix_ordering = prefix_ordering
+        self.dispatch_window = dispatch_window
+        self.postprocess_workers = postprocess_workers
 
     def inference(self,
                   retriever: BaseRetriever,
@@ -89,94 +185,238 @@ class GenInferencer(BaseInferencer):
 
         # 2. Get results of retrieval process
         ice_idx_list = retriever.retrieve()
-
-        # 3. Generate prompts for testing input
-        prompt_list = self.get_generation_prompt_list_from_retriever_indices(
-            ice_idx_list,
-            retriever,
-            self.gen_field_replace_token,
-            max_seq_len=self.max_seq_len,
-            ice_template=ice_template,
-            prompt_template=prompt_template)
-
-        # 3.1 Fetch and zip prompt & gold answer if output column exists
         ds_reader = retriever.dataset_reader
-        if ds_reader.output_column:
+        has_gold = bool(ds_reader.output_column)
+        gold_ans = None
+        if has_gold:
             gold_ans = ds_reader.dataset['test'][ds_reader.output_column]
-            prompt_list = list(zip(prompt_list, gold_ans))
 
-        # Create tmp json file for saving intermediate results and future
-        # resuming
-        index = 0
-        tmp_json_filepath = os.path.join(output_json_filepath,
-                                         'tmp_' + output_json_filename)
-        if osp.exists(tmp_json_filepath):
-            # TODO: move resume to output handler
-            try:
-                tmp_result_dict = mmengine.load(tmp_json_filepath)
-            except Exception:
-                pass
-            else:
-                output_handler.results_dict = tmp_result_dict
-                index = len(tmp_result_dict)
-
-        # 4. Wrap prompts with Dataloader
-        dataloader = self.get_dataloader(prompt_list[index:], self.batch_size)
+        # 3. Replay the checkpoint journal of an interrupted run, completed
+        # samples are appended to it as they come in
+        if self.save_every is not None and self.is_main_process:
+            os.makedirs(output_json_filepath, exist_ok=True)
+            output_handler.resume(
+                result_journal_path(output_json_filepath,
+                                    output_json_filename),
+                legacy_path=osp.join(output_json_filepath,
+                                     'tmp_' + output_json_filename))
+        pending = [
+            i for i in range(len(ice_idx_list))
+            if str(i) not in output_handler.results_dict
+        ]
 
-        # 5. Inference for prompts in each batch
+        # 4. Generate prompts for testing input, either all upfront or on a
+        # background thread just ahead of dispatch
+        batch_size = self.batch_size
+        if getattr(self.model, 'batch_job', None) is not None:
+            # submit everything left as a single offline batch job
+            batch_size = max(1, len(pending))
+        window = self._window_size()
+        chunk_size = window or batch_size
+        render = functools.partial(
+            self._render_prompts,
+            ice_idx_list=ice_idx_list,
+            retriever=retriever,
+            gen_field_replace_token=self.gen_field_replace_token,
+            max_seq_len=self.max_seq_len,
+            ice_template=ice_template,
+            prompt_template=prompt_template)
+        if self.lazy_prompts:
+            prompts = prefetch(
+                self._iter_prompts(pending, render, gold_ans, chunk_size),
+                2 * chunk_size)
+        else:
+            prompts = list(
+                self._iter_prompts(pending, render, gold_ans, len(pending)))
+            if self.prefix_ordering and len(prompts) > 1:
+                prompts = self._prefix_order(prompts, has_gold)
+        if window:
+            samples = self._dispatch(prompts, len(pending), window, has_gold)
+        else:
+            samples = self._generate_batches(prompts, len(pending),
+                                             batch_size, has_gold)
+
+        # 5. Inference, saving the samples as they come in
         logger.info('Starting inference process...')
-        for datum in tqdm(dataloader, disable=not self.is_main_process):
-            if ds_reader.output_column:
-                entry, golds = list(zip(*datum))
-            else:
-                entry = datum
-                golds = [None for _ in range(len(entry))]
-            # 5-1. Inference with local model
-            extra_gen_kwargs = {}
-            sig = inspect.signature(self.model.generate)
-            if 'stopping_criteria' in sig.parameters:
-                extra_gen_kwargs['stopping_criteria'] = self.stopping_criteria
-            with torch.no_grad():
-                print(f"self.model:{self.model}")
-                parsed_entries = self.model.parse_template(entry, mode='gen')
-                results = self.model.generate_from_template(
-                    entry, max_out_len=self.max_out_len, **extra_gen_kwargs)
-                generated = results
-
-            num_return_sequences = getattr(self.model, 'generation_kwargs',
-                                           {}).get('num_return_sequences', 1)
-            # 5-3. Save current output
-            for prompt, prediction, gold in zip(
-                    parsed_entries, batched(generated, num_return_sequences),
-                    golds):
-                if num_return_sequences == 1:
-                    prediction = prediction[0]
+        if postprocessor_cfg and self.postprocess_workers:
+            output_handler.start_postprocessing(self.postprocess_workers)
+        unsaved = []
+        for indices, results in samples:
+            # 5-3. Save current output, by dataset index
+            for index, (prompt, prediction, gold) in zip(indices, results):
                 output_handler.save_results(prompt,
                                             prediction,
                                             index,
                                             gold=gold,
                                             postprocessor_cfg=postprocessor_cfg)
-                index = index + 1
 
-            # 5-4. Save intermediate results
-            if (self.save_every is not None and index % self.save_every == 0
-                    and self.is_main_process):
-                output_handler.write_to_json(output_json_filepath,
-                                             'tmp_' + output_json_filename)
+            # 5-4. Save intermediate results, appending only the new samples
+            unsaved.extend(indices)
+            if (self.save_every is not None
+                    and len(unsaved) >= self.save_every * batch_size):
+                output_handler.checkpoint(unsaved)
+                unsaved = []
 
         # 6. Output
+        output_handler.finish_postprocessing(postprocessor_cfg)
+        output_handler.results_dict = dict(
+            sorted(output_handler.results_dict.items(),
+                   key=lambda item: int(item[0])))
         if self.is_main_process:
             os.makedirs(output_json_filepath, exist_ok=True)
             output_handler.write_to_json(output_json_filepath,
                                          output_json_filename)
-            if osp.exists(tmp_json_filepath):
-                os.remove(tmp_json_filepath)
+            output_handler.write_metrics_summary(output_json_filepath,
+                                                 output_json_filename)
+            output_handler.finalize_journal()
 
         return [
             sample['prediction']
             for sample in output_handler.results_dict.values()
         ]
 
+    def _window_size(self) -> int:
+        """Number of samples kept in flight by :meth:`_dispatch`, 0 for the
+        batch by batch loop."""
+        if (not self.model.is_api
+                or getattr(self.model, 'batch_job', None) is not None
+                or getattr(self.model, 'batch_prompts', 1) > 1):
+            return 0
+        if self.dispatch_window is None:
+            return self.batch_size
+        return self.dispatch_window
+
+    def _generate(self, datum: List, has_gold) -> List[Tuple]:
+        """Generate the predictions of some prompts, returning ``(prompt,
+        prediction, gold)`` of each."""
+        entry, golds = self._split_golds(datum, has_gold)
+        # 5-1. Inference with local model
+        extra_gen_kwargs = {}
+        sig = inspect.signature(self.model.generate)
+        if 'stopping_criteria' in sig.parameters:
+            extra_gen_kwargs['stopping_criteria'] = self.stopping_criteria
+        with torch.no_grad():
+            parsed_entries = self.model.parse_template(entry, mode='gen')
+            results = self.model.generate_from_template(
+                entry, max_out_len=self.max_out_len, **extra_gen_kwargs)
+            generated = results
+
+        return self._pack(parsed_entries, golds, generated)
+
+    @staticmethod
+    def _split_golds(datum: List, has_gold) -> Tuple[List, List]:
+        if has_gold:
+            entry, golds = list(zip(*datum))
+            return list(entry), list(golds)
+        return datum, [None for _ in range(len(datum))]
+
+    def _pack(self, parsed_entries: List, golds: List,
+              generated: List) -> List[Tuple]:
+        num_return_sequences = getattr(self.model, 'generation_kwargs',
+                                       {}).get('num_return_sequences', 1)
+        predictions = [
+            prediction[0] if num_return_sequences == 1 else prediction
+            for prediction in batched(generated, num_return_sequences)
+        ]
+        return list(zip(parsed_entries, predictions, golds))
+
+    def _iter_prompts(self, indices: Iterable[int], render: Callable,
+                      gold_ans: Optional[List],
+                      chunk_size: int) -> Iterator[Tuple[int, object]]:
+        """Render the prompts of ``indices`` chunk by chunk, yielding
+        ``(index, prompt)``, or ``(index, (prompt, gold))`` if the dataset
+        has an output column."""
+        for chunk in batched(indices, max(1, chunk_size)):
+            for index, prompt in zip(chunk, render(chunk)):
+                yield index, (prompt if gold_ans is None else
+                              (prompt, gold_ans[index]))
+
+    def _generate_batches(self, prompts: Iterable[Tuple[int, object]],
+                          total: int, batch_size: int,
+                          has_gold) -> Iterator[Tuple[List, List]]:
+        """Generate the prompts batch by batch."""
+        progress = tqdm(total=total, disable=not self.is_main_process)
+        try:
+            for batch in batched(prompts, batch_size):
+                indices, datum = zip(*batch)
+                yield list(indices), self._generate(list(datum), has_gold)
+                progress.update(len(batch))
+        finally:
+            _close(prompts)
+            progress.close()
+
+    def _dispatch(self, prompts: Iterable[Tuple[int, object]], total: int,
+                  window: int, has_gold) -> Iterator[Tuple[List, List]]:
+        """Generate the prompts one by one with up to ``window`` of them in
+        flight, yielding them as they finish.
+
+        Unlike :meth:`_generate_batches` there is no barrier at batch
+        boundaries: the next prompt in dispatch order is submitted as soon
+        as any sample is done, so a slow completion only holds its own slot.
+        The results carry their dataset index and are sorted by it before
+        being dumped. Models in ``async_mode`` keep the samples in flight on
+        their own event loop, other models get a thread for each.
+        """
+        prompts = iter(prompts)
+        progress = tqdm(total=total, disable=not self.is_main_process)
+        futures = {}
+        executor = None
+        if not getattr(self.model, 'async_mode', False):
+            executor = ThreadPoolExecutor(max_workers=window,
+                                          thread_name_prefix='dispatch')
+        with executor or contextlib.nullcontext():
+
+            def submit(num):
+                for index, datum in islice(prompts, num):
+                    if executor is None:
+                        entry, golds = self._split_golds([datum], has_gold)
+                        parsed = self.model.parse_template(entry, mode='gen')
+                        future = self.model.submit(
+                            parsed, max_out_len=self.max_out_len)
+                        pack = functools.partial(self._pack, parsed, golds)
+                    else:
+                        future = executor.submit(self._generate, [datum],
+                                                 has_gold)
+                        pack = None
+                    futures[future] = index, pack
+
+            try:
+                submit(window)
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    # refill the window before handing the results out
+                    submit(len(done))
+                    for future in done:
+                        index, pack = futures.pop(future)
+                        results = future.result()
+                        yield [index], pack(results) if pack else results
+                        progress.update(1)
+            finally:
+                # on error or early exit drop the samples not started yet,
+                # the requests on an event loop are cancelled as well
+                for future in futures:
+                    future.cancel()
+                _close(prompts)
+                progress.close()
+
+    def _prefix_order(self, prompts: List[Tuple[int, object]],
+                      has_gold) -> List[Tuple[int, object]]:
+        """Reorder the rendered prompts so that prompts sharing a prefix are
+        dispatched contiguously, and report the estimated shared-prefix
+        ratio before and after."""
+        texts = []
+        for _, datum in prompts:
+            prompt = datum[0] if has_gold else datum
+            texts.append(
+                _prompt_text(self.model.parse_template(prompt, mode='gen')))
+        order = prefix_order(texts)
+        before = shared_prefix_ratio(texts)
+        after = shared_prefix_ratio([texts[j] for j in order])
+        logger.info(f'Prefix-aware ordering of {len(prompts)} prompts: '
+                    f'estimated shared-prefix ratio {after:.1%} '
+                    f'(dataset order: {before:.1%})')
+        return [prompts[j] for j in order]
+
     def get_generation_prompt_list_from_retriever_indices(
             self,
             ice_idx_list: List[List[int]],
@@ -185,31 +425,57 @@ class GenInferencer(BaseInferencer):
             max_seq_len: Optional[int] = None,
             ice_template: Optional[PromptTemplate] = None,
             prompt_template: Optional[PromptTemplate] = None):
+        return self._render_prompts(range(len(ice_idx_list)),
+                                    ice_idx_list,
+                                    retriever,
+                                    gen_field_replace_token,
+                                    max_seq_len=max_seq_len,
+                                    ice_template=ice_template,
+                                    prompt_template=prompt_template)
+
+    def _render_prompts(self,
+                        indices: Iterable[int],
+                        ice_idx_list: List[List[int]],
+                        retriever: BaseRetriever,
+                        gen_field_replace_token: str,
+                        max_seq_len: Optional[int] = None,
+                        ice_template: Optional[PromptTemplate] = None,
+                        prompt_template: Optional[PromptTemplate] = None):
+        """Prompts of the test samples at ``indices``, each dropping
+        in-context examples until it fits in ``max_seq_len``."""
         prompt_list = []
-        for idx, ice_idx in enumerate(ice_idx_list):
-            ice = retriever.generate_ice(ice_idx, ice_template=ice_template)
+        for idx in indices:
+            ice = retriever.generate_ice(ice_idx_list[idx],
+                                         ice_template=ice_template)
             prompt = retriever.generate_prompt_for_generate_task(
                 idx,
                 ice,
                 gen_field_replace_token=gen_field_replace_token,
                 ice_template=ice_template,
                 prompt_template=prompt_template)
-            if max_seq_len is not None:
-                prompt_token_num = self.model.get_token_len_from_template(
-                    prompt, mode='gen')
-                while len(ice_idx) > 0 and prompt_token_num > max_seq_len:
-                    ice_idx = ice_idx[:-1]
-                    ice = retriever.generate_ice(ice_idx,
-                                                 ice_template=ice_template)
-                    prompt = retriever.generate_prompt_for_generate_task(
-                        idx,
-                        ice,
-                        gen_field_replace_token=gen_field_replace_token,
-                        ice_template=ice_template,
-                        prompt_template=prompt_template)
-                    prompt_token_num = self.model.get_token_len_from_template(
-                        prompt, mode='gen')
             prompt_list.append(prompt)
+        if max_seq_len is None or not prompt_list:
+            return prompt_list
+
+        # count every prompt in one batch, only the overlong ones are
+        # rebuilt with fewer in-context examples
+        token_nums = self.model.get_token_len_from_template(prompt_list,
+                                                            mode='gen')
+        for i, idx in enumerate(indices):
+            ice_idx = ice_idx_list[idx]
+            prompt_token_num = token_nums[i]
+            while len(ice_idx) > 0 and prompt_token_num > max_seq_len:
+                ice_idx = ice_idx[:-1]
+                ice = retriever.generate_ice(ice_idx,
+                                             ice_template=ice_template)
+                prompt_list[i] = retriever.generate_prompt_for_generate_task(
+                    idx,
+                    ice,
+                    gen_field_replace_token=gen_field_replace_token,
+                    ice_template=ice_template,
+                    prompt_template=prompt_template)
+                prompt_token_num = self.model.get_token_len_from_template(
+                    prompt_list[i], mode='gen')
         return prompt_list
 
 
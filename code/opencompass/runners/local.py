@@ -1,3 +1,4 @@
+import contextlib
 import os
 import os.path as osp
 import re
@@ -7,15 +8,15 @@ import time
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from threading import Lock
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import mmengine
 import numpy as np
 from mmengine.config import ConfigDict
 from tqdm import tqdm
 
-from opencompass.registry import RUNNERS, TASKS
-from opencompass.utils import get_logger
+from opencompass.registry import MODELS, RUNNERS, TASKS
+from opencompass.utils import get_logger, local_coordinator
 
 from .base import BaseRunner
 
@@ -32,6 +33,16 @@ def get_command_template(gpu_ids: List[int]) -> str:
     return tmpl
 
 
+def _has_api_model(task: Dict[str, Any]) -> bool:
+    for model_cfg in task.get('models', []):
+        model_type = model_cfg.get('type')
+        if isinstance(model_type, str):
+            model_type = MODELS.get(model_type)
+        if getattr(model_type, 'is_api', False):
+            return True
+    return False
+
+
 @RUNNERS.register_module()
 class LocalRunner(BaseRunner):
     """Local runner. Start tasks by local python.
@@ -44,6 +55,11 @@ class LocalRunner(BaseRunner):
             Defaults to 1.
         debug (bool): Whether to run in debug mode.
         lark_bot_url (str): Lark bot url.
+        coordinate (bool): Whether to serve a coordinator to the task
+            processes, so that the query rate, token and concurrency limits
+            of API models hold across all of them instead of per process,
+            see :obj:`CoordinatorServer`. Defaults to None, serving one only
+            if some task has an API model.
     """
 
     def __init__(
@@ -53,10 +69,12 @@ class LocalRunner(BaseRunner):
         debug: bool = False,
         max_workers_per_gpu: int = 1,
         lark_bot_url: str = None,
+        coordinate: Optional[bool] = None,
     ):
         super().__init__(task=task, debug=debug, lark_bot_url=lark_bot_url)
         self.max_num_workers = max_num_workers
         self.max_workers_per_gpu = max_workers_per_gpu
+        self.coordinate = coordinate
 
     def launch(self, tasks: List[Dict[str, Any]]) -> List[Tuple[str, int]]:
         """Launch multiple tasks.
@@ -161,9 +179,16 @@ class LocalRunner(BaseRunner):
 
                 return res
 
-            with ThreadPoolExecutor(
-                    max_workers=self.max_num_workers) as executor:
-                status = executor.map(submit, tasks, range(len(tasks)))
+            with contextlib.ExitStack() as stack:
+                coordinate = self.coordinate
+                if coordinate is None:
+                    coordinate = any(map(_has_api_model, tasks))
+                if coordinate:
+                    # task subprocesses inherit the coordinator's address
+                    stack.enter_context(local_coordinator())
+                with ThreadPoolExecutor(
+                        max_workers=self.max_num_workers) as executor:
+                    status = executor.map(submit, tasks, range(len(tasks)))
 
         return status
 
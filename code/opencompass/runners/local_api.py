@@ -6,7 +6,6 @@ import sys
 import time
 import traceback
 from multiprocessing import Manager, Pool
-from multiprocessing.managers import SyncManager
 from typing import Any, Dict, List, Tuple
 
 import mmengine
@@ -16,14 +15,15 @@ from tqdm import tqdm
 from opencompass.registry import RUNNERS, TASKS
 from opencompass.tasks import OpenICLInferTask
 from opencompass.tasks.base import BaseTask
-from opencompass.utils import (build_dataset_from_cfg, build_model_from_cfg,
-                               get_infer_output_path, get_logger,
+from opencompass.utils import (SharedSemaphore, build_dataset_from_cfg,
+                               build_model_from_cfg, get_infer_output_path,
+                               get_logger, local_coordinator,
                                task_abbr_from_cfg)
 
 from .base import BaseRunner
 
 
-def monkey_run(self, tokens: SyncManager.Semaphore):
+def monkey_run(self, tokens: SharedSemaphore):
     """Hack for infer task run, add tokens for multiprocess."""
     self.logger.info(f'Task {task_abbr_from_cfg(self.cfg)}')
     for model_cfg, dataset_cfgs in zip(self.model_cfgs, self.dataset_cfgs):
@@ -91,13 +91,13 @@ def reset_std():
             h.stream = sys.stdout
 
 
-def launch(task: BaseTask, tokens: SyncManager.Semaphore):
+def launch(task: BaseTask, tokens: SharedSemaphore):
     """Launch a single task.
 
     Args:
         task (BaseTask): Task to launch.
-        tokens (SyncManager.Semaphore): Multiprocessing semaphore
-            for every subprocess to follow.
+        tokens (SharedSemaphore): Cross-process semaphore for every
+            subprocess to follow.
 
     Returns:
         tuple[str, int]: Task name and exit code.
@@ -212,8 +212,15 @@ class LocalAPIRunner(BaseRunner):
 
             get_logger().info('All the logs and processes for each task'
                               ' should be checked in each infer/.out file.')
-            with Manager() as manager:
-                tokens = manager.Semaphore(self.concurrent_users)
+            # the concurrent users are slots of the run's coordinator, a
+            # round trip on a socket per acquire instead of a manager proxy
+            # call; the models of the workers share their rate limits
+            # through it as well. The key is per run, a standalone
+            # coordinator may serve several runs with their own limits
+            with local_coordinator() as path, Manager() as manager:
+                tokens = SharedSemaphore(path,
+                                         f'concurrent_users.{os.getpid()}',
+                                         self.concurrent_users)
                 # pbar update has visualization issue when direct
                 # update pbar in callback, need an extra counter
                 pbar_counter = manager.Value('i', 0)
@@ -114,6 +114,12 @@ class OpenICLInferTask(BaseTask):
         out_dir, out_file = osp.split(out_path)
         mkdir_or_exist(out_dir)
 
+        if self.model.is_api and getattr(self.model, 'trace_cfg', None):
+            trace_path = get_infer_output_path(
+                self.model_cfg, self.dataset_cfg,
+                osp.join(self.work_dir, 'logs', 'trace'), 'jsonl')
+            self.model.start_tracing(trace_path)
+
         if hasattr(self.infer_cfg, 'prompt_template') and \
                 hasattr(self.infer_cfg, 'ice_template'):
             inferencer.inference(retriever,
@@ -135,6 +141,16 @@ class OpenICLInferTask(BaseTask):
                                  output_json_filepath=out_dir,
                                  output_json_filename=out_file)
 
+        if self.model.is_api and getattr(self.model, 'trace_cfg', None):
+            self.model.stop_tracing()
+
+        if self.model.is_api and hasattr(self.model, 'get_stats'):
+            stats = self.model.get_stats()
+            if stats:
+                self.logger.info(
+                    f'API stats of {task_abbr_from_cfg(self.sub_cfg)}: '
+                    f'{stats}')
+
     def _set_default_value(self, cfg: ConfigDict, key: str, value: Any):
         if key not in cfg:
             cfg[key] = value
@@ -2,12 +2,17 @@ from .abbr import *  # noqa
 from .auxiliary import *  # noqa
 from .build import *  # noqa
 from .collect_env import *  # noqa
+from .coordinator import *  # noqa
 from .dependency import *  # noqa
 from .file import *  # noqa
 from .fileio import *  # noqa
+from .http_pool import *  # noqa
 from .lark import *  # noqa
 from .logging import *  # noqa
 from .prompt import *  # noqa
+from .repair import *  # noqa
+from .retry import *  # noqa
 from .text_postprocessors import *  # noqa
+from .tracing import *  # noqa
 from .datasets import *  # noqa
 from .results_update import *  # noqa
@@ -1,4 +1,9 @@
+import queue
+import threading
 from itertools import islice
+from typing import Iterable, Iterator
+
+__all__ = ['batched', 'prefetch']
 
 try:
     # batched is in 3.12
@@ -12,3 +17,42 @@ except ImportError:
         it = iter(iterable)
         while batch := tuple(islice(it, n)):
             yield batch
+
+
+def prefetch(iterable: Iterable, size: int) -> Iterator:
+    """Iterate ``iterable`` on a background thread, at most ``size`` items
+    ahead of the consumer. An exception of the producer is raised in the
+    consumer, and the producer stops once the consumer is closed."""
+    items = queue.Queue(maxsize=max(1, size))
+    stop = threading.Event()
+    end = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((end, None))
+        except BaseException as e:
+            put((end, e))
+
+    threading.Thread(target=produce, name='prefetch', daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,645 @@
+import argparse
+import contextlib
+import json
+import os
+import os.path as osp
+import selectors
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from .logging import get_logger
+
+__all__ = [
+    'CoordinatorServer', 'CoordinatorClient', 'CoordinatorUnavailable',
+    'SharedSemaphore', 'get_coordinator', 'local_coordinator'
+]
+
+# socket path of the coordinator serving the current run, inherited by the
+# task processes
+COORDINATOR_ENV = 'OPENCOMPASS_COORDINATOR'
+
+
+class CoordinatorUnavailable(ConnectionError):
+    """The coordinator could not be reached or did not answer in time. The
+    callers fall back to their process-local limits."""
+
+
+def _encode_key(key: str) -> str:
+    # the protocol is whitespace separated
+    return '_'.join(str(key).split()) or '_'
+
+
+def _min_limit(old, new):
+    if old is None:
+        return new
+    if new is None:
+        return old
+    return min(old, new)
+
+
+class _Budget:
+    """Limits and live state of one key: a request bucket refilled at
+    ``qps``, a token bucket refilled at ``tpm`` per minute and a number of
+    concurrency slots, see :obj:`RateLimiter` for the bucket semantics."""
+
+    def __init__(self):
+        self.qps = self.burst = self.tpm = self.concurrency = None
+        self._requests = self._tokens = 0.
+        self._last = time.monotonic()
+        self.in_flight = 0
+        self.waiters = deque()
+        self.counters = dict(granted=0, throttled=0, slots=0, queued=0)
+
+    def limit(self, qps, burst, tpm, concurrency):
+        """Register the limits of a client. Clients of one key may disagree,
+        the strictest limit wins."""
+        self._refill(time.monotonic())
+        self.qps = _min_limit(self.qps, qps)
+        if self.qps is not None:
+            burst = burst or max(1, int(self.qps))
+            first = self.burst is None
+            self.burst = _min_limit(self.burst, burst)
+            self._requests = float(self.burst) if first else min(
+                self._requests, self.burst)
+        if tpm is not None:
+            first = self.tpm is None
+            self.tpm = _min_limit(self.tpm, tpm)
+            self._tokens = float(self.tpm) if first else min(
+                self._tokens, self.tpm)
+        self.concurrency = _min_limit(self.concurrency, concurrency)
+
+    def _refill(self, now: float):
+        elapsed = now - self._last
+        self._last = now
+        if self.qps is not None:
+            self._requests = min(self.burst,
+                                 self._requests + elapsed * self.qps)
+        if self.tpm is not None:
+            self._tokens = min(self.tpm,
+                               self._tokens + elapsed * self.tpm / 60)
+
+    def take(self, num_tokens: int) -> float:
+        """Take a request and ``num_tokens`` budget tokens, returning 0 on
+        success and the seconds to wait otherwise."""
+        now = time.monotonic()
+        self._refill(now)
+        delay = 0.
+        if self.qps is not None and self._requests < 1:
+            delay = (1 - self._requests) / self.qps
+        cost = 0
+        if self.tpm is not None:
+            # a single oversized request must still pass eventually
+            cost = min(num_tokens, self.tpm)
+            if self._tokens < cost:
+                delay = max(delay, (cost - self._tokens) * 60 / self.tpm)
+        if delay > 0:
+            self.counters['throttled'] += 1
+            return delay
+        if self.qps is not None:
+            self._requests -= 1
+        if self.tpm is not None:
+            self._tokens -= cost
+        self.counters['granted'] += 1
+        return 0.
+
+    def try_slot(self) -> bool:
+        if self.concurrency is not None and \
+                self.in_flight >= self.concurrency:
+            return False
+        self.in_flight += 1
+        self.counters['slots'] += 1
+        return True
+
+    def stats(self) -> Dict:
+        return dict(qps=self.qps,
+                    tpm=self.tpm,
+                    concurrency=self.concurrency,
+                    in_flight=self.in_flight,
+                    waiting=len(self.waiters),
+                    **self.counters)
+
+
+class _Connection:
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.buffer = b''
+        # slots held per key, given back if the process dies
+        self.held: Dict[str, int] = {}
+
+
+class CoordinatorServer:
+    """Token server enforcing per-endpoint limits across processes.
+
+    Every task process talks to the server over one Unix socket per thread
+    with a newline-delimited text protocol. A rate request costs a single
+    round trip: the server either grants it or answers with the seconds to
+    wait, so the client sleeps locally and no connection is held. A blocking
+    concurrency request is parked on the server until a slot is released,
+    which also happens when the connection holding it goes away.
+
+    Commands, where ``-`` stands for no limit:
+
+    - ``L key qps burst tpm concurrency``: register limits, no reply.
+    - ``T key tokens``: take a request, replies the delay, ``0`` if granted.
+    - ``A key``: wait for a concurrency slot, replies ``1``.
+    - ``N key``: try to take a concurrency slot, replies ``1`` or ``0``.
+    - ``R key``: release a concurrency slot, no reply.
+    - ``S``: replies the statistics of every key as JSON.
+    - ``P``: replies ``pong``, lets a client parked on ``A`` check that the
+      server is alive.
+
+    A malformed command is answered with ``E <error>`` and its connection is
+    dropped, which gives back the slots it held. The server runs on a single
+    thread of the launching process.
+
+    Args:
+        path (str, optional): Socket path. Defaults to a new temporary
+            directory.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self._tmp_dir = None
+        if path is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix='oc_coord_')
+            path = osp.join(self._tmp_dir, 'coordinator.sock')
+        self.path = path
+        self.budgets: Dict[str, _Budget] = {}
+        self._selector = selectors.DefaultSelector()
+        self._thread = None
+        self._stopped = False
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+
+    def _budget(self, key: str) -> _Budget:
+        budget = self.budgets.get(key)
+        if budget is None:
+            budget = self.budgets[key] = _Budget()
+        return budget
+
+    def start(self) -> 'CoordinatorServer':
+        if osp.exists(self.path):
+            os.remove(self.path)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.path)
+        self._listener.listen(1024)
+        self._listener.setblocking(False)
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        name='coordinator',
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        while not self._stopped:
+            for key, _ in self._selector.select():
+                if key.fileobj is self._listener:
+                    self._accept()
+                elif key.fileobj is self._wakeup_r:
+                    self._wakeup_r.recv(64)
+                else:
+                    self._read(key.data)
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup_w.send(b'\0')
+        if self._thread is not None:
+            self._thread.join()
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+        self._selector.close()
+        self._wakeup_w.close()
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        elif osp.exists(self.path):
+            os.remove(self.path)
+
+    def _accept(self):
+        try:
+            sock, _ = self._listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        self._selector.register(sock, selectors.EVENT_READ, _Connection(sock))
+
+    def _read(self, conn: _Connection):
+        try:
+            data = conn.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(conn)
+            return
+        conn.buffer += data
+        *lines, conn.buffer = conn.buffer.split(b'\n')
+        for line in lines:
+            try:
+                self._handle(conn, line.decode().split())
+            except Exception as e:
+                # a bad client must not take the server down with it
+                get_logger().warning(
+                    f'Coordinator dropping a client after {line[:80]!r}: '
+                    f'{type(e).__name__}: {e}')
+                self._send(conn, f'E {type(e).__name__}')
+                self._drop(conn)
+                return
+
+    def _send(self, conn: _Connection, reply: str):
+        # replies are tiny, a client only sends after reading its reply
+        try:
+            conn.sock.sendall(reply.encode() + b'\n')
+        except OSError:
+            pass
+
+    def _handle(self, conn: _Connection, args):
+        if not args:
+            return
+        cmd = args[0]
+        if cmd == 'S':
+            stats = {k: b.stats() for k, b in self.budgets.items()}
+            self._send(conn, json.dumps(stats))
+            return
+        if cmd == 'P':
+            self._send(conn, 'pong')
+            return
+        budget = self._budget(args[1])
+        if cmd == 'T':
+            delay = budget.take(int(args[2]))
+            self._send(conn, f'{delay:.6f}' if delay else '0')
+        elif cmd == 'A':
+            if budget.try_slot():
+                self._hold(conn, args[1])
+                self._send(conn, '1')
+            else:
+                budget.counters['queued'] += 1
+                budget.waiters.append(conn)
+        elif cmd == 'N':
+            granted = budget.try_slot()
+            if granted:
+                self._hold(conn, args[1])
+            self._send(conn, '1' if granted else '0')
+        elif cmd == 'R':
+            if conn.held.get(args[1]):
+                conn.held[args[1]] -= 1
+                self._release(args[1], budget)
+        elif cmd == 'L':
+            limits = [None if v == '-' else float(v) for v in args[2:6]]
+            qps, burst, tpm, concurrency = limits
+            budget.limit(qps, burst and int(burst), tpm and int(tpm),
+                         concurrency and int(concurrency))
+            self._grant_waiters(args[1], budget)
+        else:
+            raise ValueError(f'unknown command {cmd!r}')
+
+    def _hold(self, conn: _Connection, key: str):
+        conn.held[key] = conn.held.get(key, 0) + 1
+
+    def _release(self, key: str, budget: _Budget):
+        budget.in_flight -= 1
+        self._grant_waiters(key, budget)
+
+    def _grant_waiters(self, key: str, budget: _Budget):
+        while budget.waiters and budget.try_slot():
+            conn = budget.waiters.popleft()
+            self._hold(conn, key)
+            self._send(conn, '1')
+
+    def _drop(self, conn: _Connection):
+        self._selector.unregister(conn.sock)
+        conn.sock.close()
+        for key, held in conn.held.items():
+            budget = self.budgets[key]
+            budget.in_flight -= held
+            self._grant_waiters(key, budget)
+        for budget in self.budgets.values():
+            if conn in budget.waiters:
+                budget.waiters = deque(c for c in budget.waiters
+                                       if c is not conn)
+
+
+class CoordinatorClient:
+    """Client of a :obj:`CoordinatorServer`.
+
+    Each thread keeps its own persistent connection, re-opened after a fork,
+    so concurrent requests never wait on each other's round trips.
+
+    Every round trip is bounded by ``timeout``. A call that fails or times
+    out drops the connection, which frees the slots it held on the server,
+    and raises :obj:`CoordinatorUnavailable`; the following calls fail fast
+    for ``retry_interval`` seconds before reconnecting, so the callers run
+    on their local limits meanwhile instead of stalling on every request.
+
+    Args:
+        path (str): Socket path of the server.
+        timeout (float): Seconds to wait for a reply. A blocking slot
+            request may wait longer, as long as the server answers a ping
+            every ``timeout`` seconds. Defaults to 10.
+        retry_interval (float): Seconds to wait before reconnecting after a
+            failure. Defaults to 30.
+    """
+
+    def __init__(self,
+                 path: str,
+                 timeout: float = 10.,
+                 retry_interval: float = 30.):
+        self.path = path
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._local = threading.local()
+        self._limits = set()
+        self._registered = set()
+        self._lock = threading.Lock()
+        self._down_until = 0.
+        self.counters = dict(calls=0, seconds=0., failures=0)
+
+    def _sock(self) -> socket.socket:
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            if time.monotonic() < self._down_until:
+                raise CoordinatorUnavailable(
+                    f'coordinator {self.path} is unavailable')
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            local.sock, local.pid, local.buffer = sock, os.getpid(), b''
+            local.pings = 0
+            # limits whose registration failed while the server was away
+            with self._lock:
+                pending = [(key, limits) for key, limits in self._limits
+                           if (key, limits, local.pid) not in self._registered]
+            for key, limits in pending:
+                sock.sendall(self._limit_line(key, limits).encode() + b'\n')
+                self._registered.add((key, limits, local.pid))
+        return local.sock
+
+    def _fail(self, error: Exception):
+        """Drop the connection of this thread and back off."""
+        local = self._local
+        sock = getattr(local, 'sock', None)
+        if sock is not None and local.pid == os.getpid():
+            sock.close()
+        local.sock = local.pid = None
+        with self._lock:
+            self.counters['failures'] += 1
+            down = time.monotonic() < self._down_until
+            self._down_until = time.monotonic() + self.retry_interval
+        if not down:
+            get_logger().warning(
+                f'Coordinator {self.path} unavailable ({error!r}), falling '
+                f'back to local limits for {self.retry_interval:g}s')
+
+    def _readline(self, sock: socket.socket) -> str:
+        local = self._local
+        while True:
+            while b'\n' not in local.buffer:
+                data = sock.recv(65536)
+                if not data:
+                    raise ConnectionError('coordinator is gone')
+                local.buffer += data
+            line, local.buffer = local.buffer.split(b'\n', 1)
+            line = line.decode()
+            if line == 'pong' and local.pings:
+                # the answer to a ping sent while parked on a slot
+                local.pings -= 1
+                continue
+            if line.startswith('E '):
+                raise ConnectionError(f'coordinator rejected: {line[2:]}')
+            return line
+
+    def _call(self,
+              line: str,
+              reply: bool = True,
+              parked: bool = False) -> Optional[str]:
+        start = time.perf_counter()
+        result = None
+        try:
+            sock = self._sock()
+            sock.sendall(line.encode() + b'\n')
+            while reply:
+                try:
+                    result = self._readline(sock)
+                    break
+                except socket.timeout:
+                    # a parked request may wait for a slot indefinitely,
+                    # as long as the server is alive
+                    if not parked or self._local.pings:
+                        raise
+                    sock.sendall(b'P\n')
+                    self._local.pings += 1
+        except CoordinatorUnavailable:
+            raise
+        except OSError as e:
+            self._fail(e)
+            raise CoordinatorUnavailable(
+                f'coordinator {self.path}: {e!r}') from e
+        with self._lock:
+            self.counters['calls'] += 1
+            self.counters['seconds'] += time.perf_counter() - start
+        return result
+
+    def register(self,
+                 key: str,
+                 qps: Optional[float] = None,
+                 burst: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None,
+                 concurrency: Optional[int] = None):
+        """Register the limits of ``key``, once per process."""
+        limits = (qps, burst, tokens_per_minute, concurrency)
+        with self._lock:
+            self._limits.add((key, limits))
+        if (key, limits, os.getpid()) in self._registered:
+            return
+        # re-sent on the next connection if the server is unavailable
+        with contextlib.suppress(CoordinatorUnavailable):
+            self._call(self._limit_line(key, limits), reply=False)
+            self._registered.add((key, limits, os.getpid()))
+
+    @staticmethod
+    def _limit_line(key: str, limits) -> str:
+        values = ' '.join('-' if v is None else str(v) for v in limits)
+        return f'L {_encode_key(key)} {values}'
+
+    def try_acquire(self, key: str, num_tokens: int = 0) -> float:
+        """Take a request of ``key`` charged ``num_tokens`` tokens.
+
+        Returns:
+            float: 0 on success, otherwise the seconds to wait before trying
+            again.
+        """
+        return float(self._call(f'T {_encode_key(key)} {int(num_tokens)}'))
+
+    def acquire_slot(self, key: str, blocking: bool = True) -> bool:
+        """Take a concurrency slot of ``key``, waiting for one to be free
+        unless ``blocking`` is False."""
+        cmd = 'A' if blocking else 'N'
+        return self._call(f'{cmd} {_encode_key(key)}',
+                          parked=blocking) == '1'
+
+    def release_slot(self, key: str):
+        self._call(f'R {_encode_key(key)}', reply=False)
+
+    @contextlib.contextmanager
+    def slot(self, key: str):
+        """Context manager holding a concurrency slot of ``key``. Without a
+        reachable coordinator the block runs on the caller's local limits
+        only."""
+        try:
+            acquired = self.acquire_slot(key)
+        except CoordinatorUnavailable:
+            acquired = False
+        try:
+            yield
+        finally:
+            if acquired:
+                # a lost connection has given the slot back already
+                with contextlib.suppress(CoordinatorUnavailable):
+                    self.release_slot(key)
+
+    def server_stats(self) -> Dict:
+        return json.loads(self._call('S'))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            calls, seconds = self.counters['calls'], self.counters['seconds']
+            failures = self.counters['failures']
+        return dict(calls=calls,
+                    failures=failures,
+                    mean_overhead_us=round(seconds / max(calls, 1) * 1e6, 1))
+
+
+class SharedSemaphore:
+    """A semaphore backed by the concurrency slots of a coordinator key.
+
+    Unlike a ``multiprocessing.Manager().Semaphore`` it can be pickled to
+    pool workers and costs one socket round trip per call instead of a
+    manager proxy call. While the coordinator is unavailable the slots are
+    taken from a semaphore of ``value`` slots local to the process.
+
+    Args:
+        path (str): Socket path of the coordinator.
+        key (str): Coordinator key holding the slots.
+        value (int): Number of slots.
+    """
+
+    def __init__(self, path: str, key: str, value: int):
+        self.path = path
+        self.key = key
+        self.value = value
+
+    @property
+    def client(self) -> CoordinatorClient:
+        client = get_coordinator(self.path)
+        client.register(self.key, concurrency=self.value)
+        return client
+
+    def _fallback(self) -> threading.BoundedSemaphore:
+        with _clients_lock:
+            key = (self.path, self.key)
+            if key not in _fallback_semaphores:
+                _fallback_semaphores[key] = threading.BoundedSemaphore(
+                    self.value)
+            return _fallback_semaphores[key]
+
+    def _held(self) -> list:
+        # where the slots of this thread came from, released in reverse
+        if not hasattr(_fallback_held, 'slots'):
+            _fallback_held.slots = {}
+        return _fallback_held.slots.setdefault((self.path, self.key), [])
+
+    def acquire(self, blocking: bool = True) -> bool:
+        try:
+            acquired = self.client.acquire_slot(self.key, blocking)
+            shared = True
+        except CoordinatorUnavailable:
+            acquired = self._fallback().acquire(blocking)
+            shared = False
+        if acquired:
+            self._held().append(shared)
+        return acquired
+
+    def release(self):
+        held = self._held()
+        if held and not held.pop():
+            self._fallback().release()
+            return
+        # a lost connection has given the slot back already
+        with contextlib.suppress(CoordinatorUnavailable):
+            self.client.release_slot(self.key)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+_clients: Dict[str, CoordinatorClient] = {}
+_clients_lock = threading.Lock()
+# local stand-ins of the shared semaphores while the coordinator is away
+_fallback_semaphores: Dict[tuple, threading.BoundedSemaphore] = {}
+_fallback_held = threading.local()
+
+
+def get_coordinator(
+        path: Optional[str] = None) -> Optional[CoordinatorClient]:
+    """Get the process-wide client of the coordinator at ``path``, by
+    default the one advertised by the launching runner through
+    ``OPENCOMPASS_COORDINATOR``. Returns None if there is none."""
+    path = path or os.environ.get(COORDINATOR_ENV)
+    if not path:
+        return None
+    with _clients_lock:
+        if path not in _clients:
+            _clients[path] = CoordinatorClient(path)
+        return _clients[path]
+
+
+@contextlib.contextmanager
+def local_coordinator():
+    """Serve a coordinator to the processes launched inside the block.
+
+    A coordinator already advertised in the environment, e.g. a standalone
+    one shared by several runs, is reused instead.
+
+    Yields:
+        str: Socket path of the coordinator.
+    """
+    if os.environ.get(COORDINATOR_ENV):
+        yield os.environ[COORDINATOR_ENV]
+        return
+    server = CoordinatorServer().start()
+    os.environ[COORDINATOR_ENV] = server.path
+    get_logger().debug(f'Rate coordinator listening on {server.path}')
+    try:
+        yield server.path
+    finally:
+        os.environ.pop(COORDINATOR_ENV, None)
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Standalone coordinator shared by several runs, export '
+        f'{COORDINATOR_ENV}=<path> before launching them')
+    parser.add_argument('path')
+    args = parser.parse_args()
+    server = CoordinatorServer(args.path).start()
+    print(f'export {COORDINATOR_ENV}={server.path}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
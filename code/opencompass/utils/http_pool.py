@@ -0,0 +1,110 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+__all__ = ['HTTPPool', 'get_http_pool']
+
+
+class HTTPPool:
+    """Keep-alive connection pool shared by the ``requests``-based API
+    wrappers.
+
+    A module-level ``requests.post`` opens a new TCP (and TLS) connection per
+    call. A pool keeps up to ``maxsize`` connections per host alive and
+    blocks further requests until one is free, so the number of sockets to a
+    backend stays bounded. With ``http2=True`` the pool runs on an
+    ``httpx.Client`` instead, multiplexing the requests over few
+    connections.
+
+    The pool also owns a thread pool of ``maxsize`` workers, so that the
+    ``generate`` calls of every batch reuse the same threads.
+
+    Args:
+        maxsize (int): Connections kept per host, and number of workers.
+            Defaults to 32.
+        num_hosts (int): Number of hosts connections are kept for. Defaults
+            to 10.
+        http2 (bool): Use HTTP/2 through ``httpx``. Defaults to False.
+        verify (bool): Verify TLS certificates. Defaults to True.
+        trust_env (bool): Take proxies and certificates from the environment.
+            Defaults to True.
+        timeout (float, optional): Timeout of a request in seconds. Defaults
+            to None.
+    """
+
+    def __init__(self,
+                 maxsize: int = 32,
+                 num_hosts: int = 10,
+                 http2: bool = False,
+                 verify: bool = True,
+                 trust_env: bool = True,
+                 timeout: Optional[float] = None):
+        self.maxsize = maxsize
+        self.http2 = http2
+        self.timeout = timeout
+        if http2:
+            import httpx
+            self.client = httpx.Client(
+                http2=True,
+                verify=verify,
+                trust_env=trust_env,
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=maxsize * num_hosts,
+                                    max_keepalive_connections=maxsize))
+        else:
+            self.client = requests.Session()
+            self.client.verify = verify
+            self.client.trust_env = trust_env
+            adapter = HTTPAdapter(pool_connections=num_hosts,
+                                  pool_maxsize=maxsize,
+                                  pool_block=True)
+            self.client.mount('http://', adapter)
+            self.client.mount('https://', adapter)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def post(self, url: str, headers: Optional[Dict] = None, data=None):
+        """POST ``data`` (str or bytes) to ``url``. The response has the
+        common ``status_code``, ``content``, ``json()`` and
+        ``raise_for_status()`` of both backends. ``json()`` raises a
+        :obj:`json.JSONDecodeError` on a malformed body."""
+        if self.http2:
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            return self.client.post(url, headers=headers, content=data)
+        return self.client.post(url,
+                                headers=headers,
+                                data=data,
+                                timeout=self.timeout)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.maxsize)
+            return self._executor
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+        self.client.close()
+
+
+_pools: Dict[str, HTTPPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_http_pool(**kwargs) -> HTTPPool:
+    """Get the process-wide :obj:`HTTPPool` of a configuration, so that all
+    models, batches and datasets of a task share its connections."""
+    key = json.dumps(kwargs, sort_keys=True)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = HTTPPool(**kwargs)
+        return _pools[key]
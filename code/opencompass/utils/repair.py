@@ -0,0 +1,120 @@
+import json
+import os
+import os.path as osp
+import re
+from typing import Dict, List
+
+from .logging import get_logger
+from .retry import RETRY_EXHAUSTED_PREFIX
+
+__all__ = ['is_failed_prediction', 'find_failed_predictions',
+           'repair_predictions']
+
+
+def is_failed_prediction(prediction) -> bool:
+    """Whether a saved prediction is the placeholder of a request whose
+    retries ran out, or empty. A sample with several return sequences fails
+    if any of them does."""
+    if prediction is None:
+        return True
+    if isinstance(prediction, (list, tuple)):
+        return any(is_failed_prediction(item) for item in prediction)
+    if not isinstance(prediction, str):
+        # e.g. the labels of PPL inference
+        return False
+    return not prediction.strip() or prediction.startswith(
+        RETRY_EXHAUSTED_PREFIX)
+
+
+def _prediction_files(pred_dir: str) -> List[str]:
+    paths = []
+    for root, _, files in os.walk(pred_dir):
+        for name in files:
+            # skip checkpoint journals and request metrics
+            if (not name.endswith('.json') or name.startswith('tmp_')
+                    or name.endswith('_metrics.json')):
+                continue
+            paths.append(osp.join(root, name))
+    return sorted(paths)
+
+
+def find_failed_predictions(pred_dir: str) -> Dict[str, List[str]]:
+    """Indices of the failed samples of every prediction file under
+    ``pred_dir``, for the files having any."""
+    failed = {}
+    for path in _prediction_files(pred_dir):
+        with open(path, encoding='utf-8') as f:
+            results = json.load(f)
+        if not isinstance(results, dict):
+            continue
+        indices = [
+            idx for idx, result in results.items()
+            if isinstance(result, dict) and 'prediction' in result
+            and is_failed_prediction(result['prediction'])
+        ]
+        if indices:
+            failed[path] = indices
+    return failed
+
+
+def _result_files(results_dir: str, pred_path: str,
+                  pred_dir: str) -> List[str]:
+    """Evaluation results scored from a prediction file. The predictions of
+    a split dataset, ``xxx_0.json``, ``xxx_1.json``, ..., are scored
+    together into ``xxx.json``."""
+    rel_path = osp.relpath(pred_path, pred_dir)
+    candidates = [rel_path]
+    root, ext = osp.splitext(rel_path)
+    split = re.match(r'(.+)_\d+$', root)
+    if split:
+        candidates.append(split.group(1) + ext)
+    paths = [osp.join(results_dir, path) for path in candidates]
+    return [path for path in paths if osp.exists(path)]
+
+
+def repair_predictions(work_dir: str) -> Dict[str, List[str]]:
+    """Prepare the outputs in ``work_dir`` for re-running only their failed
+    samples.
+
+    The good samples of every prediction file with failures are written to
+    the checkpoint journal of the file, and the file itself is removed, so
+    the next inference run of the dataset resumes from the journal and only
+    generates the failed indices, rewriting the file with them patched in.
+    The evaluation results of the affected datasets are removed as well so
+    that only those are scored again.
+
+    Args:
+        work_dir (str): The work dir of a run, holding ``predictions/`` and
+            ``results/``.
+
+    Returns:
+        Dict[str, List[str]]: Failed indices by prediction file.
+    """
+    # imported here, the inferencers pull in torch
+    from opencompass.openicl.icl_inferencer.icl_base_inferencer import (
+        ResultJournal, result_journal_path)
+
+    logger = get_logger()
+    pred_dir = osp.join(work_dir, 'predictions')
+    results_dir = osp.join(work_dir, 'results')
+    failed = find_failed_predictions(pred_dir)
+    for path, indices in failed.items():
+        with open(path, encoding='utf-8') as f:
+            results = json.load(f)
+        for idx in indices:
+            results.pop(idx)
+        journal = ResultJournal(
+            result_journal_path(osp.dirname(path), osp.basename(path)))
+        # the prediction file supersedes a journal left behind
+        journal.remove()
+        journal.append(results)
+        journal.close()
+        # dropped only once the good samples are safe in the journal
+        os.remove(path)
+        for result_path in _result_files(results_dir, path, pred_dir):
+            os.remove(result_path)
+            logger.info(f'Removed stale results {result_path}')
+        logger.info(f'Repairing {len(indices)} failed samples of {path}')
+    if not failed:
+        logger.info(f'No failed samples found in {pred_dir}')
+    return failed
@@ -0,0 +1,361 @@
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple
+
+from .logging import get_logger
+
+__all__ = [
+    'RetryPolicy', 'RetryError', 'FatalAPIError', 'CircuitOpenError',
+    'CircuitBreaker', 'get_status_code', 'get_retry_after',
+    'RETRY_EXHAUSTED_PREFIX'
+]
+
+# client errors that are still worth another attempt
+RETRYABLE_STATUS = (408, 409, 425, 429)
+
+# start of the prediction recorded for a sample whose retries ran out
+RETRY_EXHAUSTED_PREFIX = 'Max Retries, status: Error'
+
+
+def get_status_code(error: BaseException) -> Optional[int]:
+    """Get the HTTP status code carried by an API exception, if any."""
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code',
+                         None)
+    return status if isinstance(status, int) else None
+
+
+def get_retry_after(error: BaseException) -> Optional[float]:
+    """Get the delay in seconds requested by a ``Retry-After`` header."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after') or headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0., float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0., parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class FatalAPIError(RuntimeError):
+    """An API error that no retry can fix, e.g. every key is out of quota."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a backend whose circuit is open."""
+
+
+class RetryError(RuntimeError):
+    """Raised when a call gives up, carrying the error of every attempt.
+
+    Args:
+        errors (List[Tuple[float, BaseException]]): Wall-clock time and error
+            of each failed attempt.
+        reason (str): Why the call gave up.
+    """
+
+    def __init__(self, errors: List[Tuple[float, BaseException]],
+                 reason: str):
+        self.errors = errors
+        self.reason = reason
+        last = errors[-1][1]
+        super().__init__(f'{reason} after {len(errors)} attempt(s), last '
+                         f'error: {type(last).__name__}: {last}')
+
+    @property
+    def attempts(self) -> int:
+        return len(self.errors)
+
+    def format_errors(self) -> str:
+        """Timestamped summary of every attempt, one after another."""
+        return ''.join(
+            f'{datetime.fromtimestamp(ts).strftime("[%Y-%m-%d %H:%M:%S]")} '
+            f'{i}:{type(e).__name__}: {e}'
+            for i, (ts, e) in enumerate(self.errors, 1))
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker of one endpoint.
+
+    The circuit opens after ``failure_threshold`` consecutive failures and
+    every call fails fast while it is open. After ``reset_timeout`` seconds it
+    is half-open: a single probe call goes through, closing the circuit on
+    success and opening it again on failure.
+
+    Args:
+        failure_threshold (int): Consecutive failures that open the circuit.
+            Defaults to 5.
+        reset_timeout (float): Seconds before a probe is let through.
+            Defaults to 30.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half_open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record(self, success: Optional[bool]) -> bool:
+        """Record the outcome of a call, returns True if the circuit has just
+        been opened. None records a neutral outcome, e.g. a request the
+        endpoint rejected, which says nothing about its health."""
+        with self._lock:
+            self.probing = False
+            if success is None:
+                return False
+            if success:
+                self.failures = 0
+                self.opened_at = None
+                return False
+            self.failures += 1
+            if self.opened_at is not None or \
+                    self.failures >= self.failure_threshold:
+                was_open = self.opened_at is not None
+                self.opened_at = time.monotonic()
+                return not was_open
+            return False
+
+
+class RetryPolicy:
+    """Retry policy shared by the API models.
+
+    One policy replaces the retry loops of the individual clients. A failed
+    attempt is retried with decorrelated jitter, i.e. a delay drawn from
+    ``[base_delay, 3 * previous delay]`` and capped by ``max_delay``. A
+    ``Retry-After`` header raises the delay to at least the requested value.
+    A call gives up when:
+
+    - the error cannot be fixed by retrying (4xx other than 408/409/425/429,
+      or :obj:`FatalAPIError`);
+    - ``max_attempts`` is reached;
+    - the next attempt would start after the per-call ``deadline``;
+    - the shared ``retry_budget`` is spent;
+    - the circuit of the endpoint is open.
+
+    Args:
+        max_attempts (int): Attempts per call, including the first one.
+            Defaults to 3.
+        base_delay (float): Smallest delay between attempts in seconds.
+            Defaults to 1.
+        max_delay (float): Largest delay between attempts in seconds.
+            Defaults to 30.
+        deadline (float, optional): Seconds a call (one sample) may spend on
+            retrying. An attempt in flight is bounded by the client timeout,
+            not by the deadline. Defaults to None (no deadline).
+        retry_budget (float, optional): Retries of all calls may not exceed
+            ``min_retries`` plus this fraction of the calls, so that a failing
+            backend is not flooded with retries. Defaults to None (no
+            budget).
+        min_retries (int): Retries always allowed by the budget. Defaults
+            to 10.
+        circuit_breaker (Dict, optional): Keyword arguments of
+            :obj:`CircuitBreaker`, one per endpoint key. Defaults to None
+            (disabled).
+    """
+
+    def __init__(self,
+                 max_attempts: int = 3,
+                 base_delay: float = 1.,
+                 max_delay: float = 30.,
+                 deadline: Optional[float] = None,
+                 retry_budget: Optional[float] = None,
+                 min_retries: int = 10,
+                 circuit_breaker: Optional[Dict] = None):
+        assert max_attempts >= 1, 'max_attempts must be positive'
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_budget = retry_budget
+        self.min_retries = min_retries
+        self.circuit_breaker = circuit_breaker
+        self.breakers: Dict[Optional[str], CircuitBreaker] = {}
+        self.counters = dict(calls=0,
+                             retries=0,
+                             failures=0,
+                             budget_exhausted=0,
+                             deadline_exceeded=0,
+                             circuit_rejections=0)
+        self._lock = threading.Lock()
+        self.logger = get_logger()
+
+    @staticmethod
+    def is_retryable(error: BaseException) -> bool:
+        if isinstance(error, (FatalAPIError, CircuitOpenError)):
+            return False
+        status = get_status_code(error)
+        return status is None or status >= 500 or status in RETRYABLE_STATUS
+
+    def breaker(self, key: Optional[str]) -> Optional[CircuitBreaker]:
+        if self.circuit_breaker is None:
+            return None
+        with self._lock:
+            if key not in self.breakers:
+                self.breakers[key] = CircuitBreaker(**self.circuit_breaker)
+            return self.breakers[key]
+
+    def _count(self, name: str, delta: int = 1):
+        with self._lock:
+            self.counters[name] += delta
+
+    def _spend_retry(self) -> bool:
+        with self._lock:
+            if self.retry_budget is not None and self.counters['retries'] >= \
+                    self.min_retries + self.retry_budget * self.counters['calls']:
+                self.counters['budget_exhausted'] += 1
+                return False
+            self.counters['retries'] += 1
+            return True
+
+    def run(self,
+            func,
+            *args,
+            key: Optional[str] = None,
+            circuit: bool = True,
+            **kwargs):
+        """Call ``func(*args, **kwargs)`` under the policy.
+
+        Args:
+            key (str, optional): Endpoint the call goes to, selecting its
+                circuit breaker.
+            circuit (bool): Whether the call goes through the circuit
+                breaker. Callers spreading the attempts over several
+                endpoints with a health check of their own pass False.
+                Defaults to True.
+
+        Raises:
+            RetryError: When the call gives up.
+        """
+        call = _RetryCall(self, key, circuit)
+        while True:
+            call.before_attempt()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                time.sleep(call.after_failure(e))
+            else:
+                call.after_success()
+                return result
+
+    async def arun(self,
+                   func,
+                   *args,
+                   key: Optional[str] = None,
+                   circuit: bool = True,
+                   **kwargs):
+        """Async counterpart of :meth:`run` for a coroutine function."""
+        call = _RetryCall(self, key, circuit)
+        while True:
+            call.before_attempt()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                await asyncio.sleep(call.after_failure(e))
+            else:
+                call.after_success()
+                return result
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.counters)
+            open_circuits = [
+                key for key, breaker in self.breakers.items()
+                if breaker.state != 'closed'
+            ]
+        if open_circuits:
+            stats['open_circuits'] = open_circuits
+        return stats
+
+
+class _RetryCall:
+    """Bookkeeping of one call of a :obj:`RetryPolicy`."""
+
+    def __init__(self, policy: RetryPolicy, key: Optional[str],
+                 circuit: bool = True):
+        self.policy = policy
+        self.key = key
+        self.breaker = policy.breaker(key) if circuit else None
+        self.errors: List[Tuple[float, BaseException]] = []
+        self.start = time.monotonic()
+        self.delay = policy.base_delay
+        policy._count('calls')
+
+    def _give_up(self, reason: str, counter: Optional[str] = None):
+        self.policy._count('failures')
+        if counter is not None:
+            self.policy._count(counter)
+        raise RetryError(self.errors, reason) from self.errors[-1][1]
+
+    def before_attempt(self):
+        if self.breaker is not None and not self.breaker.allow():
+            self.errors.append(
+                (time.time(),
+                 CircuitOpenError(f'circuit of {self.key} is open')))
+            self._give_up('Circuit open', 'circuit_rejections')
+
+    def after_success(self):
+        if self.breaker is not None:
+            self.breaker.record(True)
+
+    def after_failure(self, error: BaseException) -> float:
+        """Record a failed attempt and return the delay before the next one,
+        or raise :obj:`RetryError` to give up."""
+        policy = self.policy
+        self.errors.append((time.time(), error))
+        retryable = policy.is_retryable(error)
+        # a rejected request is neither a failure nor a success of the
+        # endpoint
+        outcome = False if retryable else None
+        if self.breaker is not None and self.breaker.record(outcome):
+            policy.logger.error(f'Circuit of {self.key} opened after '
+                                f'{self.breaker.failures} failures, failing '
+                                f'fast for {self.breaker.reset_timeout:g}s')
+        if not retryable:
+            self._give_up('Not retryable')
+        if len(self.errors) >= policy.max_attempts:
+            self._give_up('Max retries')
+
+        # decorrelated jitter
+        self.delay = min(policy.max_delay,
+                         random.uniform(policy.base_delay, self.delay * 3))
+        delay = max(self.delay, get_retry_after(error) or 0.)
+        if policy.deadline is not None and \
+                time.monotonic() - self.start + delay > policy.deadline:
+            self._give_up('Deadline exceeded', 'deadline_exceeded')
+        if not policy._spend_retry():
+            self._give_up('Retry budget exhausted')
+        policy.logger.warning(
+            f'{type(error).__name__}: {error}, retrying in {delay:.1f}s '
+            f'(attempt {len(self.errors)}/{policy.max_attempts})')
+        return delay
@@ -0,0 +1,109 @@
+import gzip
+import json
+import logging
+import os
+import os.path as osp
+import queue
+import random
+import time
+import uuid
+from logging.handlers import QueueListener
+from typing import Dict, Optional
+
+__all__ = ['RequestTracer']
+
+
+class _JsonlHandler(logging.Handler):
+    """Write the dict carried by each record as one JSON line, optionally
+    gzip compressed. Runs on the listener thread only."""
+
+    def __init__(self, path: str, kind: str, compress: bool = False):
+        super().__init__()
+        self.kind = kind
+        if compress:
+            self.stream = gzip.open(path, 'at', encoding='utf-8')
+        else:
+            self.stream = open(path, 'a', encoding='utf-8')
+        self.addFilter(lambda record: record.kind == self.kind)
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.stream.write(
+                json.dumps(record.msg, ensure_ascii=False, default=str) +
+                '\n')
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.stream.close()
+        super().close()
+
+
+class RequestTracer:
+    """Low-overhead request tracing for API models.
+
+    Every request produces one compact JSON line (ids, sizes, timings and
+    status) in ``path``. Full request and response payloads go to a separate
+    ``*.payloads.jsonl[.gz]`` store, sampled by ``payload_sample_rate``.
+    Callers only build a small dict and enqueue it. Serialisation and disk
+    I/O happen on a background listener thread.
+
+    Args:
+        path (str): Path of the trace file (JSON lines).
+        payload_sample_rate (float): Fraction of requests whose full payload
+            is kept. Defaults to 0.
+        compress (bool): Whether to gzip the payload store. Defaults to True.
+    """
+
+    def __init__(self,
+                 path: str,
+                 payload_sample_rate: float = 0.,
+                 compress: bool = True):
+        if osp.dirname(path):
+            os.makedirs(osp.dirname(path), exist_ok=True)
+        self.path = path
+        self.payload_sample_rate = payload_sample_rate
+        self._queue = queue.SimpleQueue()
+        handlers = [_JsonlHandler(path, 'trace')]
+        if payload_sample_rate > 0:
+            root, _ = osp.splitext(path)
+            payload_path = root + '.payloads.jsonl' + ('.gz'
+                                                       if compress else '')
+            handlers.append(_JsonlHandler(payload_path, 'payload', compress))
+        self._handlers = handlers
+        self._listener = QueueListener(self._queue, *handlers)
+        self._listener.start()
+
+    @staticmethod
+    def new_request_id() -> str:
+        return uuid.uuid4().hex[:16]
+
+    def _put(self, kind: str, data: Dict):
+        self._queue.put_nowait(
+            logging.makeLogRecord({
+                'msg': data,
+                'kind': kind
+            }))
+
+    def record(self, **fields):
+        """Enqueue one compact trace record."""
+        fields.setdefault('ts', round(time.time(), 3))
+        self._put('trace', fields)
+
+    def should_sample_payload(self) -> bool:
+        return self.payload_sample_rate > 0 and \
+            random.random() < self.payload_sample_rate
+
+    def payload(self, request_id: str, request: Dict,
+                response: Optional[Dict] = None):
+        """Enqueue the full payload of a request."""
+        self._put('payload', {
+            'id': request_id,
+            'request': request,
+            'response': response
+        })
+
+    def close(self):
+        self._listener.stop()
+        for handler in self._handlers:
+            handler.close()
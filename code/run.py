@@ -10,7 +10,7 @@ from opencompass.partitioners import MultimodalNaivePartitioner
 from opencompass.registry import PARTITIONERS, RUNNERS, build_from_cfg
 from opencompass.runners import SlurmRunner
 from opencompass.summarizers import DefaultSummarizer
-from opencompass.utils import LarkReporter, get_logger
+from opencompass.utils import LarkReporter, get_logger, repair_predictions
 from opencompass.utils.run import (exec_mm_infer_runner, fill_eval_cfg,
                                    fill_infer_cfg, get_config_from_arg)
 
@@ -71,6 +71,13 @@ def parse_args():
                              'argument is not specified, the latest results in '
                              'the work_dir will be reused. The argument should '
                              'also be a specific timestamp, e.g. 20230516_144254'),
+    parser.add_argument('--repair',
+                        help='Re-run only the samples of the reused outputs '
+                             'whose prediction is empty or a retry-exhausted '
+                             'error, patch them into the prediction files and '
+                             're-score the affected datasets. Implies -r.',
+                        action='store_true',
+                        default=False)
     parser.add_argument('-w',
                         '--work-dir',
                         help='Work path, all the outputs will be '
@@ -210,6 +217,11 @@ def main():
 
     # cfg_time_str defaults to the current time
     cfg_time_str = dir_time_str = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    if args.repair:
+        if args.mode not in ['all', 'infer']:
+            raise ValueError('--repair re-runs inference, it cannot be used '
+                             f'in {args.mode} mode!')
+        args.reuse = args.reuse or 'latest'
     if args.reuse:
         if args.reuse == 'latest':
             if not os.path.exists(cfg.work_dir) or not os.listdir(
@@ -244,6 +256,9 @@ def main():
         content = f'{getpass.getuser()}\'s task has been launched!'
         LarkReporter(cfg['lark_bot_url']).post(content)
 
+    if args.repair:
+        repair_predictions(cfg['work_dir'])
+
     if args.mode in ['all', 'infer']:
         # When user have specified --slurm or --dlc, or have not set
         # "infer" in config, we will provide a default configuration
@@ -0,0 +1,75 @@
+import pytest
+
+from opencompass.models.base_api import AdaptiveConcurrencyController
+
+
+class StatusError(Exception):
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f'HTTP {status_code}')
+        self.status_code = status_code
+        headers = {} if retry_after is None else {
+            'retry-after': str(retry_after)
+        }
+        self.response = type('Response', (), {'headers': headers})()
+
+
+def test_window_grows_on_success():
+    controller = AdaptiveConcurrencyController(initial_window=2,
+                                               max_window=4)
+    for _ in range(20):
+        assert controller.try_acquire()[0]
+        controller.release(latency=0.01)
+    assert controller.stats()['window'] == 4
+
+
+def test_window_shrinks_on_congestion():
+    controller = AdaptiveConcurrencyController(initial_window=8, cooldown=0)
+    controller.acquire()
+    controller.release(error=StatusError(429))
+    assert controller.stats()['window'] == 4
+    controller.acquire()
+    controller.release(error=TimeoutError())
+    assert controller.stats()['window'] == 2
+    # a client error is no congestion signal
+    controller.acquire()
+    controller.release(error=StatusError(400))
+    assert controller.stats()['window'] == 2
+
+
+def test_decrease_cooldown():
+    controller = AdaptiveConcurrencyController(initial_window=8, cooldown=60)
+    for _ in range(3):
+        controller.acquire()
+        controller.release(error=StatusError(503))
+    assert controller.stats()['window'] == 4
+
+
+def test_slow_response_is_congestion():
+    controller = AdaptiveConcurrencyController(initial_window=8,
+                                               latency_threshold=1.,
+                                               cooldown=0)
+    controller.acquire()
+    controller.release(latency=2.)
+    assert controller.stats()['window'] == 4
+
+
+def test_full_window_and_retry_after():
+    controller = AdaptiveConcurrencyController(initial_window=1)
+    assert controller.try_acquire() == (True, None)
+    assert controller.try_acquire() == (False, None)
+    controller.release(error=StatusError(429, retry_after=30))
+    acquired, delay = controller.try_acquire()
+    assert not acquired and 29 < delay <= 30
+
+
+def test_slot_reports_outcome():
+    controller = AdaptiveConcurrencyController(initial_window=2)
+    with pytest.raises(ValueError):
+        with controller.slot():
+            raise ValueError()
+    with controller.slot():
+        pass
+    stats = controller.stats()
+    assert stats['in_flight'] == 0
+    assert stats['requests'] == 2 and stats['errors'] == 1
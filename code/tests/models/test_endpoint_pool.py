@@ -0,0 +1,85 @@
+import time
+
+from opencompass.models.endpoint_pool import EndpointPool, derive_base_url
+
+URLS = ['http://a/v1/chat/completions', 'http://b/v1/chat/completions']
+
+
+class StatusError(Exception):
+
+    def __init__(self, status_code):
+        super().__init__(f'HTTP {status_code}')
+        self.status_code = status_code
+
+
+def test_derive_base_url():
+    assert derive_base_url(URLS[0]) == 'http://a/v1'
+
+
+def test_least_outstanding():
+    pool = EndpointPool(URLS)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is not second
+    pool.release(first, latency=0.1)
+    assert pool.acquire() is first
+
+
+def test_exclude():
+    pool = EndpointPool(URLS)
+    a, b = pool.endpoints
+    assert pool.acquire(exclude=a) is b
+    # the only replica is used if there is no other
+    single = EndpointPool(URLS[:1])
+    assert single.acquire(exclude=single.endpoints[0]) is single.endpoints[0]
+
+
+def test_ejection_and_probe():
+    pool = EndpointPool(URLS, max_failures=2, eject_time=0.05)
+    a, b = pool.endpoints
+    for _ in range(2):
+        pool.release(pool.acquire(exclude=b), error=ValueError())
+    assert pool.stats()[a.url]['ejected']
+    assert all(pool.acquire() is b for _ in range(5))
+
+    time.sleep(0.06)
+    # half-open: a single probe goes to the ejected replica
+    assert pool.acquire() is a
+    assert pool.acquire() is b
+    pool.release(a, latency=0.1)
+    assert a.ejections == 0
+
+
+def test_failed_probe_doubles_ejection():
+    pool = EndpointPool(URLS[:1], max_failures=1, eject_time=0.05)
+    endpoint = pool.endpoints[0]
+    pool.release(pool.acquire(), error=ValueError())
+    time.sleep(0.06)
+    pool.release(pool.acquire(), error=ValueError())
+    assert endpoint.ejections == 2
+    assert endpoint.ejected_until - time.monotonic() > 0.05
+
+
+def test_slow_replica_is_ejected():
+    pool = EndpointPool(URLS, slow_factor=3.)
+    a, b = pool.endpoints
+    for _ in range(EndpointPool.MIN_SAMPLES):
+        b.outstanding += 1
+        pool.release(b, latency=0.1)
+    for _ in range(EndpointPool.MIN_SAMPLES):
+        a.outstanding += 1
+        pool.release(a, latency=1.)
+    assert pool.stats()[a.url]['ejected']
+    assert not pool.stats()[b.url]['ejected']
+
+
+def test_rejected_request_is_neutral():
+    pool = EndpointPool(URLS[:1], max_failures=2)
+    endpoint = pool.endpoints[0]
+    # a 4xx in between neither counts as a failure nor resets the streak
+    for error in (ValueError(), StatusError(400), StatusError(404)):
+        pool.release(pool.acquire(), error=error)
+    assert not pool.stats()[endpoint.url]['ejected']
+    assert endpoint.failures == 1 and endpoint.errors == 3
+    pool.release(pool.acquire(), error=StatusError(429))
+    assert pool.stats()[endpoint.url]['ejected']
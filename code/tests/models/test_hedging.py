@@ -0,0 +1,167 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from opencompass.models.endpoint_pool import EndpointPool
+from opencompass.models.general_api import BaseGeneralApi
+from opencompass.models.hedging import (HedgeAttempt, RequestCancelled,
+                                        RequestHedger)
+
+
+class FakeResponse:
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+
+def _hedger(**kwargs):
+    hedger = RequestHedger(**{
+        'min_samples': 1,
+        'max_ratio': 1.,
+        'min_delay': 0.05,
+        **kwargs
+    })
+    primed = HedgeAttempt()
+    primed.begin('ep')
+    primed.first_token_time = primed.start + 0.01
+    hedger.observe(primed)
+    return hedger
+
+
+def _model(**hedge):
+    return BaseGeneralApi(api_url='http://127.0.0.1:9/v1/chat/completions',
+                          api_headers={'Authorization': 'Bearer test'},
+                          hedge=hedge)
+
+
+def test_hedger_delay_and_budget():
+    hedger = RequestHedger(min_samples=2, max_ratio=0.5, min_delay=0.)
+    assert hedger.delay() is None
+    for ttft in (0.1, 0.3):
+        attempt = HedgeAttempt()
+        attempt.first_token_time = attempt.start + ttft
+        hedger.observe(attempt)
+    assert hedger.delay() == pytest.approx(0.3)
+    assert hedger.try_hedge()
+    assert not hedger.try_hedge()
+    assert hedger.stats()['budget_skips'] == 1
+
+
+def test_cancel_closes_bound_response():
+    attempt = HedgeAttempt()
+    attempt.begin('ep')
+    response = FakeResponse()
+    attempt.bind(response)
+    attempt.cancel()
+    assert response.closed.is_set()
+    with pytest.raises(RequestCancelled):
+        attempt.check_cancelled(OSError('closed'))
+
+
+def test_cancelled_attempt_is_not_sent():
+    attempt = HedgeAttempt()
+    attempt.cancel()
+    with pytest.raises(RequestCancelled):
+        attempt.begin('ep')
+    response = FakeResponse()
+    with pytest.raises(RequestCancelled):
+        attempt.bind(response)
+    assert response.closed.is_set()
+
+
+def test_cancelled_lease_is_neutral():
+    pool = EndpointPool(['http://a/v1/chat/completions'], max_failures=1)
+    with pytest.raises(RequestCancelled):
+        with pool.use():
+            raise RequestCancelled()
+    endpoint = pool.endpoints[0]
+    assert endpoint.outstanding == 0
+    assert endpoint.failures == 0 and endpoint.requests == 0
+
+    with pytest.raises(ValueError):
+        with pool.use():
+            raise ValueError()
+    assert pool.stats()[endpoint.url]['ejected']
+
+
+def test_clock_starts_when_sent():
+    attempt = HedgeAttempt()
+    threading.Timer(0.2, attempt.begin, ('ep', )).start()
+    start = time.monotonic()
+    # local queueing before begin() does not count towards the delay
+    assert not attempt.wait_first_token(0.1)
+    assert time.monotonic() - start >= 0.3 - 0.05
+
+
+def test_hedge_wins_and_primary_is_closed():
+    model = _model()
+    model.hedger = _hedger()
+    stuck = FakeResponse()
+    outcomes = {}
+
+    def request(messages, attempt):
+        attempt.begin('ep' if attempt.exclude is None else 'other')
+        if attempt.exclude is None:
+            attempt.bind(stuck)
+            try:
+                # blocked before the first token until the response closes
+                if not stuck.closed.wait(10):
+                    return {'content': 'primary'}
+                raise OSError('connection closed')
+            except OSError as e:
+                outcomes['primary'] = 'cancelled'
+                attempt.check_cancelled(e)
+                raise
+        attempt.on_chunk()
+        return {'content': 'hedge'}
+
+    start = time.monotonic()
+    assert model._hedged_request(request, [])['content'] == 'hedge'
+    assert stuck.closed.is_set()
+    assert time.monotonic() - start < 5
+    model._hedge_executor.shutdown(wait=True)
+    assert outcomes == {'primary': 'cancelled'}
+    assert model.hedger.stats()['hedge_wins'] == 1
+
+
+def test_fast_primary_is_not_hedged():
+    model = _model()
+    model.hedger = _hedger()
+    calls = []
+
+    def request(messages, attempt):
+        calls.append(attempt)
+        attempt.begin('ep')
+        attempt.on_chunk()
+        return {'content': 'primary'}
+
+    assert model._hedged_request(request, [])['content'] == 'primary'
+    assert len(calls) == 1
+    assert model.hedger.stats()['hedges'] == 0
+
+
+def test_async_hedge_cancels_primary():
+    model = _model()
+    model.hedger = _hedger()
+    cancelled = []
+
+    async def request(messages, attempt):
+        attempt.begin('ep')
+        if attempt.exclude is None and not cancelled:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+        attempt.on_chunk()
+        return {'content': 'hedge'}
+
+    result = asyncio.run(
+        asyncio.wait_for(model._ahedged_request(request, []), 5))
+    assert result['content'] == 'hedge'
+    assert cancelled == [True]
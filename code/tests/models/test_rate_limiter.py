@@ -0,0 +1,29 @@
+import time
+
+import pytest
+
+from opencompass.models.base_api import RateLimiter
+
+
+def test_disabled_limiter_never_waits():
+    limiter = RateLimiter(None)
+    assert not limiter.enabled
+    assert all(limiter.try_acquire(10**6) == 0 for _ in range(100))
+
+
+def test_request_bucket():
+    limiter = RateLimiter(10, burst=3)
+    assert [limiter.try_acquire() for _ in range(3)] == [0, 0, 0]
+    delay = limiter.try_acquire()
+    assert 0 < delay <= 0.1
+    time.sleep(delay)
+    assert limiter.try_acquire() == 0
+
+
+def test_token_bucket():
+    limiter = RateLimiter(None, tokens_per_minute=600)
+    assert limiter.try_acquire(500) == 0
+    # 10 tokens per second refill the missing 400
+    assert limiter.try_acquire(500) == pytest.approx(40, abs=0.5)
+    # an oversized request is charged the whole budget, not refused forever
+    assert RateLimiter(None, tokens_per_minute=600).try_acquire(10**6) == 0
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from opencompass.models.response_cache import ResponseCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache' / 'responses.sqlite'))
+    yield cache
+    cache.close()
+
+
+def test_make_key_is_order_independent():
+    assert ResponseCache.make_key(a=1, b={'x': 1, 'y': 2}) == \
+        ResponseCache.make_key(b={'y': 2, 'x': 1}, a=1)
+    assert ResponseCache.make_key(a=1) != ResponseCache.make_key(a=2)
+
+
+def test_roundtrip(cache):
+    key = ResponseCache.make_key(model='m', messages=['hi'])
+    assert cache.get(key) is None
+    cache.put(key, {'content': '你好', 'reasoning': None})
+    assert cache.get(key) == {'content': '你好', 'reasoning': None}
+    assert cache.stats() == dict(hits=1, misses=1, writes=1, evictions=0)
+
+
+def test_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'responses.sqlite')
+    writer = ResponseCache(path)
+    writer.put('k', {'content': 'a'})
+    reader = ResponseCache(path, readonly=True)
+    assert reader.get('k') == {'content': 'a'}
+    # a readonly cache never writes
+    reader.put('other', {'content': 'b'})
+    assert writer.get('other') is None
+    reader.close()
+    writer.close()
+
+
+def test_ttl(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'), ttl=0.05)
+    cache.put('k', {'content': 'a'})
+    assert cache.get('k') == {'content': 'a'}
+    time.sleep(0.1)
+    assert cache.get('k') is None
+    cache.close()
+
+
+def test_evicts_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(ResponseCache, 'EVICT_EVERY', 1)
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'), max_entries=2)
+    cache.put('a', {'content': 'a'})
+    time.sleep(0.01)
+    cache.put('b', {'content': 'b'})
+    time.sleep(0.01)
+    cache.get('a')
+    time.sleep(0.01)
+    cache.put('c', {'content': 'c'})
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.stats()['evictions'] == 1
+    cache.close()
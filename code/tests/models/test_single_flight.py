@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from opencompass.models.single_flight import SingleFlight
+
+
+def test_concurrent_calls_are_coalesced():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def request(value):
+        calls.append(value)
+        release.wait(5)
+        return {'content': value}
+
+    with ThreadPoolExecutor(4) as executor:
+        futures = [
+            executor.submit(flight.do, 'key', request, 'a') for _ in range(4)
+        ]
+        time.sleep(0.1)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert calls == ['a']
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert all(result == {'content': 'a'} for result, _ in results)
+    assert flight.stats() == dict(calls=4, coalesced=3, dedup_ratio=0.75)
+
+
+def test_completed_calls_are_forgotten():
+    flight = SingleFlight()
+    assert flight.do('key', lambda: 1) == (1, False)
+    assert flight.do('key', lambda: 2) == (2, False)
+
+
+def test_error_is_shared():
+    flight = SingleFlight()
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        raise ValueError('boom')
+
+    with ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(flight.do, 'key', failing)
+        started.wait(5)
+        follower = executor.submit(flight.do, 'key', failing)
+        for future in (leader, follower):
+            with pytest.raises(ValueError):
+                future.result()
+    # the failed call is not remembered either
+    assert flight.do('key', lambda: 'ok') == ('ok', False)
+
+
+def test_async_calls_are_coalesced():
+    flight = SingleFlight()
+    calls = []
+
+    async def request(value):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        return value
+
+    async def main():
+        return await asyncio.gather(
+            *[flight.ado('key', request, 'a') for _ in range(3)])
+
+    results = asyncio.run(main())
+    assert calls == ['a']
+    assert sorted(results) == [('a', False), ('a', True), ('a', True)]
+
+
+def test_async_leader_cancelled():
+    flight = SingleFlight()
+
+    async def main():
+        leader = asyncio.ensure_future(
+            flight.ado('key', asyncio.sleep, 10))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(
+            flight.ado('key', asyncio.sleep, 10))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        # a new call runs on its own
+        return await flight.ado('key', asyncio.sleep, 0, 'ok')
+
+    assert asyncio.run(main()) == ('ok', False)
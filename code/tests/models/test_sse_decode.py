@@ -0,0 +1,129 @@
+import json
+
+import httpx
+import pytest
+
+from opencompass.models import NonReasoningAPI, ReasoningAPI
+
+
+def _event(delta=None, usage=None):
+    chunk = {
+        'id': 'chatcmpl-golden',
+        'object': 'chat.completion.chunk',
+        'created': 0,
+        'model': 'golden',
+        'choices': [] if delta is None else [{
+            'index': 0,
+            'delta': delta,
+            'finish_reason': None
+        }],
+    }
+    if usage is not None:
+        chunk['usage'] = usage
+    return f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'
+
+
+def _multiline_event(delta):
+    # one event whose JSON is split over two data lines
+    line = json.dumps({
+        'id': 'chatcmpl-golden',
+        'object': 'chat.completion.chunk',
+        'created': 0,
+        'model': 'golden',
+        'choices': [{
+            'index': 0,
+            'delta': delta,
+            'finish_reason': None
+        }],
+    }, ensure_ascii=False)
+    head, tail = line.split('"choices"')
+    return f'data: {head}\ndata: "choices"{tail}\n\n'
+
+
+USAGE = {'prompt_tokens': 9, 'completion_tokens': 8, 'total_tokens': 17}
+
+STREAMS = {
+    'reasoning_content': ''.join([
+        _event({'role': 'assistant', 'content': ''}),
+        _event({'content': None, 'reasoning_content': '先想一想，'}),
+        _event({'content': None, 'reasoning_content': '再回答。\n'}),
+        _event({'content': '答案是 42', 'reasoning_content': None}),
+        _multiline_event({'content': '。✓'}),
+        _event(usage=USAGE),
+        'data: [DONE]\n\n',
+    ]),
+    'reasoning': ''.join([
+        ': keep-alive comment\n\n',
+        _event({'role': 'assistant', 'content': None}),
+        _event({'reasoning': '推理'}),
+        _event({'reasoning': ''}),
+        _event({'content': '你好，世界'}),
+        _event({}),
+        'data: [DONE]\n\n',
+    ]),
+    'crlf_without_done': ''.join([
+        _event({'content': 'ünïcödé '}).replace('\n', '\r\n'),
+        _event({'content': '🙂'}).replace('\n', '\r\n'),
+    ]),
+    'empty_answer': ''.join([
+        _event({'role': 'assistant', 'content': ''}),
+        'data: [DONE]\n\n',
+    ]),
+}
+
+# chunk sizes of the response body: whole, split mid-line and mid-UTF-8
+# character, and byte by byte
+CHUNK_SIZES = [None, 7, 1]
+
+
+def _chunks(body, size):
+    if size is None:
+        return [body]
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+def _model(cls, monkeypatch, body, size):
+
+    def handler(request):
+        return httpx.Response(200,
+                              headers={'content-type': 'text/event-stream'},
+                              content=iter(_chunks(body, size)))
+
+    monkeypatch.setattr(httpx, 'HTTPTransport',
+                        lambda **kwargs: httpx.MockTransport(handler))
+    return cls(path='golden',
+               api_url='http://golden/v1/chat/completions',
+               api_data={'model': 'golden'},
+               api_headers={'Authorization': 'Bearer golden'},
+               retry=0)
+
+
+def test_streams_split_mid_character():
+    body = STREAMS['reasoning_content'].encode('utf-8')
+    bad = 0
+    for chunk in _chunks(body, 7):
+        try:
+            chunk.decode('utf-8')
+        except UnicodeDecodeError:
+            bad += 1
+    assert bad > 0
+
+
+@pytest.mark.parametrize('cls', [ReasoningAPI, NonReasoningAPI])
+@pytest.mark.parametrize('name', list(STREAMS))
+@pytest.mark.parametrize('size', CHUNK_SIZES)
+def test_raw_stream_matches_sdk(cls, name, size, monkeypatch):
+    body = STREAMS[name].encode('utf-8')
+    messages = [{'role': 'user', 'content': 'hi'}]
+    results = []
+    for raw_stream in (False, True):
+        model = _model(cls, monkeypatch, body, size)
+        model.raw_stream = raw_stream
+        results.append(model.generate_stream(messages))
+    expected, actual = results
+    assert actual.keys() == expected.keys()
+    for key, value in expected.items():
+        if value is None:
+            assert actual[key] is None
+        else:
+            assert actual[key].encode('utf-8') == value.encode('utf-8')
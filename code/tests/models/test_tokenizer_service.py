@@ -0,0 +1,57 @@
+import pytest
+
+from opencompass.models.tokenizer_service import (TokenizerService,
+                                                  heuristic_token_len)
+
+TEXT = 'one two three four five six'
+
+
+def test_heuristic_token_len():
+    assert heuristic_token_len('Hello, world 2024!') == 3
+    assert heuristic_token_len('你好 world') == 3
+    assert heuristic_token_len('') == 0
+
+
+def test_count_batch_is_cached():
+    service = TokenizerService()
+    assert service.count_batch(['a b', 'c', 'a b']) == [2, 1, 2]
+    assert service.count('a b') == 2
+    stats = service.stats()
+    assert stats['misses'] == 2 and stats['hits'] == 2
+
+
+def test_cache_is_bounded():
+    service = TokenizerService(cache_size=2)
+    service.count_batch(['a', 'b b', 'c c c'])
+    assert len(service._cache) == 2
+    assert TokenizerService(cache_size=0).count_batch(['a', 'a']) == [1, 1]
+
+
+@pytest.mark.parametrize('mode, expected', [
+    ('rear', 'one two three '),
+    ('front', 'four five six'),
+    ('mid', 'one two five six'),
+])
+def test_trim(mode, expected):
+    service = TokenizerService()
+    trimmed = service.trim(TEXT, 4 if mode == 'mid' else 3, mode)
+    assert trimmed == expected
+
+
+def test_trim_keeps_short_text():
+    service = TokenizerService()
+    assert service.trim(TEXT, 6, 'mid') == TEXT
+    assert service.trim(TEXT, 100, 'front') == TEXT
+
+
+def test_trim_to_nothing():
+    service = TokenizerService()
+    assert service.trim(TEXT, 0, 'front') == ''
+    assert service.trim(TEXT, -5, 'rear') == ''
+
+
+def test_real_backends_need_a_name():
+    with pytest.raises(AssertionError):
+        TokenizerService(backend='tiktoken')
+    with pytest.raises(AssertionError):
+        TokenizerService(backend='unknown')
@@ -0,0 +1,130 @@
+import asyncio
+import gc
+import random
+import threading
+import time
+
+import pytest
+
+from opencompass.models.general_api import _EventLoopThread
+from opencompass.openicl.icl_inferencer import GenInferencer
+
+BATCH_SIZE = 8
+
+
+class MockModel:
+    """Answers every prompt after a fixed latency, so that both dispatchers
+    see the same workload."""
+
+    is_api = True
+
+    def __init__(self, latencies):
+        self.latencies = latencies
+
+    def parse_template(self, prompt_template, mode):
+        return list(prompt_template)
+
+    def generate(self, inputs, max_out_len):
+        return self.generate_from_template(inputs, max_out_len)
+
+    def generate_from_template(self, templates, max_out_len):
+        time.sleep(max(self.latencies[prompt] for prompt in templates))
+        return [f'answer to {prompt}' for prompt in templates]
+
+
+class AsyncMockModel(MockModel):
+    """Keeps its requests on an event loop, like ``async_mode`` API
+    models."""
+
+    async_mode = True
+
+    def __init__(self, latencies):
+        super().__init__(latencies)
+        self.loop_thread = _EventLoopThread()
+        self.threads = 0
+
+    def submit(self, inputs, max_out_len):
+        return self.loop_thread.submit(self._agenerate(inputs))
+
+    async def _agenerate(self, inputs):
+        self.threads = max(self.threads, threading.active_count())
+        await asyncio.sleep(max(self.latencies[prompt] for prompt in inputs))
+        return [f'answer to {prompt}' for prompt in inputs]
+
+
+@pytest.fixture(scope='module')
+def latencies():
+    # heavy-tailed: most samples are fast, a few are much slower
+    rng = random.Random(0)
+    return {
+        f'prompt {i}': min(rng.lognormvariate(-4.5, 1.2), 0.3)
+        for i in range(64)
+    }
+
+
+def _run(model, tmp_path, window):
+    inferencer = GenInferencer(model,
+                               max_out_len=16,
+                               batch_size=BATCH_SIZE,
+                               output_json_filepath=str(tmp_path),
+                               dispatch_window=window)
+    prompts = list(enumerate(model.latencies))
+    results = {}
+    # a full collection stalls every thread, keep it out of the timings
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        if window:
+            samples = inferencer._dispatch(prompts, len(prompts), window,
+                                           False)
+        else:
+            samples = inferencer._generate_batches(prompts, len(prompts),
+                                                   BATCH_SIZE, False)
+        for indices, outputs in samples:
+            for index, output in zip(indices, outputs):
+                assert index not in results
+                results[index] = output
+        elapsed = time.perf_counter() - start
+    finally:
+        gc.enable()
+    return elapsed, [results[i] for i in sorted(results)]
+
+
+def test_window_matches_batches_and_beats_the_barrier(latencies, tmp_path):
+    batches, expected = _run(MockModel(latencies), tmp_path, 0)
+    window, results = _run(MockModel(latencies), tmp_path, BATCH_SIZE)
+    assert results == expected
+    assert len(results) == len(latencies)
+    # the slowest sample of every batch no longer stalls the others
+    assert window < 0.8 * batches
+
+
+def test_async_model_needs_no_thread_per_sample(latencies, tmp_path):
+    _, expected = _run(MockModel(latencies), tmp_path, 0)
+    model = AsyncMockModel(latencies)
+    before = threading.active_count()
+    _, results = _run(model, tmp_path, 32)
+    assert results == expected
+    assert model.threads <= before + 1
+    model.loop_thread.stop()
+
+
+def test_early_exit_cancels_requests_in_flight(tmp_path):
+    model = AsyncMockModel({'fast': 0., 'slow': 10.})
+    inferencer = GenInferencer(model,
+                               max_out_len=16,
+                               batch_size=BATCH_SIZE,
+                               output_json_filepath=str(tmp_path))
+    samples = inferencer._dispatch([(0, 'fast'), (1, 'slow')], 2, 2, False)
+    assert next(samples)[0] == [0]
+    tasks = model.loop_thread.run(_pending_tasks())
+    samples.close()
+    time.sleep(0.05)
+    assert tasks and all(task.cancelled() for task in tasks)
+    model.loop_thread.stop()
+
+
+async def _pending_tasks():
+    current = asyncio.current_task()
+    return [task for task in asyncio.all_tasks() if task is not current]
@@ -0,0 +1,99 @@
+import json
+import os
+
+from opencompass.openicl.icl_inferencer.icl_base_inferencer import (
+    GenInferencerOutputHandler, ResultJournal, dump_results_dict)
+
+
+def _result(idx):
+    return {'origin_prompt': f'question {idx}', 'prediction': f'answer {idx}'}
+
+
+def test_replay_appended_records(tmp_path):
+    journal = ResultJournal(str(tmp_path / 'tmp_foo.jsonl'), fsync=False)
+    journal.append({'0': _result(0), '1': _result(1)})
+    journal.append({})
+    journal.append({'2': _result(2)})
+    journal.close()
+
+    replayed = ResultJournal(journal.path).replay()
+    assert replayed == {str(i): _result(i) for i in range(3)}
+
+
+def test_replay_later_record_wins(tmp_path):
+    journal = ResultJournal(str(tmp_path / 'tmp_foo.jsonl'), fsync=False)
+    journal.append({'0': _result(0)})
+    journal.append({'0': {'prediction': 'patched'}})
+    journal.close()
+    assert journal.replay() == {'0': {'prediction': 'patched'}}
+
+
+def test_replay_truncates_torn_tail(tmp_path):
+    path = str(tmp_path / 'tmp_foo.jsonl')
+    journal = ResultJournal(path, fsync=False)
+    journal.append({'0': _result(0), '1': _result(1)})
+    journal.close()
+    size = os.path.getsize(path)
+    with open(path, 'ab') as f:
+        # a crash in the middle of an append
+        f.write(b'{"id": "2", "result": {"predic')
+
+    journal = ResultJournal(path, fsync=False)
+    assert journal.replay() == {'0': _result(0), '1': _result(1)}
+    assert os.path.getsize(path) == size
+
+    # new records start on a clean line
+    journal.append({'2': _result(2)})
+    journal.close()
+    assert journal.replay() == {str(i): _result(i) for i in range(3)}
+
+
+def test_replay_missing_journal(tmp_path):
+    assert ResultJournal(str(tmp_path / 'missing.jsonl')).replay() == {}
+
+
+def test_remove(tmp_path):
+    journal = ResultJournal(str(tmp_path / 'tmp_foo.jsonl'), fsync=False)
+    journal.append({'0': _result(0)})
+    journal.remove()
+    assert not os.path.exists(journal.path)
+    journal.remove()
+
+
+def test_dump_results_dict_replaces_atomically(tmp_path):
+    path = tmp_path / 'foo.json'
+    path.write_text('stale')
+    dump_results_dict({'0': _result(0)}, str(path))
+    assert json.loads(path.read_text()) == {'0': _result(0)}
+    assert os.listdir(tmp_path) == ['foo.json']
+
+
+def test_handler_resume_and_checkpoint(tmp_path):
+    path = str(tmp_path / 'tmp_foo.jsonl')
+    handler = GenInferencerOutputHandler()
+    handler.resume(path)
+    handler.save_results('question 0', 'answer 0', 0)
+    handler.save_results('question 1', 'answer 1', 1)
+    handler.checkpoint([0, 1])
+    handler.journal.close()
+
+    resumed = GenInferencerOutputHandler()
+    resumed.resume(path)
+    assert resumed.results_dict == handler.results_dict
+
+    resumed.finalize_journal()
+    assert not os.path.exists(path)
+
+
+def test_handler_resume_carries_legacy_checkpoint(tmp_path):
+    legacy = tmp_path / 'tmp_foo.json'
+    legacy.write_text(json.dumps({'0': _result(0)}))
+    journal = ResultJournal(str(tmp_path / 'tmp_foo.jsonl'), fsync=False)
+    journal.append({'1': _result(1)})
+    journal.close()
+
+    handler = GenInferencerOutputHandler()
+    handler.resume(journal.path, legacy_path=str(legacy))
+    assert handler.results_dict == {'0': _result(0), '1': _result(1)}
+    assert not legacy.exists()
+    handler.journal.close()
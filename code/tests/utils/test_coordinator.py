@@ -0,0 +1,198 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from opencompass.models.base_api import SharedRateLimiter
+from opencompass.utils.coordinator import (CoordinatorClient,
+                                           CoordinatorServer,
+                                           CoordinatorUnavailable,
+                                           SharedSemaphore)
+
+
+@pytest.fixture
+def server():
+    server = CoordinatorServer().start()
+    yield server
+    server.stop()
+
+
+def _raw(server):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(5)
+    sock.connect(server.path)
+    return sock
+
+
+def _ask(sock, line):
+    sock.sendall(line.encode() + b'\n')
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return data.decode().strip()
+
+
+def test_rate_budget(server):
+    client = CoordinatorClient(server.path)
+    client.register('ep', qps=2, burst=2)
+    assert client.try_acquire('ep') == 0
+    assert client.try_acquire('ep') == 0
+    delay = client.try_acquire('ep')
+    assert 0 < delay <= 0.5
+    stats = client.server_stats()['ep']
+    assert stats['granted'] == 2 and stats['throttled'] == 1
+
+
+def test_strictest_limit_wins(server):
+    client = CoordinatorClient(server.path)
+    client.register('ep', concurrency=4)
+    client.register('ep', concurrency=1)
+    assert client.acquire_slot('ep', blocking=False)
+    assert not client.acquire_slot('ep', blocking=False)
+    client.release_slot('ep')
+    assert client.acquire_slot('ep', blocking=False)
+
+
+def test_parked_slot_granted_on_release(server):
+    client = CoordinatorClient(server.path)
+    client.register('ep', concurrency=1)
+    assert client.acquire_slot('ep')
+    granted = []
+
+    def waiter():
+        granted.append(client.acquire_slot('ep'))
+        client.release_slot('ep')
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    time.sleep(0.1)
+    assert not granted
+    client.release_slot('ep')
+    thread.join(5)
+    assert granted == [True]
+
+
+def test_parked_slot_survives_client_timeout(server):
+    # a parked request pings the server instead of giving up
+    client = CoordinatorClient(server.path, timeout=0.05)
+    client.register('ep', concurrency=1)
+    held = threading.Event()
+
+    def holder():
+        # slots are released on the connection holding them
+        client.acquire_slot('ep')
+        held.set()
+        time.sleep(0.3)
+        client.release_slot('ep')
+
+    thread = threading.Thread(target=holder)
+    thread.start()
+    held.wait(5)
+    other = CoordinatorClient(server.path, timeout=0.05)
+    assert other.acquire_slot('ep')
+    thread.join(5)
+    assert other.server_stats()['ep']['in_flight'] == 1
+
+
+def test_dropped_connection_releases_slots(server):
+    sock = _raw(server)
+    sock.sendall(b'L ep - - - 1\n')
+    assert _ask(sock, 'N ep') == '1'
+    client = CoordinatorClient(server.path)
+    assert not client.acquire_slot('ep', blocking=False)
+    sock.close()
+    time.sleep(0.1)
+    assert client.acquire_slot('ep', blocking=False)
+
+
+def test_bad_command_drops_only_its_connection(server):
+    good = _raw(server)
+    good.sendall(b'L ep - - - 2\n')
+    assert _ask(good, 'N ep') == '1'
+    bad = _raw(server)
+    assert _ask(bad, 'N ep') == '1'
+    assert _ask(bad, 'T ep not-a-number').startswith('E ')
+    assert bad.recv(10) == b''
+    # the server is still serving, the slot of the bad client is back
+    assert _ask(good, 'N ep') == '1'
+    assert _ask(good, 'P') == 'pong'
+    assert _ask(_raw(server), 'X').startswith('E ')
+
+
+def test_keys_with_whitespace(server):
+    client = CoordinatorClient(server.path)
+    client.register('my endpoint', concurrency=1)
+    assert client.acquire_slot('my endpoint', blocking=False)
+    assert not client.acquire_slot('my endpoint', blocking=False)
+
+
+def test_unavailable_coordinator_falls_back(tmp_path):
+    client = CoordinatorClient(str(tmp_path / 'missing.sock'),
+                               timeout=0.1,
+                               retry_interval=60)
+    # registration is kept for the next connection
+    client.register('ep', concurrency=1)
+    with pytest.raises(CoordinatorUnavailable):
+        client.try_acquire('ep')
+    # failing fast until the retry interval has passed
+    start = time.monotonic()
+    with pytest.raises(CoordinatorUnavailable):
+        client.acquire_slot('ep')
+    assert time.monotonic() - start < 0.05
+    with client.slot('ep'):
+        pass
+    assert client.stats()['failures'] == 1
+
+
+def test_shared_limiter_falls_back_to_local_buckets(tmp_path):
+    client = CoordinatorClient(str(tmp_path / 'missing.sock'), timeout=0.1)
+    limiter = SharedRateLimiter(client, 'ep', 10, burst=1)
+    assert limiter.try_acquire() == 0
+    assert limiter.try_acquire() > 0
+
+
+def test_hung_coordinator_times_out(tmp_path):
+    path = str(tmp_path / 'hung.sock')
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+    client = CoordinatorClient(path, timeout=0.1)
+    with pytest.raises(CoordinatorUnavailable):
+        client.try_acquire('ep')
+    with pytest.raises(CoordinatorUnavailable):
+        CoordinatorClient(path, timeout=0.1).acquire_slot('ep')
+    listener.close()
+
+
+def test_reconnect_registers_pending_limits(tmp_path):
+    path = str(tmp_path / 'coordinator.sock')
+    client = CoordinatorClient(path, retry_interval=0)
+    client.register('ep', concurrency=1)
+    server = CoordinatorServer(path).start()
+    try:
+        assert client.acquire_slot('ep', blocking=False)
+        assert not client.acquire_slot('ep', blocking=False)
+    finally:
+        server.stop()
+
+
+def test_shared_semaphore(server):
+    semaphore = SharedSemaphore(server.path, 'users', 1)
+    assert semaphore.acquire()
+    assert not semaphore.acquire(blocking=False)
+    semaphore.release()
+    with semaphore:
+        assert not semaphore.acquire(blocking=False)
+
+
+def test_shared_semaphore_falls_back_to_local_slots(tmp_path):
+    semaphore = SharedSemaphore(str(tmp_path / 'missing.sock'), 'users', 1)
+    assert semaphore.acquire()
+    assert not semaphore.acquire(blocking=False)
+    semaphore.release()
+    assert semaphore.acquire(blocking=False)
+    semaphore.release()
@@ -0,0 +1,82 @@
+import json
+import os
+
+from opencompass.openicl.icl_inferencer.icl_base_inferencer import (
+    ResultJournal, result_journal_path)
+from opencompass.utils.repair import (find_failed_predictions,
+                                      is_failed_prediction,
+                                      repair_predictions)
+from opencompass.utils.retry import RETRY_EXHAUSTED_PREFIX
+
+FAILED = f'{RETRY_EXHAUSTED_PREFIX}, err_reason:timeout'
+
+
+def _dump(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def _predictions(*predictions):
+    return {
+        str(i): {
+            'origin_prompt': f'question {i}',
+            'prediction': prediction
+        }
+        for i, prediction in enumerate(predictions)
+    }
+
+
+def test_journal_path():
+    assert result_journal_path('out', 'foo.json') == os.path.join(
+        'out', 'tmp_foo.jsonl')
+
+
+def test_is_failed_prediction():
+    assert is_failed_prediction(FAILED)
+    assert is_failed_prediction('')
+    assert is_failed_prediction('  \n')
+    assert is_failed_prediction(None)
+    assert is_failed_prediction(['fine', FAILED])
+    assert not is_failed_prediction('fine')
+    assert not is_failed_prediction(['fine', 'also fine'])
+    # e.g. the label of PPL inference
+    assert not is_failed_prediction(2)
+
+
+def test_find_failed_predictions_skips_journals_and_metrics(tmp_path):
+    pred_dir = tmp_path / 'predictions'
+    _dump(str(pred_dir / 'm' / 'foo.json'), _predictions('a', FAILED, ''))
+    _dump(str(pred_dir / 'm' / 'bar.json'), _predictions('a', 'b'))
+    _dump(str(pred_dir / 'm' / 'foo_metrics.json'), {'prediction': ''})
+    (pred_dir / 'm' / 'tmp_baz.jsonl').write_text('')
+
+    failed = find_failed_predictions(str(pred_dir))
+    assert failed == {str(pred_dir / 'm' / 'foo.json'): ['1', '2']}
+
+
+def test_repair_predictions(tmp_path):
+    pred_path = str(tmp_path / 'predictions' / 'm' / 'foo_1.json')
+    _dump(pred_path, _predictions('a', FAILED, 'c', ''))
+    _dump(str(tmp_path / 'predictions' / 'm' / 'bar.json'),
+          _predictions('a'))
+    # the splits of a dataset are scored together
+    _dump(str(tmp_path / 'results' / 'm' / 'foo.json'), {'accuracy': 50})
+    _dump(str(tmp_path / 'results' / 'm' / 'bar.json'), {'accuracy': 100})
+
+    failed = repair_predictions(str(tmp_path))
+    assert failed == {pred_path: ['1', '3']}
+    assert not os.path.exists(pred_path)
+    assert sorted(os.listdir(tmp_path / 'results' / 'm')) == ['bar.json']
+
+    # the next inference run resumes from the good samples
+    journal = ResultJournal(
+        result_journal_path(os.path.dirname(pred_path), 'foo_1.json'))
+    assert sorted(journal.replay()) == ['0', '2']
+
+
+def test_repair_without_failures(tmp_path):
+    pred_path = str(tmp_path / 'predictions' / 'm' / 'foo.json')
+    _dump(pred_path, _predictions('a'))
+    assert repair_predictions(str(tmp_path)) == {}
+    assert os.path.exists(pred_path)
@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+
+from opencompass.utils.retry import (CircuitBreaker, FatalAPIError,
+                                     RetryError, RetryPolicy,
+                                     get_retry_after, get_status_code)
+
+
+class StatusError(Exception):
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f'HTTP {status_code}')
+        self.status_code = status_code
+        self.response = type('Response', (), {'headers': headers or {}})()
+
+
+class Flaky:
+    """Raises the given errors one after another, then returns 'ok'."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+def _policy(**kwargs):
+    return RetryPolicy(**{'base_delay': 0., 'max_delay': 0., **kwargs})
+
+
+def test_status_and_retry_after():
+    assert get_status_code(StatusError(429)) == 429
+    assert get_status_code(ValueError()) is None
+    assert get_retry_after(StatusError(429, {'retry-after': '3'})) == 3.
+    assert get_retry_after(StatusError(429)) is None
+
+
+def test_retries_until_success():
+    func = Flaky(StatusError(503), TimeoutError())
+    assert _policy(max_attempts=3).run(func) == 'ok'
+    assert func.calls == 3
+
+
+def test_gives_up_after_max_attempts():
+    func = Flaky(*[StatusError(500)] * 3)
+    with pytest.raises(RetryError) as info:
+        _policy(max_attempts=2).run(func)
+    assert info.value.attempts == 2
+    assert info.value.reason == 'Max retries'
+
+
+@pytest.mark.parametrize('error', [StatusError(400), FatalAPIError('quota')])
+def test_not_retryable(error):
+    func = Flaky(error)
+    with pytest.raises(RetryError) as info:
+        _policy(max_attempts=5).run(func)
+    assert func.calls == 1
+    assert info.value.reason == 'Not retryable'
+
+
+def test_retryable_client_errors():
+    func = Flaky(StatusError(429), StatusError(408))
+    assert _policy(max_attempts=3).run(func) == 'ok'
+
+
+def test_retry_budget():
+    policy = _policy(max_attempts=5, retry_budget=0., min_retries=1)
+    assert policy.run(Flaky(StatusError(500))) == 'ok'
+    with pytest.raises(RetryError) as info:
+        policy.run(Flaky(StatusError(500)))
+    assert info.value.reason == 'Retry budget exhausted'
+
+
+def test_breaker_opens_and_probes():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.)
+    assert not breaker.record(False)
+    assert breaker.record(False)
+    # half-open: a single probe goes through
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == 'closed'
+
+
+def test_policy_breaker_fails_fast():
+    policy = _policy(max_attempts=1,
+                     circuit_breaker=dict(failure_threshold=2,
+                                          reset_timeout=60))
+    for _ in range(2):
+        with pytest.raises(RetryError):
+            policy.run(Flaky(StatusError(500)), key='a')
+    func = Flaky()
+    with pytest.raises(RetryError) as info:
+        policy.run(func, key='a')
+    assert info.value.reason == 'Circuit open'
+    assert func.calls == 0
+    # other endpoints have their own breaker
+    assert policy.run(Flaky(), key='b') == 'ok'
+    assert policy.stats()['open_circuits'] == ['a']
+
+
+def test_rejected_request_is_neutral_for_the_breaker():
+    policy = _policy(max_attempts=1,
+                     circuit_breaker=dict(failure_threshold=2,
+                                          reset_timeout=60))
+    # a 4xx in between neither counts as a failure nor resets the streak
+    for error in (StatusError(500), StatusError(400), StatusError(500)):
+        with pytest.raises(RetryError):
+            policy.run(Flaky(error), key='a')
+    assert policy.breakers['a'].state == 'open'
+
+    for _ in range(3):
+        with pytest.raises(RetryError):
+            policy.run(Flaky(StatusError(400)), key='b')
+    assert policy.breakers['b'].state == 'closed'
+
+
+def test_call_without_breaker():
+    policy = _policy(max_attempts=1,
+                     circuit_breaker=dict(failure_threshold=1))
+    for _ in range(3):
+        with pytest.raises(RetryError):
+            policy.run(Flaky(StatusError(500)), circuit=False)
+    assert policy.breakers == {}
+    assert policy.run(Flaky(), circuit=False) == 'ok'
+
+
+def test_async_run():
+
+    async def call(func):
+        return func()
+
+    func = Flaky(StatusError(502))
+    assert asyncio.run(_policy().arun(call, func)) == 'ok'
+    assert func.calls == 2
@@ -0,0 +1,73 @@
+"""Throughput benchmark of ``BaseGeneralApi`` against a local stub server.
+
+Each request takes a fixed ``--latency`` on the server side, so the ideal
+throughput of a model with ``max_concurrency=C`` is ``C / latency`` samples
+per second. The table printed at the end shows how close the request engine
+gets to that bound.
+
+Example:
+    python tools/bench_api_concurrency.py --num-samples 256 \
+        --concurrency 1 4 16 64
+"""
+import argparse
+import os.path as osp
+import sys
+import time
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+
+from mock_llm_server import MockLLMServer  # noqa: E402
+
+from opencompass.models import NonReasoningAPI  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='API concurrency benchmark')
+    parser.add_argument('--num-samples', type=int, default=256)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--concurrency',
+                        type=int,
+                        nargs='+',
+                        default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--async-mode',
+                        action='store_true',
+                        help='Use the asyncio request engine.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = MockLLMServer(latency=args.latency).start()
+    inputs = [f'question {i}' for i in range(args.num_samples)]
+    rows = []
+    try:
+        for concurrency in args.concurrency:
+            model = NonReasoningAPI(
+                path='mock',
+                api_url=server.base_url + '/chat/completions',
+                api_headers={'Authorization': 'Bearer mock'},
+                api_data={'model': 'mock'},
+                stream=args.stream,
+                max_concurrency=concurrency,
+                async_mode=args.async_mode)
+            server.reset_stats()
+            start = time.perf_counter()
+            model.generate(inputs)
+            elapsed = time.perf_counter() - start
+            throughput = args.num_samples / elapsed
+            ideal = concurrency / args.latency
+            rows.append((concurrency, elapsed, throughput,
+                         throughput / ideal, server.max_in_flight))
+    finally:
+        server.stop()
+
+    print(f'{"concurrency":>12} {"wall(s)":>9} {"samples/s":>10} '
+          f'{"efficiency":>11} {"peak in-flight":>15}')
+    for concurrency, elapsed, throughput, efficiency, peak in rows:
+        print(f'{concurrency:>12} {elapsed:>9.2f} {throughput:>10.1f} '
+              f'{efficiency:>10.0%} {peak:>15}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Overhead and enforcement benchmark of the cross-process coordinator.
+
+Several processes with several threads each hammer one endpoint key:
+
+- slots: acquire/release cycles of a ``multiprocessing.Manager().Semaphore``,
+  as :obj:`LocalAPIRunner` used to share, against a :obj:`SharedSemaphore`
+  of the coordinator. The table shows the time per cycle.
+- rate: every thread sends as fast as a ``--qps`` limit allows, with one
+  bucket per process, as separate task processes used to have, against one
+  bucket shared through the coordinator. The table shows the aggregate rate
+  the endpoint would see.
+
+Example:
+    python tools/bench_coordinator.py --processes 8 --threads 8 --qps 50
+"""
+import argparse
+import multiprocessing as mp
+import os
+import os.path as osp
+import sys
+import threading
+import time
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+
+from opencompass.utils.coordinator import (CoordinatorServer,  # noqa: E402
+                                           SharedSemaphore, get_coordinator)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Coordinator benchmark')
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--cycles',
+                        type=int,
+                        default=2000,
+                        help='Acquire/release cycles per thread')
+    parser.add_argument('--slots', type=int, default=16)
+    parser.add_argument('--qps', type=float, default=50.)
+    parser.add_argument('--duration', type=float, default=3.)
+    return parser.parse_args()
+
+
+def run_threads(num_threads, func, *args):
+    threads = [
+        threading.Thread(target=func, args=args) for _ in range(num_threads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def cycle_slots(semaphore, cycles):
+    for _ in range(cycles):
+        semaphore.acquire()
+        semaphore.release()
+
+
+def slot_worker(semaphore, num_threads, cycles):
+    run_threads(num_threads, cycle_slots, semaphore, cycles)
+
+
+def send_at_rate(path, key, deadline, counter, lock):
+    client = get_coordinator(path)
+    while True:
+        delay = client.try_acquire(key)
+        if time.monotonic() >= deadline:
+            return
+        if delay > 0:
+            time.sleep(delay)
+            continue
+        with lock:
+            counter[0] += 1
+
+
+def rate_worker(path, shared, qps, num_threads, duration, queue):
+    key = 'endpoint' if shared else f'endpoint-{os.getpid()}'
+    get_coordinator(path).register(key, qps=qps, burst=1)
+    counter, lock = [0], threading.Lock()
+    run_threads(num_threads, send_at_rate, path, key,
+                time.monotonic() + duration, counter, lock)
+    queue.put(counter[0])
+
+
+def run_processes(target, args_list):
+    processes = [mp.Process(target=target, args=args) for args in args_list]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return time.perf_counter() - start
+
+
+def main():
+    args = parse_args()
+    server = CoordinatorServer().start()
+    rows = []
+    try:
+        num_cycles = args.processes * args.threads * args.cycles
+        with mp.Manager() as manager:
+            semaphore = manager.Semaphore(args.slots)
+            elapsed = run_processes(
+                slot_worker,
+                [(semaphore, args.threads, args.cycles)] * args.processes)
+        rows.append(('slots', 'Manager().Semaphore',
+                     f'{elapsed / num_cycles * 1e6:.1f} us/cycle'))
+        semaphore = SharedSemaphore(server.path, 'slots', args.slots)
+        elapsed = run_processes(
+            slot_worker,
+            [(semaphore, args.threads, args.cycles)] * args.processes)
+        rows.append(('slots', 'SharedSemaphore',
+                     f'{elapsed / num_cycles * 1e6:.1f} us/cycle'))
+
+        for name, shared in (('per-process buckets', False),
+                             ('coordinator', True)):
+            queue = mp.Queue()
+            run_processes(rate_worker,
+                          [(server.path, shared, args.qps, args.threads,
+                            args.duration, queue)] * args.processes)
+            sent = sum(queue.get() for _ in range(args.processes))
+            rows.append(('rate', name, f'{sent / args.duration:.1f} req/s '
+                         f'(limit {args.qps:g})'))
+    finally:
+        server.stop()
+
+    print(f'{"test":>6} {"mechanism":>22}  result')
+    for test, name, result in rows:
+        print(f'{test:>6} {name:>22}  {result}')
+
+
+if __name__ == '__main__':
+    main()
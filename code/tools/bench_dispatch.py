@@ -0,0 +1,128 @@
+"""Batch barrier vs sliding window dispatch of :obj:`GenInferencer`.
+
+A mock API model answers every prompt after a latency drawn from a
+heavy-tailed distribution (log-normal by default, see
+:obj:`mock_llm_server.Distribution`). The same samples are generated batch
+by batch, each batch waiting for its slowest sample, and through the
+sliding window of ``--window`` samples in flight. The table shows the wall
+time, the throughput and how busy the slots were; the predictions of both
+runs are dumped and checked to be byte-identical.
+
+Example:
+    python tools/bench_dispatch.py --num-samples 400 --batch-size 16 \
+        --latency lognormal:-1,1
+"""
+import argparse
+import os.path as osp
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = osp.dirname(osp.dirname(osp.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, osp.join(ROOT, 'tools'))
+
+from mock_llm_server import Distribution  # noqa: E402
+
+from opencompass.openicl.icl_inferencer import GenInferencer  # noqa: E402
+from opencompass.openicl.icl_inferencer.icl_base_inferencer import \
+    GenInferencerOutputHandler  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Dispatch benchmark')
+    parser.add_argument('--num-samples', type=int, default=400)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--window',
+                        type=int,
+                        default=None,
+                        help='Samples in flight, the batch size by default')
+    parser.add_argument('--latency', default='lognormal:-1,1')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+class MockModel:
+    """Stands in for an API model, with a fixed latency per prompt so that
+    both dispatchers see the same workload."""
+
+    is_api = True
+
+    def __init__(self, latencies):
+        self.latencies = latencies
+        self.busy = 0.
+        self._lock = threading.Lock()
+
+    def parse_template(self, prompt_template, mode):
+        return list(prompt_template)
+
+    def generate(self, inputs, max_out_len):
+        return self.generate_from_template(inputs, max_out_len)
+
+    def generate_from_template(self, templates, max_out_len):
+        latency = sum(self.latencies[prompt] for prompt in templates)
+        time.sleep(max(self.latencies[prompt] for prompt in templates))
+        with self._lock:
+            self.busy += latency
+        return [f'answer to {prompt}' for prompt in templates]
+
+
+def run(args, latencies, window, work_dir):
+    model = MockModel(latencies)
+    inferencer = GenInferencer(model,
+                               max_out_len=16,
+                               batch_size=args.batch_size,
+                               output_json_filepath=work_dir,
+                               dispatch_window=window)
+    prompts = list(enumerate(latencies))
+    handler = GenInferencerOutputHandler()
+    start = time.perf_counter()
+    if window:
+        samples = inferencer._dispatch(prompts, len(prompts), window, False)
+    else:
+        samples = inferencer._generate_batches(prompts, len(prompts),
+                                               args.batch_size, False)
+    for indices, results in samples:
+        for index, (prompt, prediction, gold) in zip(indices, results):
+            handler.save_results(prompt, prediction, index, gold=gold)
+    elapsed = time.perf_counter() - start
+    handler.results_dict = dict(
+        sorted(handler.results_dict.items(), key=lambda item: int(item[0])))
+    filename = f'window_{window}.json'
+    handler.write_to_json(work_dir, filename)
+    with open(osp.join(work_dir, filename), 'rb') as f:
+        dump = f.read()
+    slots = window or args.batch_size
+    return elapsed, model.busy / (elapsed * slots), dump
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    distribution = Distribution(args.latency)
+    latencies = {
+        f'prompt {i}': distribution.sample()
+        for i in range(args.num_samples)
+    }
+    window = args.window or args.batch_size
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, size in (('batches', 0), ('window', window)):
+            rows.append((name, size) + run(args, latencies, size, work_dir))
+    assert rows[0][-1] == rows[1][-1], 'the predictions differ'
+
+    mean = sum(latencies.values()) / len(latencies)
+    print(f'latency {args.latency}: mean {mean:.3f}s, '
+          f'max {max(latencies.values()):.3f}s')
+    print(f'{"dispatch":>10} {"slots":>6} {"wall(s)":>8} {"samples/s":>10} '
+          f'{"busy":>6}')
+    for name, size, elapsed, busy, _ in rows:
+        print(f'{name:>10} {size or args.batch_size:>6} {elapsed:>8.2f} '
+              f'{args.num_samples / elapsed:>10.2f} {busy:>6.1%}')
+    print('predictions are byte-identical')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""End-to-end throughput benchmark of ``run.py`` against the mock server.
+
+The shipped example configs (``examples/CoreNetwork.py`` and
+``examples/BasicKnowledge.py`` by default) are pointed at a local
+:obj:`MockLLMServer` and run through ``run.py``. For every config the table
+shows the end-to-end wall time, samples per second and the CPU time spent by
+this process and by the task processes it launched.
+
+With ``--profile`` the tasks run in-process (``run.py --debug``) under
+cProfile, every thread included, and the CPU time is broken down by
+component (request engine, inferencer, HTTP/SDK stack, ...). Note that
+``--debug`` also turns on DEBUG logging.
+
+Example:
+    python tools/bench_e2e.py --num-samples 200 --latency lognormal:-1,0.5 \
+        --tokens-per-s 80 --model-cfg max_concurrency=64 stream=False
+"""
+import argparse
+import cProfile
+import glob
+import json
+import os
+import os.path as osp
+import pstats
+import resource
+import runpy
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = osp.dirname(osp.dirname(osp.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, osp.join(ROOT, 'tools'))
+
+from mmengine.config import Config, DictAction  # noqa: E402
+from mock_llm_server import MockLLMServer, fit_text  # noqa: E402
+
+DEFAULT_CONFIGS = ['examples/CoreNetwork.py', 'examples/BasicKnowledge.py']
+
+# (component, path fragments), first match wins
+COMPONENTS = [
+    ('request engine', ['opencompass/models/']),
+    ('inferencer', ['opencompass/openicl/']),
+    ('tasks & runners', [
+        'opencompass/tasks/', 'opencompass/runners/',
+        'opencompass/partitioners/'
+    ]),
+    ('datasets & eval',
+     ['opencompass/datasets/', 'opencompass/judge_models/']),
+    ('opencompass other', ['opencompass/']),
+    ('http & sdk', [
+        '/openai/', '/httpx/', '/httpcore/', '/h2/', '/hpack/', '/h11/',
+        '/anyio/', '/requests/', '/urllib3/', '/pydantic', '/ssl.py',
+        '/socket.py', '/selectors.py'
+    ]),
+    ('json', ['/json/', 'orjson']),
+    ('logging', ['/logging/']),
+    ('config & registry', ['/mmengine/']),
+    ('threading & queues', [
+        '/threading.py', '/queue.py', '/concurrent/', '/asyncio/'
+    ]),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark')
+    parser.add_argument('configs', nargs='*', default=DEFAULT_CONFIGS)
+    parser.add_argument('--num-samples',
+                        type=int,
+                        default=None,
+                        help='Samples per dataset, all by default')
+    parser.add_argument('--latency', default='0.5')
+    parser.add_argument('--tokens-per-s', type=float, default=None)
+    parser.add_argument('--reply-chars', type=int, default=400)
+    parser.add_argument('--reasoning-chars', type=int, default=0)
+    parser.add_argument('--replay', help='Trace file to replay timings from')
+    parser.add_argument('--model-cfg',
+                        nargs='+',
+                        action=DictAction,
+                        default={},
+                        help='Extra model arguments, e.g. max_concurrency=64')
+    parser.add_argument('--mode', choices=['infer', 'all'], default='infer')
+    parser.add_argument('--profile',
+                        action='store_true',
+                        help='Run the tasks in-process and break the CPU '
+                        'time down by component')
+    parser.add_argument('--top', type=int, default=0,
+                        help='Also print the N most expensive functions')
+    return parser.parse_args()
+
+
+def prepare_config(path: str, server: MockLLMServer, args,
+                   work_dir: str) -> str:
+    """Point the models (and judges) of a config at the mock server and
+    dump it next to the outputs."""
+    cfg = Config.fromfile(path)
+    for model in cfg.models:
+        model['api_url'] = server.base_url + '/chat/completions'
+        model['api_headers'] = {
+            **model.get('api_headers', {}), 'Authorization': 'Bearer mock'
+        }
+        model.update(args.model_cfg)
+    datasets = []
+    for item in cfg.datasets:
+        # some examples nest the dataset lists
+        datasets.extend(item if isinstance(item, list) else [item])
+    for dataset in datasets:
+        if args.num_samples is not None:
+            dataset['reader_cfg']['test_range'] = f'[0:{args.num_samples}]'
+        evaluator = dataset.get('eval_cfg', {}).get('evaluator', {})
+        if 'judge_model' in evaluator:
+            evaluator['judge_model'] = dict(base_url=server.base_url,
+                                            model='mock',
+                                            api_key='mock')
+    cfg.work_dir = work_dir
+    config_path = osp.join(work_dir, osp.basename(path))
+    os.makedirs(work_dir, exist_ok=True)
+    cfg.dump(config_path)
+    return config_path
+
+
+def count_samples(work_dir: str) -> int:
+    num_samples = 0
+    pattern = osp.join(work_dir, '*', 'predictions', '**', '*.json')
+    for path in glob.glob(pattern, recursive=True):
+        name = osp.basename(path)
+        if name.startswith('tmp_') or name.endswith('_metrics.json'):
+            continue
+        with open(path, encoding='utf-8') as f:
+            num_samples += len(json.load(f))
+    return num_samples
+
+
+class ThreadProfiler:
+    """cProfile of the calling thread and of every thread started while it
+    is active, measuring per-thread CPU time."""
+
+    def __init__(self):
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def _new_profile(self) -> cProfile.Profile:
+        profile = cProfile.Profile(time.thread_time)
+        with self._lock:
+            self.profiles.append(profile)
+        return profile
+
+    def _bootstrap(self, frame, event, arg):
+        sys.setprofile(None)
+        self._new_profile().enable()
+
+    def __enter__(self):
+        if sys.version_info < (3, 12):
+            # before 3.12 a profiler only sees the thread enabling it
+            threading.setprofile(self._bootstrap)
+        self._main = self._new_profile()
+        self._main.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self._main.disable()
+        threading.setprofile(None)
+
+    def stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self._main)
+        for profile in self.profiles:
+            if profile is not self._main:
+                stats.add(profile)
+        return stats
+
+
+def component_of(filename: str) -> str:
+    filename = filename.replace('\\', '/')
+    for name, fragments in COMPONENTS:
+        if any(fragment in filename for fragment in fragments):
+            return name
+    return 'other'
+
+
+def cpu_by_component(stats: pstats.Stats):
+    """Self CPU time per component. Built-in functions have no file, their
+    time is charged to the component of their callers."""
+    totals = {}
+    for (filename, _, _), (_, _, tottime, _, callers) in stats.stats.items():
+        if filename != '~':
+            name = component_of(filename)
+            totals[name] = totals.get(name, 0.) + tottime
+            continue
+        charged = 0.
+        for (caller_file, _, _), caller_stat in callers.items():
+            name = component_of(caller_file)
+            totals[name] = totals.get(name, 0.) + caller_stat[2]
+            charged += caller_stat[2]
+        if tottime > charged:
+            totals['other'] = totals.get('other', 0.) + tottime - charged
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+
+def run(config_path: str, work_dir: str, args):
+    argv = ['run.py', config_path, '-w', work_dir, '-m', args.mode]
+    if args.profile:
+        argv.append('--debug')
+    sys.argv = argv
+    runpy.run_path(osp.join(ROOT, 'run.py'), run_name='__main__')
+
+
+def cpu_times():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (own.ru_utime + own.ru_stime,
+            children.ru_utime + children.ru_stime)
+
+
+def main():
+    args = parse_args()
+    server = MockLLMServer(latency=args.latency,
+                           reply=fit_text('This is a mock answer. ',
+                                          args.reply_chars),
+                           tokens_per_s=args.tokens_per_s,
+                           reasoning=fit_text('Let me think. ',
+                                              args.reasoning_chars),
+                           replay=args.replay).start()
+    os.chdir(ROOT)
+    rows = []
+    try:
+        for path in args.configs:
+            work_dir = tempfile.mkdtemp(prefix='bench_e2e_')
+            config_path = prepare_config(path, server, args, work_dir)
+            server.reset_stats()
+            own_start, children_start = cpu_times()
+            start = time.perf_counter()
+            if args.profile:
+                with ThreadProfiler() as profiler:
+                    run(config_path, work_dir, args)
+            else:
+                run(config_path, work_dir, args)
+            elapsed = time.perf_counter() - start
+            own_end, children_end = cpu_times()
+            num_samples = count_samples(work_dir)
+            rows.append((osp.basename(path), num_samples, elapsed,
+                         num_samples / elapsed, own_end - own_start,
+                         children_end - children_start,
+                         server.max_in_flight))
+            if args.profile:
+                stats = profiler.stats()
+                breakdown = cpu_by_component(stats)
+                total = sum(cpu for _, cpu in breakdown) or 1.
+                print(f'\nCPU by component, {osp.basename(path)}:')
+                for name, cpu in breakdown:
+                    print(f'{name:>20} {cpu:>8.2f}s {cpu / total:>7.1%}')
+                if args.top:
+                    stats.sort_stats('tottime').print_stats(args.top)
+            print(f'outputs of {path}: {work_dir}')
+    finally:
+        server.stop()
+
+    print(f'\n{"config":>20} {"samples":>8} {"wall(s)":>8} '
+          f'{"samples/s":>10} {"cpu(s)":>8} {"task cpu(s)":>12} '
+          f'{"max inflight":>13}')
+    for name, num_samples, elapsed, throughput, own, children, peak in rows:
+        print(f'{name:>20} {num_samples:>8} {elapsed:>8.1f} '
+              f'{throughput:>10.2f} {own:>8.1f} {children:>12.1f} '
+              f'{peak:>13}')
+
+
+if __name__ == '__main__':
+    main()
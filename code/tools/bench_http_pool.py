@@ -0,0 +1,103 @@
+"""Connection reuse benchmark of :obj:`HTTPPool` against a local stub server.
+
+The same ``/generate`` requests are sent twice: once with a module-level
+``requests.post`` per request and a fresh thread pool per batch, as the
+legacy wrappers used to do, and once through a shared :obj:`HTTPPool`. The
+table shows the wall time and the number of TCP connections the server
+accepted.
+
+Example:
+    python tools/bench_http_pool.py --num-samples 2000 --batch-size 64
+"""
+import argparse
+import json
+import os.path as osp
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+
+from mock_llm_server import MockLLMServer  # noqa: E402
+
+from opencompass.utils.http_pool import HTTPPool  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='HTTP pool benchmark')
+    parser.add_argument('--num-samples', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.)
+    parser.add_argument('--http2', action='store_true')
+    return parser.parse_args()
+
+
+def run_legacy(url, batches, workers):
+    def request(data):
+        response = requests.post(url,
+                                 headers={'content-type': 'application/json'},
+                                 data=data)
+        response.raise_for_status()
+        return response.json()
+
+    for batch in batches:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(request, batch))
+
+
+def run_pooled(url, batches, pool):
+    def request(data):
+        response = pool.post(url,
+                             headers={'content-type': 'application/json'},
+                             data=data)
+        response.raise_for_status()
+        return response.json()
+
+    for batch in batches:
+        list(pool.executor.map(request, batch))
+
+
+def main():
+    args = parse_args()
+    server = MockLLMServer(latency=args.latency).start()
+    url = server.base_url.rsplit('/v1', 1)[0] + '/generate'
+    payloads = [
+        json.dumps({
+            'inputs': f'question {i}',
+            'parameters': {
+                'max_new_tokens': 16
+            }
+        }) for i in range(args.num_samples)
+    ]
+    batches = [
+        payloads[i:i + args.batch_size]
+        for i in range(0, len(payloads), args.batch_size)
+    ]
+    pool = HTTPPool(maxsize=args.workers, http2=args.http2)
+    rows = []
+    try:
+        for name, func, target in (('requests.post', run_legacy,
+                                    args.workers), ('HTTPPool', run_pooled,
+                                                    pool)):
+            server.reset_stats()
+            start = time.perf_counter()
+            func(url, batches, target)
+            elapsed = time.perf_counter() - start
+            rows.append((name, elapsed, args.num_samples / elapsed,
+                         server.num_connections))
+    finally:
+        pool.close()
+        server.stop()
+
+    print(f'{"transport":>14} {"time(s)":>9} {"req/s":>9} '
+          f'{"connections":>12}')
+    for name, elapsed, throughput, connections in rows:
+        print(f'{name:>14} {elapsed:>9.2f} {throughput:>9.1f} '
+              f'{connections:>12}')
+
+
+if __name__ == '__main__':
+    main()
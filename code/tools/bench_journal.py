@@ -0,0 +1,98 @@
+"""Checkpoint cost of :obj:`GenInferencer`, whole-dict rewrite vs journal.
+
+A run of ``--num-samples`` samples in batches of ``--batch-size`` is
+replayed with synthetic predictions. After every batch the intermediate
+results are saved either the old way, dumping the whole results dict to
+``tmp_*.json``, or by appending the batch to a :obj:`ResultJournal`. The
+table shows the mean cost of a checkpoint at the start, the middle and the
+end of the run, and the total time spent checkpointing.
+
+Example:
+    python tools/bench_journal.py --num-samples 20000 --batch-size 8
+"""
+import argparse
+import os.path as osp
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+
+from opencompass.openicl.icl_inferencer.icl_base_inferencer import (  # noqa
+    ResultJournal, dump_results_dict)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Checkpoint benchmark')
+    parser.add_argument('--num-samples', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--prediction-chars', type=int, default=800)
+    parser.add_argument('--no-fsync',
+                        action='store_true',
+                        help='Do not fsync the journal appends')
+    return parser.parse_args()
+
+
+def make_result(idx, args):
+    return {
+        'origin_prompt': f'Question {idx}: ' + 'x' * 200,
+        'prediction': 'y' * args.prediction_chars,
+        'gold': 'A',
+    }
+
+
+def run(args, save):
+    """Time ``save(results_dict, indices)`` after every batch."""
+    results_dict, costs = {}, []
+    for start in range(0, args.num_samples, args.batch_size):
+        indices = range(start, min(start + args.batch_size, args.num_samples))
+        for idx in indices:
+            results_dict[str(idx)] = make_result(idx, args)
+        tic = time.perf_counter()
+        save(results_dict, indices)
+        costs.append(time.perf_counter() - tic)
+    return costs
+
+
+def summarize(costs):
+    tenth = max(1, len(costs) // 10)
+    middle = len(costs) // 2
+    stages = (costs[:tenth], costs[middle - tenth // 2:middle + tenth // 2 +
+                                     1], costs[-tenth:])
+    return [sum(stage) / len(stage) * 1e3 for stage in stages] + [sum(costs)]
+
+
+def main():
+    args = parse_args()
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = osp.join(work_dir, 'tmp_bench.json')
+        rows.append(('whole dict',
+                     summarize(
+                         run(args, lambda results, _: dump_results_dict(
+                             results, path)))))
+
+        journal = ResultJournal(osp.join(work_dir, 'tmp_bench.jsonl'),
+                                fsync=not args.no_fsync)
+        rows.append(('journal',
+                     summarize(
+                         run(args, lambda results, indices: journal.append(
+                             {str(idx): results[str(idx)]
+                              for idx in indices})))))
+        tic = time.perf_counter()
+        replayed = journal.replay()
+        replay_cost = time.perf_counter() - tic
+        journal.remove()
+        assert len(replayed) == args.num_samples
+
+    print(f'{"mechanism":>12} {"start(ms)":>10} {"middle(ms)":>11} '
+          f'{"end(ms)":>9} {"total(s)":>9}')
+    for name, (start, middle, end, total) in rows:
+        print(f'{name:>12} {start:>10.3f} {middle:>11.3f} {end:>9.3f} '
+              f'{total:>9.2f}')
+    print(f'journal replay of {args.num_samples} samples: '
+          f'{replay_cost * 1e3:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Upfront vs lazy prompt construction of :obj:`GenInferencer`.
+
+A mock retriever renders long prompts (a tool list or system prompt of
+``--prefix-chars`` plus a question, costing ``--render-ms`` of CPU each)
+and a mock API model answers after ``--latency`` seconds. The whole
+``GenInferencer.inference`` runs once with every prompt rendered before the
+first request and once rendering them on a background thread just ahead of
+dispatch, both in dataset order as lazy prompts rule out prefix ordering.
+The table shows the time to the first request, the wall time and the peak
+traced memory; the predictions of both runs are checked to be
+byte-identical.
+
+Example:
+    python tools/bench_prompts.py --num-samples 2000 --prefix-chars 20000
+"""
+import argparse
+import os.path as osp
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+
+from opencompass.openicl.icl_inferencer import GenInferencer  # noqa: E402
+from opencompass.utils.prompt import PromptList  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Prompt pipeline benchmark')
+    parser.add_argument('--num-samples', type=int, default=2000)
+    parser.add_argument('--prefix-chars', type=int, default=20000)
+    parser.add_argument('--render-ms', type=float, default=1.)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--batch-size', type=int, default=16)
+    return parser.parse_args()
+
+
+def busy_wait(seconds):
+    end = time.thread_time() + seconds
+    while time.thread_time() < end:
+        pass
+
+
+class MockReader:
+
+    output_column = 'answer'
+
+    def __init__(self, num_samples):
+        self.dataset = {
+            'test': {
+                'answer': [f'answer {i}' for i in range(num_samples)]
+            }
+        }
+
+
+class MockRetriever:
+    """Zero-shot retriever rendering a long shared prefix per prompt."""
+
+    def __init__(self, args):
+        self.args = args
+        self.dataset_reader = MockReader(args.num_samples)
+
+    def retrieve(self):
+        return [[] for _ in range(self.args.num_samples)]
+
+    def generate_ice(self, ice_idx, ice_template=None):
+        return ''
+
+    def generate_prompt_for_generate_task(self, idx, ice, **kwargs):
+        busy_wait(self.args.render_ms / 1e3)
+        # a fresh copy per prompt, as the templates render them
+        prefix = ''.join(['tool list. '] * (self.args.prefix_chars // 11))
+        return PromptList([
+            dict(role='SYSTEM', prompt=prefix),
+            dict(role='HUMAN', prompt=f'question {idx}'),
+        ])
+
+
+class MockModel:
+
+    is_api = True
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.first_request = None
+        self._lock = threading.Lock()
+
+    def parse_template(self, prompt_template, mode):
+        if isinstance(prompt_template, PromptList):
+            return prompt_template
+        return [self.parse_template(p, mode) for p in prompt_template]
+
+    def get_token_len_from_template(self, templates, mode='ppl'):
+        if isinstance(templates, PromptList):
+            return sum(len(item['prompt']) for item in templates) // 4
+        return [self.get_token_len_from_template(t) for t in templates]
+
+    def generate(self, inputs, max_out_len):
+        with self._lock:
+            if self.first_request is None:
+                self.first_request = time.perf_counter()
+        time.sleep(self.latency)
+        return [f'reply to {prompt[-1]["prompt"]}' for prompt in inputs]
+
+    def generate_from_template(self, templates, max_out_len):
+        return self.generate(self.parse_template(templates, 'gen'),
+                             max_out_len)
+
+
+def run(args, lazy, work_dir):
+    model = MockModel(args.latency)
+    inferencer = GenInferencer(model,
+                               max_out_len=16,
+                               max_seq_len=args.prefix_chars,
+                               batch_size=args.batch_size,
+                               output_json_filepath=work_dir,
+                               output_json_filename=f'lazy_{lazy}.json',
+                               save_every=None,
+                               prefix_ordering=False,
+                               lazy_prompts=lazy)
+    tracemalloc.start()
+    start = time.perf_counter()
+    inferencer.inference(MockRetriever(args))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    with open(osp.join(work_dir, f'lazy_{lazy}.json'), 'rb') as f:
+        dump = f.read()
+    return model.first_request - start, elapsed, peak / 2**20, dump
+
+
+def main():
+    args = parse_args()
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, lazy in (('upfront', False), ('lazy', True)):
+            rows.append((name, ) + run(args, lazy, work_dir))
+    assert rows[0][-1] == rows[1][-1], 'the predictions differ'
+
+    print(f'{"prompts":>8} {"first request(s)":>17} {"wall(s)":>8} '
+          f'{"peak(MiB)":>10}')
+    for name, first, elapsed, peak, _ in rows:
+        print(f'{name:>8} {first:>17.2f} {elapsed:>8.2f} {peak:>10.1f}')
+    print('predictions are byte-identical')
+
+
+if __name__ == '__main__':
+    main()
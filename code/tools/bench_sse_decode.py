@@ -0,0 +1,147 @@
+"""Golden-output check and microbenchmark of the raw SSE decoding path.
+
+A synthetic reasoning stream (``--num-tokens`` deltas, most of them
+reasoning) is folded into a result twice: once through the OpenAI SDK chunk
+models as ``generate_stream`` does, and once through the ``raw_stream=True``
+decoder. Both results must be byte-identical, for every delta layout and
+reasoning mode below, before any timing is reported.
+
+Example:
+    python tools/bench_sse_decode.py --num-tokens 30000
+"""
+import argparse
+import json
+import os.path as osp
+import sys
+import time
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+
+from openai.types.chat import ChatCompletionChunk  # noqa: E402
+
+from opencompass.models import NonReasoningAPI, ReasoningAPI  # noqa: E402
+from opencompass.models.general_api import SSEDecoder  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='SSE decoding benchmark')
+    parser.add_argument('--num-tokens', type=int, default=30000)
+    parser.add_argument('--reasoning-ratio', type=float, default=0.9)
+    parser.add_argument('--repeat', type=int, default=3)
+    return parser.parse_args()
+
+
+def make_stream(num_tokens: int, reasoning_ratio: float,
+                reasoning_key: str) -> bytes:
+    """SSE body of a reasoning model answer, as a vLLM-like server sends."""
+
+    def event(delta):
+        chunk = {
+            'id': 'chatcmpl-bench',
+            'object': 'chat.completion.chunk',
+            'created': 0,
+            'model': 'bench',
+            'choices': [{
+                'index': 0,
+                'delta': delta,
+                'finish_reason': None
+            }],
+        }
+        return f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'
+
+    num_reasoning = int(num_tokens * reasoning_ratio)
+    events = [event({'role': 'assistant', 'content': ''})]
+    for i in range(num_tokens):
+        word = ['推理', ' step', '，', ' 42', '\n'][i % 5]
+        if i < num_reasoning:
+            events.append(event({'content': None, reasoning_key: word}))
+        else:
+            events.append(event({'content': word}))
+    usage_chunk = {
+        'id': 'chatcmpl-bench',
+        'object': 'chat.completion.chunk',
+        'created': 0,
+        'model': 'bench',
+        'choices': [],
+        'usage': {
+            'prompt_tokens': 100,
+            'completion_tokens': num_tokens,
+            'total_tokens': num_tokens + 100
+        }
+    }
+    events.append(f'data: {json.dumps(usage_chunk)}\n\n')
+    events.append('data: [DONE]\n\n')
+    return ''.join(events).encode('utf-8')
+
+
+def sdk_path(model, body: bytes):
+    state = model._new_stream_state()
+    for payload in iter_events(body):
+        if payload.startswith('[DONE]'):
+            break
+        chunk = ChatCompletionChunk.construct(**json.loads(payload))
+        model._consume_stream_chunk(state, chunk)
+    return model._finish_stream(state)
+
+
+def raw_path(model, body: bytes):
+    state = model._new_stream_state()
+    for payload in iter_events(body):
+        if model._consume_sse_event(state, payload):
+            break
+    return model._finish_stream(state)
+
+
+def iter_events(body: bytes):
+    decoder = SSEDecoder()
+    for line in body.decode('utf-8').split('\n'):
+        payload = decoder.feed(line)
+        if payload is not None:
+            yield payload
+
+
+def timed(func, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    args = parse_args()
+    kwargs = dict(path='bench',
+                  api_url='http://127.0.0.1:1/v1/chat/completions',
+                  api_headers={'Authorization': 'Bearer bench'})
+    models = {
+        'ReasoningAPI': ReasoningAPI(**kwargs),
+        'NonReasoningAPI': NonReasoningAPI(**kwargs)
+    }
+
+    print(f'{"model":>16} {"delta key":>18} {"sdk(s)":>8} {"raw(s)":>8} '
+          f'{"speedup":>8}')
+    for reasoning_key in ('reasoning', 'reasoning_content'):
+        body = make_stream(args.num_tokens, args.reasoning_ratio,
+                           reasoning_key)
+        for name, model in models.items():
+            expected, sdk_time = timed(sdk_path, model, body,
+                                       repeat=args.repeat)
+            actual, raw_time = timed(raw_path, model, body,
+                                     repeat=args.repeat)
+            for key in ('content', 'reasoning'):
+                assert (key in expected) == (key in actual), \
+                    f'{name}/{reasoning_key}: {key} presence differs'
+                if expected.get(key) is None:
+                    assert actual.get(key) is None
+                else:
+                    assert expected[key].encode('utf-8') == \
+                        actual[key].encode('utf-8'), \
+                        f'{name}/{reasoning_key}: {key} differs'
+            print(f'{name:>16} {reasoning_key:>18} {sdk_time:>8.3f} '
+                  f'{raw_time:>8.3f} {sdk_time / raw_time:>7.1f}x')
+    print('golden check passed: raw and SDK paths are byte-identical')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,657 @@
+"""A local OpenAI-compatible stub server for benchmarking API models.
+
+Besides chat completions (streaming or not, with ``reasoning`` or
+``reasoning_content`` deltas) it serves ``/generate`` for the LightLLM and
+FastChat-style wrappers, and the ``/files`` and ``/batches`` endpoints of the
+batch API, so that the offline ``batch_job`` mode can be tested end to end.
+
+The timing of every answer is either synthetic, i.e. a time to first token
+drawn from ``--latency`` followed by tokens at ``--tokens-per-s``, or
+replayed from the per-request records of a real run (``trace=dict(...)`` of
+the API models, or ``--record`` of this server). Errors (429, 5xx, hung
+requests) can be injected at given rates.
+
+Example:
+    python tools/mock_llm_server.py --port 8000 --latency lognormal:-1,0.5 \
+        --tokens-per-s 50 --reasoning-chars 400 --error 429=0.02 \
+        --error 503=0.01 --error timeout=0.005
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Union
+
+# characters per streamed token
+TOKEN_CHARS = 4
+
+
+class Distribution:
+    """A latency distribution parsed from ``kind:args``.
+
+    - ``0.2`` or ``const:0.2``: always 0.2 seconds;
+    - ``uniform:0.1,0.5``: uniform in [0.1, 0.5];
+    - ``exp:0.3``: exponential with mean 0.3;
+    - ``normal:0.3,0.05``: normal, clipped at 0;
+    - ``lognormal:-1,0.5``: log-normal with the given mu and sigma, a good
+      fit for heavy-tailed serving latencies.
+    """
+
+    KINDS = {
+        'const': lambda v: v,
+        'uniform': random.uniform,
+        'exp': lambda mean: random.expovariate(1 / mean),
+        'normal': random.gauss,
+        'lognormal': random.lognormvariate,
+    }
+
+    def __init__(self, spec: Union[str, float]):
+        if isinstance(spec, (int, float)):
+            spec = f'const:{spec}'
+        elif ':' not in spec:
+            spec = f'const:{spec}'
+        kind, _, args = spec.partition(':')
+        if kind not in self.KINDS:
+            raise ValueError(f'Unknown distribution {kind}, expected one of '
+                             f'{list(self.KINDS)}')
+        self.spec = spec
+        self._sample = self.KINDS[kind]
+        self.args = [float(x) for x in args.split(',')]
+
+    def sample(self) -> float:
+        return max(0., self._sample(*self.args))
+
+
+class Plan:
+    """How one request is answered: an error, or the time to first token,
+    the delay between tokens and the text."""
+
+    def __init__(self,
+                 error: Optional[str] = None,
+                 ttft: float = 0.,
+                 interval: float = 0.,
+                 content: str = '',
+                 reasoning: str = ''):
+        self.error = error
+        self.ttft = ttft
+        self.interval = interval
+        self.content = content
+        self.reasoning = reasoning
+
+    @property
+    def num_tokens(self) -> int:
+        return len(split_tokens(self.content)) + len(
+            split_tokens(self.reasoning))
+
+
+def split_tokens(text: str) -> List[str]:
+    return [text[i:i + TOKEN_CHARS] for i in range(0, len(text), TOKEN_CHARS)]
+
+
+def fit_text(text: str, num_chars: int) -> str:
+    """Repeat or cut ``text`` to ``num_chars`` characters."""
+    if not text or num_chars <= 0:
+        return ''
+    return (text * (num_chars // len(text) + 1))[:num_chars]
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.num_connections += 1
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+
+    def _read_json(self):
+        return json.loads(self._read_body() or b'{}')
+
+    def _read_form(self):
+        """Parse a multipart/form-data body into ``{name: bytes}``."""
+        head = f'Content-Type: {self.headers["Content-Type"]}\r\n\r\n'
+        message = BytesParser(policy=HTTP).parsebytes(
+            head.encode('latin-1') + self._read_body())
+        return {
+            part.get_param('name', header='content-disposition'):
+            part.get_payload(decode=True)
+            for part in message.iter_parts()
+        }
+
+    def _send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_bytes(self, body: bytes, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f'{len(data):X}\r\n'.encode('ascii') + data +
+                         b'\r\n')
+        self.wfile.flush()
+
+    def do_GET(self):
+        parts = self.path.rstrip('/').split('/')
+        server = self.server
+        if len(parts) >= 3 and parts[-3] == 'files' and \
+                parts[-1] == 'content' and parts[-2] in server.files:
+            self._send_bytes(server.files[parts[-2]][1])
+        elif len(parts) >= 2 and parts[-2] == 'batches' and \
+                parts[-1] in server.batches:
+            self._send_json(server.batches[parts[-1]])
+        else:
+            self._send_json({'error': f'unknown path {self.path}'}, 404)
+
+    def do_POST(self):
+        path = self.path.rstrip('/')
+        if path.endswith('/chat/completions'):
+            self._serve(self._chat_completions, self._read_json())
+        elif path.endswith('/generate'):
+            self._serve(self._generate, self._read_json())
+        elif path.endswith('/files'):
+            self._upload_file(self._read_form())
+        elif path.endswith('/batches'):
+            self._create_batch(self._read_json())
+        elif path.endswith('/cancel'):
+            batch = self.server.batches.get(path.split('/')[-2])
+            if batch is None:
+                self._send_json({'error': f'unknown path {self.path}'}, 404)
+            else:
+                batch['status'] = 'cancelled'
+                self._send_json(batch)
+        else:
+            self._send_json({'error': f'unknown path {self.path}'}, 404)
+
+    def _serve(self, answer, request):
+        server = self.server
+        with server.stats_lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight,
+                                       server.in_flight)
+            server.num_requests += 1
+        start = time.monotonic()
+        plan = server.plan()
+        ttft = None
+        try:
+            if plan.error is None:
+                ttft = answer(request, plan)
+            else:
+                self._send_error(plan.error)
+        finally:
+            with server.stats_lock:
+                server.in_flight -= 1
+                if plan.error is not None:
+                    server.num_errors += 1
+            server.record(request, plan, time.monotonic() - start, ttft)
+
+    def _send_error(self, error: str):
+        if error == 'timeout':
+            # hold the request until the client gives up
+            time.sleep(self.server.hang_time)
+            self.close_connection = True
+            return
+        status = int(error)
+        headers = {'Retry-After': '1'} if status == 429 else None
+        self._send_json(
+            {
+                'error': {
+                    'message': f'injected {status} error',
+                    'type': 'mock_error',
+                    'code': status
+                }
+            },
+            status=status,
+            headers=headers)
+
+    def _chat_completions(self, request, plan: Plan) -> float:
+        if request.get('stream'):
+            return self._stream_reply(request, plan)
+        time.sleep(plan.ttft + plan.interval * plan.num_tokens)
+        self._send_json(self.server.completion(request, plan))
+        return plan.ttft
+
+    def _generate(self, request, plan: Plan) -> float:
+        """Text generation endpoint. A request with ``prompt`` gets the
+        prompt echoed before the reply in ``text``, as the FastChat-style
+        server of :obj:`FreeAPI` does; otherwise the reply is returned in
+        ``generated_text`` as LightLLM does.
+
+        A list of prompts is decoded as one batch, with one output per
+        prompt; each one is null with probability ``batch_error_rate``."""
+        time.sleep(plan.ttft + plan.interval * plan.num_tokens)
+        if 'prompt' in request:
+            field, prompts = 'text', request['prompt']
+        else:
+            field, prompts = 'generated_text', request['inputs']
+        if not isinstance(prompts, list):
+            echo = prompts if field == 'text' else ''
+            self._send_json({field: [echo + plan.content]})
+            return plan.ttft
+        error_rate = self.server.batch_error_rate
+        self._send_json({
+            field: [
+                None if random.random() < error_rate else
+                (prompt if field == 'text' else '') + plan.content
+                for prompt in prompts
+            ]
+        })
+        return plan.ttft
+
+    def _stream_reply(self, request, plan: Plan) -> float:
+        server = self.server
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        cid = f'chatcmpl-{uuid.uuid4().hex}'
+
+        def send(delta, usage=None):
+            chunk = {
+                'id': cid,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': request.get('model', 'mock'),
+                'choices': [{
+                    'index': 0,
+                    'delta': delta,
+                    'finish_reason': None
+                }] if usage is None else [],
+            }
+            if usage is not None:
+                chunk['usage'] = usage
+            self._write_chunk(b'data: ' +
+                              json.dumps(chunk, ensure_ascii=False).encode(
+                                  'utf-8') + b'\n\n')
+
+        start = time.monotonic()
+        send({'role': 'assistant', 'content': ''})
+        time.sleep(plan.ttft)
+        deltas = [{
+            'content': None,
+            server.reasoning_key: piece
+        } for piece in split_tokens(plan.reasoning)]
+        deltas += [{
+            'content': piece
+        } for piece in split_tokens(plan.content)] or [{
+            'content': ''
+        }]
+        ttft = None
+        for i, delta in enumerate(deltas):
+            if i:
+                time.sleep(plan.interval)
+            send(delta)
+            if ttft is None:
+                ttft = time.monotonic() - start
+        if (request.get('stream_options') or {}).get('include_usage'):
+            send(None, usage=server.completion(request, plan)['usage'])
+        self._write_chunk(b'data: [DONE]\n\n')
+        self._write_chunk(b'')
+        return ttft
+
+    def _upload_file(self, form):
+        file_object = self.server.add_file(form['file'],
+                                           form['purpose'].decode())
+        self._send_json(file_object)
+
+    def _create_batch(self, request):
+        server = self.server
+        if request.get('input_file_id') not in server.files:
+            self._send_json({'error': 'unknown input_file_id'}, 400)
+            return
+        batch = {
+            'id': f'batch_{uuid.uuid4().hex}',
+            'object': 'batch',
+            'endpoint': request['endpoint'],
+            'input_file_id': request['input_file_id'],
+            'completion_window': request.get('completion_window', '24h'),
+            'status': 'validating',
+            'output_file_id': None,
+            'error_file_id': None,
+            'created_at': int(time.time()),
+            'request_counts': {
+                'total': 0,
+                'completed': 0,
+                'failed': 0
+            },
+        }
+        server.batches[batch['id']] = batch
+        threading.Thread(target=server.process_batch,
+                         args=(batch, ),
+                         daemon=True).start()
+        self._send_json(batch)
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """Threaded stub server of an OpenAI-compatible LLM endpoint.
+
+    Args:
+        host (str): Host to bind. Defaults to '127.0.0.1'.
+        port (int): Port to bind, 0 picks a free one. Defaults to 0.
+        latency (float or str): Time to first token in seconds, or a
+            :obj:`Distribution` spec. Defaults to 0.1.
+        reply (str): Text returned for every request.
+        tokens_per_s (float, optional): Decoding speed after the first
+            token. Defaults to None (all tokens at once).
+        reasoning (str): Reasoning text sent before the reply. Defaults to
+            '' (none).
+        reasoning_key (str): Field carrying the reasoning, 'reasoning' or
+            'reasoning_content'. Defaults to 'reasoning_content'.
+        error_rates (Dict[str, float], optional): Probability of answering
+            with an HTTP error (e.g. ``{'429': 0.02, '503': 0.01}``) or of
+            hanging for ``hang_time`` seconds (``'timeout'``). Defaults to
+            None.
+        hang_time (float): Seconds a 'timeout' request is held. Defaults to
+            600.
+        replay (str, optional): Trace file (JSON lines) of a real run, whose
+            successful records are replayed: time to first token, latency
+            and reply lengths are drawn from them. Defaults to None.
+        record (str, optional): Append the timing of every served request
+            to this file, in the format ``replay`` reads. Defaults to None.
+        batch_latency (float): Seconds a batch job takes. Defaults to 1.
+        batch_error_rate (float): Fraction of batch requests that fail,
+            in batch jobs and batched ``/generate`` calls. Defaults to 0.
+        seed (int, optional): Seed of the random choices. Defaults to None.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 latency: Union[float, str] = 0.1,
+                 reply: str = 'This is a mock answer.',
+                 tokens_per_s: Optional[float] = None,
+                 reasoning: str = '',
+                 reasoning_key: str = 'reasoning_content',
+                 error_rates: Optional[Dict[str, float]] = None,
+                 hang_time: float = 600.,
+                 replay: Optional[str] = None,
+                 record: Optional[str] = None,
+                 batch_latency: float = 1.,
+                 batch_error_rate: float = 0.,
+                 seed: Optional[int] = None):
+        super().__init__((host, port), MockLLMHandler)
+        if seed is not None:
+            random.seed(seed)
+        self.latency = Distribution(latency)
+        self.reply = reply
+        self.tokens_per_s = tokens_per_s
+        self.reasoning = reasoning
+        self.reasoning_key = reasoning_key
+        self.error_rates = error_rates or {}
+        self.hang_time = hang_time
+        self.replay_records = self._load_replay(replay) if replay else None
+        self._record_file = open(record, 'a') if record else None
+        self.stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.num_requests = 0
+        self.num_connections = 0
+        self.num_errors = 0
+        self.batch_latency = batch_latency
+        self.batch_error_rate = batch_error_rate
+        self.files = {}
+        self.batches = {}
+        self._thread = None
+
+    @staticmethod
+    def _load_replay(path: str) -> List[Dict]:
+        records = []
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get('status', 'ok') == 'ok' and 'latency' in record:
+                    records.append(record)
+        if not records:
+            raise ValueError(f'No successful request with a latency in '
+                             f'{path}')
+        return records
+
+    def plan(self) -> Plan:
+        """Decide how the next request is answered."""
+        draw = random.random()
+        for error, rate in self.error_rates.items():
+            if draw < rate:
+                return Plan(error=error)
+            draw -= rate
+
+        if self.replay_records is not None:
+            record = random.choice(self.replay_records)
+            content = fit_text(self.reply, record.get('content_chars', 0))
+            reasoning = fit_text(self.reasoning or self.reply,
+                                 record.get('reasoning_chars', 0))
+            plan = Plan(ttft=record.get('ttft', record['latency']),
+                        content=content,
+                        reasoning=reasoning)
+            if plan.num_tokens > 1:
+                plan.interval = max(0., record['latency'] -
+                                    plan.ttft) / (plan.num_tokens - 1)
+            return plan
+
+        plan = Plan(ttft=self.latency.sample(),
+                    content=self.reply,
+                    reasoning=self.reasoning)
+        if self.tokens_per_s:
+            plan.interval = 1 / self.tokens_per_s
+        return plan
+
+    def record(self, request: Dict, plan: Plan, latency: float,
+               ttft: Optional[float]):
+        if self._record_file is None:
+            return
+        record = {
+            'ts': round(time.time(), 3),
+            'stream': bool(request.get('stream')),
+            'latency': round(latency, 4),
+            'status': 'ok' if plan.error is None else 'error',
+        }
+        if plan.error is None:
+            record.update(content_chars=len(plan.content),
+                          reasoning_chars=len(plan.reasoning))
+            if ttft is not None:
+                record['ttft'] = round(ttft, 4)
+        else:
+            record['error'] = plan.error
+        with self.stats_lock:
+            self._record_file.write(json.dumps(record) + '\n')
+            self._record_file.flush()
+
+    def completion(self, request, plan: Optional[Plan] = None):
+        if plan is None:
+            plan = Plan(content=self.reply, reasoning=self.reasoning)
+        message = {'role': 'assistant', 'content': plan.content}
+        if plan.reasoning:
+            message[self.reasoning_key] = plan.reasoning
+        prompt_chars = sum(
+            len(m.get('content') or '') for m in request.get('messages', [])
+            if isinstance(m.get('content'), str))
+        completion_tokens = plan.num_tokens
+        prompt_tokens = prompt_chars // TOKEN_CHARS + 1
+        return {
+            'id': f'chatcmpl-{uuid.uuid4().hex}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'mock'),
+            'choices': [{
+                'index': 0,
+                'finish_reason': 'stop',
+                'message': message,
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens
+            },
+        }
+
+    def add_file(self, content: bytes, purpose: str):
+        file_object = {
+            'id': f'file-{uuid.uuid4().hex}',
+            'object': 'file',
+            'bytes': len(content),
+            'created_at': int(time.time()),
+            'filename': f'{purpose}.jsonl',
+            'purpose': purpose,
+            'status': 'processed',
+        }
+        self.files[file_object['id']] = (file_object, content)
+        return file_object
+
+    def process_batch(self, batch):
+        """Answer every line of a batch after ``batch_latency`` seconds,
+        failing a ``batch_error_rate`` fraction of them."""
+        lines = self.files[batch['input_file_id']][1].decode().splitlines()
+        requests = [json.loads(line) for line in lines if line.strip()]
+        batch['request_counts']['total'] = len(requests)
+        batch['status'] = 'in_progress'
+        time.sleep(self.batch_latency)
+        if batch['status'] == 'cancelled':
+            return
+        outputs, errors = [], []
+        for item in requests:
+            if random.random() < self.batch_error_rate:
+                errors.append({
+                    'id': f'batch_req_{uuid.uuid4().hex}',
+                    'custom_id': item['custom_id'],
+                    'response': {
+                        'status_code': 500,
+                        'body': {
+                            'error': {
+                                'message': 'injected error'
+                            }
+                        }
+                    },
+                    'error': None,
+                })
+            else:
+                outputs.append({
+                    'id': f'batch_req_{uuid.uuid4().hex}',
+                    'custom_id': item['custom_id'],
+                    'response': {
+                        'status_code': 200,
+                        'body': self.completion(item['body'])
+                    },
+                    'error': None,
+                })
+        for key, items in (('output_file_id', outputs),
+                           ('error_file_id', errors)):
+            if items:
+                content = ''.join(json.dumps(x) + '\n' for x in items)
+                batch[key] = self.add_file(content.encode(),
+                                           'batch_output')['id']
+        batch['request_counts'].update(completed=len(outputs),
+                                       failed=len(errors))
+        batch['status'] = 'completed'
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.max_in_flight = 0
+            self.num_requests = 0
+            self.num_connections = 0
+            self.num_errors = 0
+
+    def start(self) -> 'MockLLMServer':
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._record_file is not None:
+            self._record_file.close()
+
+
+def parse_error_rate(value: str):
+    error, _, rate = value.partition('=')
+    if error != 'timeout' and not error.isdigit():
+        raise argparse.ArgumentTypeError(
+            f'expected STATUS=RATE or timeout=RATE, got {value}')
+    return error, float(rate)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Mock LLM server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency',
+                        default='0.1',
+                        help='Time to first token, seconds or a '
+                        'distribution such as lognormal:-1,0.5')
+    parser.add_argument('--tokens-per-s', type=float, default=None)
+    parser.add_argument('--reply-chars',
+                        type=int,
+                        default=None,
+                        help='Length of the reply, repeating the default '
+                        'text')
+    parser.add_argument('--reasoning-chars', type=int, default=0)
+    parser.add_argument('--reasoning-key',
+                        choices=['reasoning', 'reasoning_content'],
+                        default='reasoning_content')
+    parser.add_argument('--error',
+                        type=parse_error_rate,
+                        action='append',
+                        default=[],
+                        help='Inject errors, e.g. 429=0.02, 503=0.01 or '
+                        'timeout=0.005. May be repeated.')
+    parser.add_argument('--hang-time', type=float, default=600.)
+    parser.add_argument('--replay', help='Trace file to replay timings from')
+    parser.add_argument('--record', help='File to record timings to')
+    parser.add_argument('--batch-latency', type=float, default=1.)
+    parser.add_argument('--batch-error-rate', type=float, default=0.)
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    reply = 'This is a mock answer.'
+    if args.reply_chars is not None:
+        reply = fit_text(reply + ' ', args.reply_chars)
+    server = MockLLMServer(args.host,
+                           args.port,
+                           latency=args.latency,
+                           reply=reply,
+                           tokens_per_s=args.tokens_per_s,
+                           reasoning=fit_text('Let me think. ',
+                                              args.reasoning_chars),
+                           reasoning_key=args.reasoning_key,
+                           error_rates=dict(args.error),
+                           hang_time=args.hang_time,
+                           replay=args.replay,
+                           record=args.record,
+                           batch_latency=args.batch_latency,
+                           batch_error_rate=args.batch_error_rate,
+                           seed=args.seed)
+    print(f'Mock LLM server listening on {server.base_url}')
+    server.serve_forever()
@@ -0,0 +1,89 @@
+"""Re-run the prediction postprocessing of a finished run offline.
+
+The raw ``prediction`` of every sample is kept in the prediction files, so
+the ``pred_postprocessor`` of the datasets can be changed and re-applied
+without redoing the inference. ``processed_pred`` is rewritten in place;
+run ``run.py -m eval -r`` afterwards to re-score (the eval task applies the
+postprocessor to the raw predictions itself).
+
+The models and datasets are read from the config dumped into the run, the
+latest one unless ``--config`` is given.
+
+Example:
+    python tools/postprocess_predictions.py outputs/default/20240101_000000
+"""
+import argparse
+import glob
+import json
+import os.path as osp
+import re
+import sys
+import time
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+
+from mmengine.config import Config  # noqa: E402
+
+from opencompass.openicl.icl_inferencer.icl_base_inferencer import (  # noqa
+    dump_results_dict, postprocess_results)
+from opencompass.utils import get_infer_output_path  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Re-apply the prediction postprocessors of a run')
+    parser.add_argument('work_dir', help='Timestamped work dir of the run')
+    parser.add_argument('--config',
+                        default=None,
+                        help='Config to take the datasets from, the latest '
+                        'one dumped into the work dir by default')
+    return parser.parse_args()
+
+
+def prediction_files(path: str):
+    """The prediction file of a dataset, or the files of its splits."""
+    if osp.exists(path):
+        return [path]
+    root, ext = osp.splitext(path)
+    pattern = re.compile(re.escape(root) + r'_\d+' + re.escape(ext) + '$')
+    return sorted(p for p in glob.glob(f'{glob.escape(root)}_*{ext}')
+                  if pattern.match(p))
+
+
+def main():
+    args = parse_args()
+    config = args.config
+    if config is None:
+        configs = sorted(glob.glob(osp.join(args.work_dir, 'configs',
+                                            '*.py')))
+        if not configs:
+            raise FileNotFoundError(
+                f'No config found in {args.work_dir}/configs')
+        config = configs[-1]
+    cfg = Config.fromfile(config, format_python_code=False)
+    datasets = []
+    for item in cfg.datasets:
+        # some configs nest the dataset lists
+        datasets.extend(item if isinstance(item, list) else [item])
+
+    pred_dir = osp.join(args.work_dir, 'predictions')
+    for model in cfg.models:
+        for dataset in datasets:
+            postprocessor_cfg = dataset.get('eval_cfg',
+                                            {}).get('pred_postprocessor')
+            if not postprocessor_cfg:
+                continue
+            for path in prediction_files(
+                    get_infer_output_path(model, dataset, pred_dir)):
+                with open(path, encoding='utf-8') as f:
+                    results = json.load(f)
+                start = time.perf_counter()
+                num_done = postprocess_results(results, postprocessor_cfg)
+                elapsed = time.perf_counter() - start
+                dump_results_dict(results, path)
+                print(f'{path}: {num_done} predictions postprocessed in '
+                      f'{elapsed:.2f}s')
+
+
+if __name__ == '__main__':
+    main()